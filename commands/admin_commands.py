@@ -1,3 +1,5 @@
+import asyncio
+import os
 from datetime import datetime, timedelta
 from telegram import (
     InlineKeyboardButton,
@@ -11,14 +13,24 @@ from lib.api_handler import get_google_oauth_login_url, get_user
 from lib.google_cal import get_calendar_events, get_readable_cal_event_str
 from utils.add_morning_flow import add_morning_flow
 from utils.add_night_flow import add_night_flow
-from utils.constants import CURRENT_DATETIME
+from utils.background_ops import cancel_background_op
+from utils.chat_data_janitor import touch_chat_data
+from utils.constants import (
+    CURRENT_DATETIME,
+    PROFILE_DEFAULT_SECONDS,
+    PROFILE_MAX_SECONDS,
+    PROFILE_SAMPLE_INTERVAL_SECONDS,
+)
 from utils.datetime_utils import get_current_till_day_end_datetimes
+from utils.google_quota import run_google_call
 from utils.job_queue import add_once_job
 from utils.logger_config import configure_logger
+from utils.profiler import format_collapsed_stacks, sample_stacks
+from utils.unknown_response import unknown_command
 from utils.update_cron_jobs import update_cron_jobs
 from utils.utils import send_message, send_on_error_message, update_chat_data_state
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -35,6 +47,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     context.chat_data["state"] = "start_command"
+    touch_chat_data(context.chat_data)
     # note that chat_id and user_id are the same for private chat
     context.chat_data["chat_id"] = str(update.message.chat_id)
 
@@ -99,6 +112,17 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @update_chat_data_state
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    chat_id = (context.chat_data or dict()).get("chat_id")
+    canceled_op = cancel_background_op(chat_id) if chat_id else None
+    if canceled_op is not None:
+        await send_message(
+            update,
+            context,
+            "Okay, I've stopped working on that!",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return ConversationHandler.END
+
     await send_message(
         update,
         context,
@@ -120,7 +144,8 @@ async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = get_user(user_id)
 
     time_min, time_max = get_current_till_day_end_datetimes()
-    events = get_calendar_events(
+    events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=time_min.isoformat(),
         timeMax=time_max.isoformat(),
@@ -151,7 +176,8 @@ async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = get_user(user_id)
 
     time_min, time_max = get_current_till_day_end_datetimes()
-    events = get_calendar_events(
+    events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=time_min.isoformat(),
         timeMax=time_max.isoformat(),
@@ -168,3 +194,45 @@ async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update_cron_jobs(context)
 
     return ConversationHandler.END
+
+
+@update_chat_data_state
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Developer only. Samples the bot's stacks for N seconds (/profile N) without
+    blocking other updates, then sends the collapsed stacks as a document.
+    """
+    DEVELOPER_CHAT_ID = os.getenv("DEVELOPER_CHAT_ID") or ""
+    if update.effective_chat is None or str(update.effective_chat.id) != DEVELOPER_CHAT_ID:
+        await unknown_command(update, context)
+        return
+
+    try:
+        duration = float(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        duration = PROFILE_DEFAULT_SECONDS
+    duration = min(max(duration, 1), PROFILE_MAX_SECONDS)
+
+    async def run_profile() -> None:
+        try:
+            stacks = await asyncio.to_thread(
+                sample_stacks, duration, PROFILE_SAMPLE_INTERVAL_SECONDS
+            )
+        except RuntimeError as e:
+            await context.bot.send_message(chat_id=DEVELOPER_CHAT_ID, text=str(e))
+            return
+
+        await context.bot.send_document(
+            chat_id=DEVELOPER_CHAT_ID,
+            document=format_collapsed_stacks(stacks).encode(),
+            filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.collapsed",
+            caption=f"{sum(stacks.values())} samples over {duration:g}s",
+        )
+
+    context.application.create_task(run_profile(), update=update)
+
+    await send_message(
+        update,
+        context,
+        f"Profiling for {duration:g}s...",
+    )
@@ -4,17 +4,21 @@ from telegram import (
     Update,
 )
 from telegram.ext import ContextTypes, ConversationHandler
+from handlers.flow_registry import register_callback, register_text_state
 from lib.api_handler import get_user
-from lib.google_cal import NovaEvent, add_calendar_item, get_calendar_events, get_google_cal_link, get_readable_cal_event_str
+from lib.google_cal import NovaEvent, get_calendar_events, get_google_cal_link, get_readable_cal_event_str, make_event_id, prefetch_calendar_events
+from lib.outbox import enqueue_calendar_item
 from utils.constants import NEW_YORK_TIMEZONE_INFO
-from utils.datetime_utils import get_day_start_end_datetimes, get_input_day_start_end_datetimes
+from utils.datetime_utils import get_day_start_end_datetimes, get_input_day_start_end_datetimes, get_mmdd_day_datetimes
+from utils.google_quota import run_google_call
+from utils.input_parsers import parse_hhmm, parse_mmdd, validate_end_after_start
 from utils.logger_config import configure_logger
 from utils.utils import send_message, send_on_error_message, update_chat_data_state
 from dotenv import load_dotenv
 from datetime import datetime
 
 load_dotenv()
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 @update_chat_data_state
@@ -33,6 +37,12 @@ async def event_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@register_text_state(
+    "event_title",
+    scratch_key="new_event",
+    field="title",
+    starts_flow=True,
+)
 @update_chat_data_state
 async def event_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -42,6 +52,12 @@ async def event_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@register_text_state(
+    "event_date",
+    scratch_key="new_event",
+    field="date",
+    parser=parse_mmdd,
+)
 @update_chat_data_state
 async def event_start_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -50,7 +66,23 @@ async def event_start_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "What time does this event start?\n\n(eg. 1930)",
     )
 
+    # Read the chosen day while the user answers, for the clash check in event_creation
+    if context.chat_data is not None and context.chat_data.get("chat_id"):
+        time_min, time_max = get_mmdd_day_datetimes(context.chat_data["new_event"]["date"])
+        prefetch_calendar_events(
+            telegram_user_id=context.chat_data["chat_id"],
+            time_min=time_min,
+            time_max=time_max,
+            k=250,
+        )
+
 
+@register_text_state(
+    "event_start_time",
+    scratch_key="new_event",
+    field="start_time",
+    parser=parse_hhmm,
+)
 @update_chat_data_state
 async def event_end_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -60,6 +92,13 @@ async def event_end_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@register_text_state(
+    "event_end_time",
+    scratch_key="new_event",
+    field="end_time",
+    parser=parse_hhmm,
+    validator=validate_end_after_start,
+)
 @update_chat_data_state
 async def event_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -77,38 +116,53 @@ async def event_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_on_error_message(context)
         return
 
-    start_time = datetime.strptime(
-        str(datetime.now(tz=NEW_YORK_TIMEZONE_INFO).year) + date + start_time_str,
-        "%Y%m%d%H%M",
+    start_time = NEW_YORK_TIMEZONE_INFO.localize(
+        datetime.strptime(
+            str(datetime.now(tz=NEW_YORK_TIMEZONE_INFO).year) + date + start_time_str,
+            "%Y%m%d%H%M",
+        )
     )
 
     # Convert to datetime object from date and end_time_str
-    end_time = datetime.strptime(
-        str(datetime.now(tz=NEW_YORK_TIMEZONE_INFO).year) + date + end_time_str,
-        "%Y%m%d%H%M",
+    end_time = NEW_YORK_TIMEZONE_INFO.localize(
+        datetime.strptime(
+            str(datetime.now(tz=NEW_YORK_TIMEZONE_INFO).year) + date + end_time_str,
+            "%Y%m%d%H%M",
+        )
     )
 
     user = get_user(context.chat_data["chat_id"])
     google_refresh_token = user.get("google_refresh_token", "") 
 
-    add_calendar_item(
-        refresh_token=google_refresh_token,
-        summary=title,
-        start_time=start_time,
-        end_time=end_time,
-        event_type=NovaEvent.EVENT,
-    )
-
     # check if this new event clashes with some other event
     time_min = start_time
     time_max = end_time
 
-    events_in_same_time_period = get_calendar_events(
+    events_in_same_time_period = await run_google_call(
+        get_calendar_events,
         refresh_token=google_refresh_token,
         timeMin=time_min.isoformat(),
         timeMax=time_max.isoformat(),
     )
 
+    # Checked before the event is queued, so the event never clashes with itself
+    await enqueue_calendar_item(
+        user_id=context.chat_data["chat_id"],
+        summary=title,
+        start_time=start_time,
+        end_time=end_time,
+        event_type=NovaEvent.EVENT,
+        # The update id tells a retry of this command from the same event created again later
+        event_id=make_event_id(
+            context.chat_data["chat_id"],
+            NovaEvent.EVENT.value,
+            title,
+            start_time,
+            end_time,
+            update.update_id,
+        ),
+    )
+
     if len(events_in_same_time_period) > 0:
         # Clash flow
         cal_url = get_google_cal_link(context.chat_data["chat_id"])
@@ -143,6 +197,7 @@ async def event_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@register_callback("event_creation_confirm")
 @update_chat_data_state
 async def event_command_end(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -205,6 +260,7 @@ async def event_command_end(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+@register_callback("event_creation_cancel")
 @update_chat_data_state
 async def event_command_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is not None:
@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, time, timedelta
 from dateutil.rrule import rrule, DAILY
 from typing import Dict, List, Optional
@@ -7,16 +8,28 @@ from telegram import (
     Update,
 )
 from telegram.ext import ContextTypes, ConversationHandler
+from handlers.flow_registry import register_callback, register_text_state
 from lib.api_handler import get_user
 from lib.google_cal import (
+    CalendarWriteMethod,
+    CalendarWriteOp,
     GoogleCalendarEventMinimum,
-    add_recurring_calendar_item,
+    batch_calendar_writes,
+    NovaEvent,
+    build_recurring_calendar_item,
     get_calendar_events,
     get_google_cal_link,
+    make_event_id,
     merge_events,
+    prefetch_calendar_events,
 )
+from lib.outbox import enqueue_recurring_calendar_item
+from utils.background_ops import ProgressCallback, start_background_op
+from utils.circuit_breaker import CircuitOpenError
 from utils.constants import DAY_END_TIME, DAY_START_TIME, NEW_YORK_TIMEZONE_INFO
 from utils.datetime_utils import get_closest_week, get_prettified_time_slots
+from utils.google_quota import run_google_call
+from utils.input_parsers import parse_minutes, parse_times_per_week
 from utils.logger_config import configure_logger
 from utils.update_cron_jobs import update_cron_jobs
 from utils.utils import (
@@ -25,7 +38,7 @@ from utils.utils import (
     update_chat_data_state,
 )
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 @update_chat_data_state
@@ -43,7 +56,23 @@ async def habit_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "That's the spirit! What's this habit you want to build?",
     )
 
+    # Read next week's calendar while the user answers, for habit_creation
+    if context.chat_data.get("chat_id"):
+        time_min, time_max = get_closest_week()
+        prefetch_calendar_events(
+            telegram_user_id=context.chat_data["chat_id"],
+            time_min=time_min,
+            time_max=time_max,
+            k=150,
+        )
+
 
+@register_text_state(
+    "habit_title",
+    scratch_key="new_habit",
+    field="title",
+    starts_flow=True,
+)
 @update_chat_data_state
 async def habit_repetition(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -53,6 +82,12 @@ async def habit_repetition(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@register_text_state(
+    "habit_repetition",
+    scratch_key="new_habit",
+    field="repetition",
+    parser=parse_times_per_week,
+)
 @update_chat_data_state
 async def habit_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -210,6 +245,12 @@ def find_time_slot(
     return best_slot_start.time() if best_slot_start else None
 
 
+@register_text_state(
+    "habit_duration",
+    scratch_key="new_habit",
+    field="duration",
+    parser=parse_minutes,
+)
 @update_chat_data_state
 async def habit_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -220,105 +261,159 @@ async def habit_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     title: str = context.chat_data["new_habit"]["title"] or ""
     repetition: str = context.chat_data["new_habit"]["repetition"] or ""
     duration: str = context.chat_data["new_habit"]["duration"] or ""
-
-    await send_message(
-        update,
-        context,
-        "Let's get started immediately.",
-    )
-
     user_id = context.chat_data["chat_id"]
-    user = get_user(user_id)
-    """
-    For habits we will pull the user's next week's events
-    (e.g. if today is tuesday, we pull from the coming Sunday to Nex Sat)
 
-    Then we will rank all the days by the amount of free time available,
-    using next week's schedule as a proxy for the user's typical schedule.
-    """
-    time_min, time_max = get_closest_week()
-    events = get_calendar_events(
-        refresh_token=user.get("google_refresh_token", ""),
-        timeMin=time_min.isoformat(),
-        timeMax=time_max.isoformat(),
-        k=150,
-    )
+    async def create_habit(progress: ProgressCallback) -> None:
+        await progress("Looking at your calendar for next week...")
+        user = await asyncio.to_thread(get_user, user_id)
+        """
+        For habits we will pull the user's next week's events
+        (e.g. if today is tuesday, we pull from the coming Sunday to Nex Sat)
+
+        Then we will rank all the days by the amount of free time available,
+        using next week's schedule as a proxy for the user's typical schedule.
+        """
+        time_min, time_max = get_closest_week()
+        events = await run_google_call(
+            get_calendar_events,
+            refresh_token=user.get("google_refresh_token", ""),
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+            k=150,
+        )
 
-    ranked_days = rank_days(
-        [
-            GoogleCalendarEventMinimum(
-                start=e.get("start"),
-                end=e.get("end"),
-                summary=e.get("summary"),
-            )
-            for e in events
-        ],
-        time_min,
-        time_max,
-    )
+        await progress("Finding the best days for " + title + "...")
+        ranked_days = rank_days(
+            [
+                GoogleCalendarEventMinimum(
+                    start=e.get("start"),
+                    end=e.get("end"),
+                    summary=e.get("summary"),
+                )
+                for e in events
+            ],
+            time_min,
+            time_max,
+        )
 
-    num_of_days = int(repetition)
-    if len(ranked_days) < num_of_days:
-        # Theoretically should never happen cause ranked days is always of length 7
-        num_of_days = len(ranked_days)
-    selected_days = ranked_days[:num_of_days]
-
-    datetime_slots = []
-    for day in selected_days:
-        events_on_day = [
-            GoogleCalendarEventMinimum(
-                start=e.get("start"),
-                end=e.get("end"),
-                summary=e.get("summary"),
+        num_of_days = int(repetition)
+        if len(ranked_days) < num_of_days:
+            # Theoretically should never happen cause ranked days is always of length 7
+            num_of_days = len(ranked_days)
+        selected_days = ranked_days[:num_of_days]
+
+        datetime_slots = []
+        for day in selected_days:
+            events_on_day = [
+                GoogleCalendarEventMinimum(
+                    start=e.get("start"),
+                    end=e.get("end"),
+                    summary=e.get("summary"),
+                )
+                for e in events
+                if (e.get("start").get("dateTime"))
+                and (
+                    datetime.fromisoformat(e.get("start").get("dateTime", "")).date()
+                    == day.date()
+                )
+            ]
+            time_slot = find_time_slot(events_on_day, duration)
+            # time_slot will only be None if there is no available timeslot
+            if time_slot:
+                datetime_slots.append(datetime.combine(day.date(), time_slot))
+            else:
+                logger.error("No available time slot found for habit creation")
+
+        await progress("Adding " + title + " to your calendar...")
+        summary = "Habit: " + title
+        rrules = ["RRULE:FREQ=WEEKLY;"]
+        # The update id tells a retry of this command from the same habit created again later
+        event_ids = [
+            make_event_id(user_id, NovaEvent.HABIT.value, title, datetime_slot, update.update_id)
+            for datetime_slot in datetime_slots
+        ]
+        try:
+            results = await run_google_call(
+                batch_calendar_writes,
+                refresh_token=user.get("google_refresh_token", ""),
+                ops=[
+                    CalendarWriteOp(
+                        method=CalendarWriteMethod.INSERT,
+                        body=build_recurring_calendar_item(
+                            summary=summary,
+                            start_time=datetime_slot,
+                            end_time=datetime_slot + timedelta(minutes=int(duration)),
+                            rrules=rrules,
+                            event_id=event_id,
+                        ),
+                    )
+                    for datetime_slot, event_id in zip(datetime_slots, event_ids)
+                ],
             )
-            for e in events
-            if (e.get("start").get("dateTime"))
-            and (
-                datetime.fromisoformat(e.get("start").get("dateTime", "")).date()
-                == day.date()
+        except CircuitOpenError:
+            # Google is down, so the outbox adds them once it is back
+            for datetime_slot, event_id in zip(datetime_slots, event_ids):
+                await enqueue_recurring_calendar_item(
+                    user_id=user_id,
+                    summary=summary,
+                    start_time=datetime_slot,
+                    end_time=datetime_slot + timedelta(minutes=int(duration)),
+                    rrules=rrules,
+                    event_id=event_id,
+                )
+            added_slots = datetime_slots
+            await progress(
+                "I can't reach Google Calendar right now, so I'll add "
+                + title
+                + " for "
+                + str(len(added_slots))
+                + " days this week as soon as it's back!"
             )
-        ]
-        time_slot = find_time_slot(events_on_day, duration)
-        # time_slot will only be None if there is no available timeslot
-        if time_slot:
-            datetime_slots.append(datetime.combine(day.date(), time_slot))
         else:
-            logger.error("No available time slot found for habit creation")
+            added_slots = [
+                datetime_slot
+                for datetime_slot, result in zip(datetime_slots, results)
+                if result.error is None
+            ]
+            if len(added_slots) < len(datetime_slots):
+                logger.error(
+                    "Added %d of %d habit slots for %s",
+                    len(added_slots),
+                    len(datetime_slots),
+                    title,
+                )
+
+            await progress(
+                "I have scheduled " + title + " for " + str(len(added_slots)) + " days this week!"
+            )
 
-    await send_message(
-        update,
-        context,
-        "I have scheduled " + title + " for " + repetition + " days this week!",
-    )
+        keyboard = [
+            [
+                InlineKeyboardButton("Looks Good!", callback_data="habit_creation_confirm"),
+            ],
+            [
+                InlineKeyboardButton("Edit", callback_data="habit_creation_edit"),
+            ],
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
-    for datetime_slot in datetime_slots:
-        summary = "Habit: " + title
-        add_recurring_calendar_item(
-            refresh_token=user.get("google_refresh_token", ""),
-            summary=summary,
-            start_time=datetime_slot,
-            end_time=datetime_slot + timedelta(minutes=int(duration)),
-            rrules=["RRULE:FREQ=WEEKLY;"],
+        await send_message(
+            update,
+            context,
+            get_prettified_time_slots(added_slots),
+            reply_markup=reply_markup,
         )
 
-    keyboard = [
-        [
-            InlineKeyboardButton("Looks Good!", callback_data="habit_creation_confirm"),
-        ],
-        [
-            InlineKeyboardButton("Edit", callback_data="habit_creation_edit"),
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await send_message(
+    await start_background_op(
         update,
         context,
-        get_prettified_time_slots(datetime_slots),
-        reply_markup=reply_markup,
+        "habit_creation",
+        create_habit,
+        "Let's get started immediately.",
     )
 
 
+@register_callback("habit_creation_edit")
 @update_chat_data_state
 async def habit_schedule_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -353,6 +448,7 @@ async def habit_schedule_edit(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
 
+@register_callback("habit_schedule_edit_yes")
 @update_chat_data_state
 async def habit_schedule_updated(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update_cron_jobs(context)
@@ -366,6 +462,7 @@ async def habit_schedule_updated(update: Update, context: ContextTypes.DEFAULT_T
     return ConversationHandler.END
 
 
+@register_callback("habit_creation_confirm")
 @update_chat_data_state
 async def habit_command_end(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is not None:
@@ -4,18 +4,24 @@ from telegram import (
     Update,
 )
 from telegram.ext import ContextTypes, ConversationHandler
-from lib.api_handler import add_tasks, get_user, mark_task_as_added
+from handlers.flow_registry import register_callback, register_text_state
+from lib.api_handler import add_tasks, get_user
 from lib.google_cal import (
     GoogleCalendarEventMinimum,
     NovaEvent,
-    add_calendar_item,
-    find_next_available_time_slot,
+    build_calendar_item,
     get_calendar_events,
     get_google_cal_link,
     get_readable_cal_event_str,
+    make_event_id,
+    prefetch_calendar_events,
 )
+from lib.outbox import OutboxKind, enqueue_calendar_item, enqueue_mutation
 from utils.datetime_utils import get_current_till_midnight_datetimes, is_within_a_week
+from utils.google_quota import run_google_call
+from utils.input_parsers import parse_minutes, parse_mmdd
 from utils.logger_config import configure_logger
+from utils.task_planner import TaskPlacement, find_task_time_slots, write_task_placements
 from dotenv import load_dotenv
 from utils.update_cron_jobs import update_cron_jobs
 from utils.utils import (
@@ -26,7 +32,7 @@ from utils.utils import (
 from datetime import datetime
 
 load_dotenv()
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 @update_chat_data_state
@@ -44,7 +50,23 @@ async def task_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Cool! What is this task on your mind?",
     )
 
+    # Read today's calendar while the user answers, for find_task_time_slots in task_creation
+    if context.chat_data.get("chat_id"):
+        time_min, time_max = get_current_till_midnight_datetimes()
+        prefetch_calendar_events(
+            telegram_user_id=context.chat_data["chat_id"],
+            time_min=time_min,
+            time_max=time_max,
+            k=500,
+        )
 
+
+@register_text_state(
+    "task_title",
+    scratch_key="new_task",
+    field="title",
+    starts_flow=True,
+)
 @update_chat_data_state
 async def task_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -54,6 +76,12 @@ async def task_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@register_text_state(
+    "task_deadline",
+    scratch_key="new_task",
+    field="deadline",
+    parser=parse_mmdd,
+)
 @update_chat_data_state
 async def task_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -63,6 +91,12 @@ async def task_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@register_text_state(
+    "task_duration",
+    scratch_key="new_task",
+    field="duration",
+    parser=parse_minutes,
+)
 @update_chat_data_state
 async def task_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -93,41 +127,46 @@ async def task_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = get_user(user_id)
         time_min, time_max = get_current_till_midnight_datetimes()
 
+        # One free slot, or enough free gaps to split the task across
         has_empty_slot = bool(
-            find_next_available_time_slot(
+            await run_google_call(
+                find_task_time_slots,
                 refresh_token=user.get("google_refresh_token", ""),
                 time_min=time_min,
                 time_max=time_max,
-                event_duration_minutes=duration_minutes,
+                duration_minutes=duration_minutes,
             )
         )
 
-        logger.info("has_empty_slot: " + str(has_empty_slot))
+        logger.info("has_empty_slot: %s", has_empty_slot)
 
         if has_empty_slot:
             await task_schedule_yes_update(update, context)
         else:
             await task_schedule_no_update(update, context)
 
-            await add_tasks(
-                {
-                    "userId": context.chat_data["chat_id"],
-                    "name": context.chat_data["new_task"]["title"] or "New Task",
-                    "duration": int(context.chat_data["new_task"]["duration"] or "0"),
-                    "deadline": context.chat_data["new_task"]["deadline"] or "",
-                }
-            )
+            await enqueue_new_task(update, context)
     else:
         await task_schedule_no_update(update, context)
 
-        await add_tasks(
-            {
+        await enqueue_new_task(update, context)
+
+
+async def enqueue_new_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Add the task to the user's list in the background, the user doesn't wait for it."""
+    await enqueue_mutation(
+        OutboxKind.ADD_TASK,
+        context.chat_data["chat_id"],
+        {
+            "task": {
                 "userId": context.chat_data["chat_id"],
                 "name": context.chat_data["new_task"]["title"] or "New Task",
                 "duration": int(context.chat_data["new_task"]["duration"] or "0"),
                 "deadline": context.chat_data["new_task"]["deadline"] or "",
             }
-        )
+        },
+        idempotency_key=f"add_task:{update.update_id}",
+    )
 
 
 async def task_schedule_yes_update(update, context):
@@ -144,20 +183,19 @@ async def task_schedule_yes_update(update, context):
     deadline: str = context.chat_data["new_task"]["deadline"] or ""
     duration: str = context.chat_data["new_task"]["duration"] or "0"
     duration_minutes = int(duration)
-    time_slot = find_next_available_time_slot(
+    time_slots = await run_google_call(
+        find_task_time_slots,
         refresh_token=user.get("google_refresh_token", ""),
         time_min=time_min,
         time_max=time_max,
-        event_duration_minutes=duration_minutes,
+        duration_minutes=duration_minutes,
     )
 
-    if time_slot is None:
-        logger.error("time_slot is None for task_schedule_yes_update")
+    if not time_slots:
+        logger.error("time_slots is empty for task_schedule_yes_update")
         await send_on_error_message(context)
         return
 
-    start_time, end_time = time_slot
-
     response = await add_tasks(
         {
             "userId": user_id,
@@ -167,28 +205,69 @@ async def task_schedule_yes_update(update, context):
         }
     )
 
-    add_calendar_item(
-        refresh_token=user.get("google_refresh_token", ""),
-        summary=title,
-        start_time=start_time,
-        end_time=end_time,
-        event_type=NovaEvent.TASK,
-        extra_details_dict={
-            "task_id": response["data"][0]["id"],
+    # The task id is needed for the calendar item, so only the task is added inline
+    task_id = response["data"][0]["id"]
+    if len(time_slots) == 1:
+        start_time, end_time = time_slots[0]
+        extra_details_dict = {
+            "task_id": task_id,
             "deadline": context.chat_data["new_task"]["deadline"] or "",
-        },
+        }
+        event_id = make_event_id(user_id, NovaEvent.TASK.value, task_id, start_time, end_time)
+        await enqueue_calendar_item(
+            user_id=user_id,
+            summary=title,
+            start_time=start_time,
+            end_time=end_time,
+            event_type=NovaEvent.TASK,
+            extra_details_dict=extra_details_dict,
+            event_id=event_id,
+        )
+        # The calendar item may not be written yet, so it is shown from what was queued.
+        # With the same id as the queued item it isn't shown twice once it is written.
+        task_items = [
+            build_calendar_item(
+                summary=title,
+                start_time=start_time,
+                end_time=end_time,
+                event_type=NovaEvent.TASK,
+                extra_details_dict=extra_details_dict,
+                event_id=event_id,
+            )
+        ]
+    else:
+        # Split across several free gaps, all chunks are written in one batch and
+        # any that fail are queued, like the single slot
+        task = {"id": task_id, "name": title, "duration": duration_minutes, "deadline": deadline}
+        task_items = await run_google_call(
+            write_task_placements,
+            user_id=user_id,
+            refresh_token=user.get("google_refresh_token", ""),
+            placements=[
+                TaskPlacement(task, start_time, end_time, chunk_index, len(time_slots))
+                for chunk_index, (start_time, end_time) in enumerate(time_slots)
+            ],
+        )
+
+    # mark as added, which the outbox sends after the calendar items
+    await enqueue_mutation(
+        OutboxKind.MARK_TASK_AS_ADDED,
+        user_id,
+        {"task_id": task_id},
+        idempotency_key=f"mark_task_as_added:{task_id}:{task_items[0]['id']}",
     )
-    
-    # mark as added
-    mark_task_as_added(response["data"][0]["id"])
 
-    events = get_calendar_events(
+    events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=time_min.isoformat(),
         timeMax=time_max.isoformat(),
         k=150,
     )
-    
+    # Chunks written by the batch may already be among the events
+    event_ids = {event.get("id") for event in events}
+    events = events + [item for item in task_items if item.get("id") not in event_ids]
+
     cal_schedule_events_str = get_readable_cal_event_str(events)
 
     keyboard = [
@@ -201,10 +280,15 @@ async def task_schedule_yes_update(update, context):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
+    split_note = (
+        f"It didn't fit in one go, so I split it into {len(time_slots)} blocks.\n\n"
+        if len(time_slots) > 1
+        else ""
+    )
     await send_message(
         update,
         context,
-        "Here's your updated schedule: \n\n" + cal_schedule_events_str,
+        split_note + "Here's your updated schedule: \n\n" + cal_schedule_events_str,
         reply_markup=reply_markup,
     )
 
@@ -231,6 +315,7 @@ async def task_schedule_no_update(update: Update, context: ContextTypes.DEFAULT_
     )
 
 
+@register_callback("task_creation_edit")
 @update_chat_data_state
 async def task_schedule_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -262,6 +347,7 @@ async def task_schedule_edit(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+@register_callback("task_creation_confirm", "task_schedule_edit_yes")
 @update_chat_data_state
 async def task_command_end(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -7,25 +7,30 @@ from telegram import (
 )
 from telegram.ext import ContextTypes, ConversationHandler
 from flows.night_flow import night_flow_review
-from lib.api_handler import get_user, mark_task_as_not_added
+from handlers.flow_registry import register_callback, register_text_state
+from lib.api_handler import get_user
 from lib.google_cal import (
     GoogleCalendarEventMinimum,
     NovaEvent,
-    add_calendar_item,
     get_block_properties,
     get_calendar_events,
     get_google_cal_link,
     get_readable_cal_event_str,
+    make_event_id,
     merge_events,
 )
+from lib.outbox import OutboxKind, enqueue_calendar_item, enqueue_mutation
 from utils.constants import DAY_END_TIME, NEW_YORK_TIMEZONE_INFO
 from utils.datetime_utils import (
     get_current_till_day_end_datetimes,
     get_day_start_end_datetimes,
 )
 from utils.get_name_time_from_job_name import get_name_time_from_job_name
+from utils.google_quota import run_google_call
 from utils.job_queue import add_once_job
+from utils.input_parsers import parse_minutes
 from utils.logger_config import configure_logger
+from utils.schedule_card import edit_schedule_card, use_callback_message_as_card
 from utils.update_cron_jobs import update_cron_jobs
 from utils.utils import (
     send_message,
@@ -34,7 +39,7 @@ from utils.utils import (
     update_chat_data_state_context,
 )
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 @update_chat_data_state_context
@@ -79,6 +84,25 @@ async def block_start_alert(context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+async def get_alerted_block_name(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> Optional[str]:
+    """
+    The block the last alert was about, or None after telling the user the alert expired.
+    chat_data["job"] is dropped once the flow is abandoned (see chat_data_janitor).
+    """
+    job = context.chat_data.get("job")
+    if not job:
+        await send_message(
+            update,
+            context,
+            "This alert has expired, I'll check in again at your next block!",
+        )
+        return None
+    return job["name"]
+
+
+@register_callback("block_start_alert_confirm")
 @update_chat_data_state
 async def block_start_alert_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -86,12 +110,15 @@ async def block_start_alert_confirm(update: Update, context: ContextTypes.DEFAUL
         await send_on_error_message(context)
         return
 
-    name = context.chat_data["job"]["name"]
+    name = await get_alerted_block_name(update, context)
+    if name is None:
+        return
 
     # get block end time
     user_id = context.chat_data["chat_id"]
     user = get_user(user_id)
-    events = get_calendar_events(
+    events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""), q=name, k=1
     )
     if len(events) != 1:
@@ -127,6 +154,7 @@ async def block_start_alert_confirm(update: Update, context: ContextTypes.DEFAUL
     return ConversationHandler.END
 
 
+@register_callback("block_flow_schedule_edit", "block_update_no")
 @update_chat_data_state
 async def block_flow_schedule_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -150,14 +178,17 @@ async def block_flow_schedule_edit(update: Update, context: ContextTypes.DEFAULT
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await send_message(
+    # The prompt goes on the alert that was tapped, not on the morning's schedule card
+    use_callback_message_as_card(update, context)
+    await edit_schedule_card(
         update,
         context,
-        "Have you edited?",
         reply_markup=reply_markup,
+        footer="Have you edited?",
     )
 
 
+@register_callback("block_flow_schedule_edit_yes", "block_update_yes")
 @update_chat_data_state
 async def block_flow_schedule_updated(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -170,7 +201,8 @@ async def block_flow_schedule_updated(
     user_id = context.chat_data["chat_id"]
     user = get_user(user_id)
     timeMin, timeMax = get_current_till_day_end_datetimes()
-    events = get_calendar_events(
+    events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=timeMin.isoformat(),
         timeMax=timeMax.isoformat(),
@@ -180,7 +212,8 @@ async def block_flow_schedule_updated(
 
     await update_cron_jobs(context)
 
-    await send_message(
+    use_callback_message_as_card(update, context)
+    await edit_schedule_card(
         update,
         context,
         "Updated your schedule!\n\n" + schedule,
@@ -189,6 +222,7 @@ async def block_flow_schedule_updated(
     await block_next_alert(update, context)
 
 
+@register_callback("block_end_alert_yes")
 @update_chat_data_state
 async def block_next_alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -199,7 +233,8 @@ async def block_next_alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = context.chat_data["chat_id"]
     user = get_user(user_id)
     timeMin, timeMax = get_current_till_day_end_datetimes()
-    events = get_calendar_events(
+    events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=timeMin.isoformat(),
         timeMax=timeMax.isoformat(),
@@ -267,6 +302,7 @@ async def block_end_alert(context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+@register_callback("block_end_alert_no")
 @update_chat_data_state
 async def block_end_alert_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -322,6 +358,13 @@ def find_today_next_available_slot(
     return None
 
 
+@register_text_state(
+    "block_end_alert_edit",
+    scratch_key="new_block",
+    field="duration",
+    starts_flow=True,
+    parser=parse_minutes,
+)
 @update_chat_data_state
 async def block_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -329,13 +372,16 @@ async def block_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_on_error_message(context)
         return
 
-    name = context.chat_data["job"]["name"]
+    name = await get_alerted_block_name(update, context)
+    if name is None:
+        return
     duration = context.chat_data["new_block"]["duration"]
 
     user_id = context.chat_data["chat_id"]
     user = get_user(user_id)
     timeMin, timeMax = get_current_till_day_end_datetimes()
-    events_full = get_calendar_events(
+    events_full = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=timeMin.isoformat(),
         timeMax=timeMax.isoformat(),
@@ -354,7 +400,8 @@ async def block_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if today_next_available_slot is None:
         # Get block details from Google Calendar
-        events = get_calendar_events(
+        events = await run_google_call(
+            get_calendar_events,
             refresh_token=user.get("google_refresh_token", ""), q=name, k=1
         )
         if len(events) != 1:
@@ -369,7 +416,12 @@ async def block_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
           task_id = int(block_props.get("task_id", "0"))
           deadline: str = block_props.get("deadline", "")
 
-          mark_task_as_not_added(task_id=task_id)
+          await enqueue_mutation(
+              OutboxKind.MARK_TASK_AS_NOT_ADDED,
+              user_id,
+              {"task_id": task_id},
+              idempotency_key=f"mark_task_as_not_added:{task_id}:{update.update_id}",
+          )
             
         return
 
@@ -390,14 +442,13 @@ async def block_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.chat_data["new_block"]["start_time"] = start_time.isoformat()
     context.chat_data["new_block"]["end_time"] = end_time.isoformat()
 
-    user_id = context.chat_data["chat_id"]
-    user = get_user(user_id)
-    add_calendar_item(
-        refresh_token=user.get("google_refresh_token", ""),
+    await enqueue_calendar_item(
+        user_id=user_id,
         summary=name,
         start_time=start_time,
         end_time=end_time,
         event_type=NovaEvent.EVENT,
+        event_id=make_event_id(user_id, "block", name, start_time, end_time, update.update_id),
     )
 
     keyboard = [
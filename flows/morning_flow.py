@@ -1,9 +1,11 @@
+import asyncio
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     Update,
 )
 from telegram.ext import ContextTypes, ConversationHandler
+from handlers.flow_registry import register_callback
 from lib.api_handler import get_user
 from lib.google_cal import (
     get_calendar_events,
@@ -11,7 +13,9 @@ from lib.google_cal import (
     get_readable_cal_event_str,
 )
 from utils.datetime_utils import get_day_start_end_datetimes
+from utils.google_quota import run_google_call
 from utils.logger_config import configure_logger
+from utils.schedule_card import edit_schedule_card, send_schedule_card
 from utils.update_cron_jobs import update_cron_jobs
 from utils.utils import (
     send_message,
@@ -20,7 +24,20 @@ from utils.utils import (
     update_chat_data_state_context,
 )
 
-logger = configure_logger()
+logger = configure_logger(__name__)
+
+
+async def get_today_schedule(user_id: str) -> str:
+    user = await asyncio.to_thread(get_user, user_id)
+    timeMin, timeMax = get_day_start_end_datetimes()
+    events = await run_google_call(
+        get_calendar_events,
+        refresh_token=user.get("google_refresh_token", ""),
+        timeMin=timeMin.isoformat(),
+        timeMax=timeMax.isoformat(),
+        k=150,
+    )
+    return get_readable_cal_event_str(events) or "No upcoming events found."
 
 
 @update_chat_data_state_context
@@ -38,16 +55,7 @@ async def morning_flow(context: ContextTypes.DEFAULT_TYPE) -> None:
 
     await send_message(None, context, "Good morning! Here's how your day looks like:")
 
-    user_id = context.chat_data["chat_id"]
-    user = get_user(user_id)
-    timeMin, timeMax = get_day_start_end_datetimes()
-    events = get_calendar_events(
-        refresh_token=user.get("google_refresh_token", ""),
-        timeMin=timeMin.isoformat(),
-        timeMax=timeMax.isoformat(),
-        k=150,
-    )
-    schedule = get_readable_cal_event_str(events) or "No upcoming events found."
+    schedule = await get_today_schedule(context.chat_data["chat_id"])
 
     keyboard = [
         [
@@ -62,9 +70,10 @@ async def morning_flow(context: ContextTypes.DEFAULT_TYPE) -> None:
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await send_message(None, context, schedule, reply_markup=reply_markup)
+    await send_schedule_card(None, context, schedule, reply_markup=reply_markup)
 
 
+@register_callback("morning_flow_edit")
 @update_chat_data_state
 async def morning_flow_schedule_edit(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -93,29 +102,33 @@ async def morning_flow_schedule_edit(
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await send_message(
+    await edit_schedule_card(
         update,
         context,
-        "Have you edited your calendar?",
         reply_markup=reply_markup,
+        footer="Have you edited your calendar?",
     )
 
 
+@register_callback("morning_flow_schedule_edit_yes")
 @update_chat_data_state
 async def morning_flow_schedule_updated(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
+    if context.chat_data is None:
+        logger.error("context.chat_data is None for event_creation")
+        await send_on_error_message(context)
+        return
+
     await update_cron_jobs(context)
 
-    await send_message(
-        update,
-        context,
-        "Great!",
-    )
+    schedule = await get_today_schedule(context.chat_data["chat_id"])
+    await edit_schedule_card(update, context, schedule, footer="Great!")
 
     return ConversationHandler.END
 
 
+@register_callback("morning_flow_confirm")
 @update_chat_data_state
 async def morning_flow_end(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update_cron_jobs(context)
@@ -4,7 +4,8 @@ from telegram import (
     Update,
 )
 from telegram.ext import ContextTypes, ConversationHandler
-from lib.api_handler import get_user, plan_tasks
+from handlers.flow_registry import register_callback, register_text_state
+from lib.api_handler import get_user
 from lib.google_cal import (
     get_calendar_events,
     get_google_cal_link,
@@ -14,14 +15,17 @@ from utils.datetime_utils import (
     get_day_start_end_datetimes,
     get_tomorrow_start_end_datetimes,
 )
+from utils.google_quota import run_google_call
 from utils.logger_config import configure_logger
+from utils.schedule_card import edit_schedule_card, send_schedule_card
+from utils.task_planner import schedule_task_backlog
 from utils.utils import (
     send_message,
     send_on_error_message,
     update_chat_data_state,
 )
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 @update_chat_data_state
@@ -44,6 +48,7 @@ async def night_flow_review(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+@register_callback("night_flow_review_yes")
 @update_chat_data_state
 async def night_flow_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.chat_data is None:
@@ -54,7 +59,8 @@ async def night_flow_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = context.chat_data["chat_id"]
     user = get_user(user_id)
     timeMin, timeMax = get_day_start_end_datetimes()
-    events = get_calendar_events(
+    events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=timeMin.isoformat(),
         timeMax=timeMax.isoformat(),
@@ -80,6 +86,12 @@ async def night_flow_feeling(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+@register_text_state(
+    "night_flow_feeling",
+    scratch_key="night_flow_review",
+    field="feeling",
+    starts_flow=True,
+)
 @update_chat_data_state
 async def night_flow_favourite(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -89,6 +101,11 @@ async def night_flow_favourite(update: Update, context: ContextTypes.DEFAULT_TYP
     )
 
 
+@register_text_state(
+    "night_flow_favourite",
+    scratch_key="night_flow_review",
+    field="favourite",
+)
 @update_chat_data_state
 async def night_flow_proud(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -98,6 +115,11 @@ async def night_flow_proud(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@register_text_state(
+    "night_flow_proud",
+    scratch_key="night_flow_review",
+    field="proud",
+)
 @update_chat_data_state
 async def night_flow_improve(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -107,6 +129,11 @@ async def night_flow_improve(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+@register_text_state(
+    "night_flow_improve",
+    scratch_key="night_flow_review",
+    field="improve",
+)
 @update_chat_data_state
 async def night_flow_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(
@@ -116,6 +143,11 @@ async def night_flow_comment(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+@register_text_state(
+    "night_flow_comment",
+    scratch_key="night_flow_review",
+    field="comment",
+)
 @update_chat_data_state
 async def night_flow_review_complete(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -154,6 +186,7 @@ async def night_flow_review_complete(
     await night_flow_tomorrow_schedule(update, context)
 
 
+@register_callback("night_flow_review_skip")
 @update_chat_data_state
 async def night_flow_tomorrow_schedule(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -162,26 +195,41 @@ async def night_flow_tomorrow_schedule(
         logger.error("context.chat_data is None for event_creation")
         await send_on_error_message(context)
         return
-    
-    await plan_tasks(context.chat_data["chat_id"])
-
-    await send_message(
-        update,
-        context,
-        "Here's your schedule for tomorrow!",
-    )
 
     user_id = context.chat_data["chat_id"]
     user = get_user(user_id)
     timeMin, timeMax = get_tomorrow_start_end_datetimes()
-    tomorrow_events = get_calendar_events(
+    tomorrow_events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=timeMin.isoformat(),
         timeMax=timeMax.isoformat(),
         k=150,
     )
+    # The backlog goes into tomorrow's free time, so the events don't need reading again
+    try:
+        planned_items = await run_google_call(
+            schedule_task_backlog,
+            user_id=user_id,
+            refresh_token=user.get("google_refresh_token", ""),
+            events=tomorrow_events,
+            window_start=timeMin,
+            window_end=timeMax,
+        )
+    except Exception:
+        # Tomorrow's events are still worth showing without the backlog
+        logger.exception("Could not plan the task backlog for tomorrow")
+        planned_items = []
+
+    await send_message(
+        update,
+        context,
+        "Here's your schedule for tomorrow!",
+    )
+
     tomorrow_schedule = (
-        get_readable_cal_event_str(tomorrow_events) or "No upcoming events found."
+        get_readable_cal_event_str(tomorrow_events + planned_items)
+        or "No upcoming events found."
     )
 
     keyboard = [
@@ -199,7 +247,7 @@ async def night_flow_tomorrow_schedule(
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await send_message(
+    await send_schedule_card(
         update,
         context,
         tomorrow_schedule,
@@ -207,6 +255,7 @@ async def night_flow_tomorrow_schedule(
     )
 
 
+@register_callback("night_flow_tomorrow_schedule_confirm")
 @update_chat_data_state
 async def night_flow_tomorrow_schedule_complete(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -226,6 +275,7 @@ async def night_flow_tomorrow_schedule_complete(
     await night_flow_end(update, context)
 
 
+@register_callback("night_flow_tomorrow_schedule_edit")
 @update_chat_data_state
 async def night_flow_tomorrow_schedule_edit(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -253,14 +303,15 @@ async def night_flow_tomorrow_schedule_edit(
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await send_message(
+    await edit_schedule_card(
         update,
         context,
-        "Have you edited?",
         reply_markup=reply_markup,
+        footer="Have you edited?",
     )
 
 
+@register_callback("night_flow_tomorrow_schedule_edit_yes")
 @update_chat_data_state
 async def night_flow_tomorrow_schedule_updated(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -273,7 +324,8 @@ async def night_flow_tomorrow_schedule_updated(
     user_id = context.chat_data["chat_id"]
     user = get_user(user_id)
     timeMin, timeMax = get_tomorrow_start_end_datetimes()
-    tomorrow_events = get_calendar_events(
+    tomorrow_events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=timeMin.isoformat(),
         timeMax=timeMax.isoformat(),
@@ -283,7 +335,7 @@ async def night_flow_tomorrow_schedule_updated(
         get_readable_cal_event_str(tomorrow_events) or "No upcoming events found."
     )
 
-    await send_message(
+    await edit_schedule_card(
         update,
         context,
         "This is how your day tomorrow will look like then!\n\n" + tomorrow_schedule,
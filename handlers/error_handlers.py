@@ -1,15 +1,22 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.constants import ParseMode
+from telegram.constants import MessageLimit, ParseMode
 from telegram.ext import ContextTypes
+from typing import Any, Dict, Optional
 import os
+import hashlib
 import html
 import json
+import time
 import traceback
 from lib.api_handler import get_google_oauth_login_url
+from utils.constants import ERROR_ALERT_WINDOW_SECONDS
 from utils.logger_config import configure_logger
 from utils.utils import send_message
 
-logger = configure_logger()
+logger = configure_logger(__name__)
+
+# fingerprint -> occurrences of that error in its current alert window
+_error_alerts: Dict[str, Dict[str, Any]] = dict()
 
 
 async def error_handler(update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -58,21 +65,136 @@ async def error_handler(update, context: ContextTypes.DEFAULT_TYPE) -> None:
     else:
         tb_string = "No traceback available"
 
+    fingerprint = get_error_fingerprint(context.error)
+    error_alert = _error_alerts.get(fingerprint)
+    if (
+        error_alert is not None
+        and time.time() - error_alert["first_seen"] < ERROR_ALERT_WINDOW_SECONDS
+    ):
+        # Already alerted in this window, the summary at the end of it will include this one
+        error_alert["count"] += 1
+        return
+
+    _error_alerts[fingerprint] = {
+        "count": 1,
+        "description": get_error_description(context.error),
+        "first_seen": time.time(),
+    }
+    if context.job_queue is not None:
+        context.job_queue.run_once(
+            send_error_summary,
+            ERROR_ALERT_WINDOW_SECONDS,
+            data=fingerprint,
+            name=f"error_summary_{fingerprint}",
+        )
+
     # Build the message with some markup and additional information about what happened.
-    # You might need to add some logic to deal with messages longer than the 4096 character limit.
+    # Everything that doesn't fit in a message is attached as a document instead.
     update_str = update.to_dict() if isinstance(update, Update) else str(update)
-    message = (
-        "An exception was raised while handling an update\n"
-        f"<pre>update = {html.escape(json.dumps(update_str, indent=2, ensure_ascii=False))}"
-        "</pre>\n\n"
-        f"<pre>context.chat_data = {html.escape(str(context.chat_data))}</pre>\n\n"
-        f"<pre>context.user_data = {html.escape(str(context.user_data))}</pre>\n\n"
-        f"<pre>{html.escape(tb_string)}</pre>"
+    details = (
+        f"update = {json.dumps(update_str, indent=2, ensure_ascii=False)}\n\n"
+        f"context.chat_data = {str(context.chat_data)}\n\n"
+        f"context.user_data = {str(context.user_data)}\n\n"
+        f"{tb_string}"
     )
+    header = get_alert_header(_error_alerts[fingerprint]["description"], fingerprint)
+    message = header + f"<pre>{html.escape(details)}</pre>"
 
     DEVELOPER_CHAT_ID = os.getenv("DEVELOPER_CHAT_ID") or ""
 
     # Finally, send the message
+    if len(message) <= MessageLimit.MAX_TEXT_LENGTH:
+        await context.bot.send_message(
+            chat_id=DEVELOPER_CHAT_ID, text=message, parse_mode=ParseMode.HTML
+        )
+    else:
+        await context.bot.send_document(
+            chat_id=DEVELOPER_CHAT_ID,
+            document=details.encode(),
+            filename=f"error_{fingerprint}.txt",
+            caption=get_alert_header(
+                _error_alerts[fingerprint]["description"],
+                fingerprint,
+                limit=MessageLimit.CAPTION_LENGTH,
+            ),
+            parse_mode=ParseMode.HTML,
+        )
+
+
+def get_alert_header(description: str, fingerprint: str, limit: Optional[int] = None) -> str:
+    """
+    The HTML header of an error alert. With a limit, the description is shortened
+    before it is escaped, so that cutting the header never splits a tag or entity.
+    """
+
+    def render(text: str) -> str:
+        return (
+            "An exception was raised while handling an update\n"
+            f"<b>{html.escape(text)}</b>\n"
+            f"fingerprint: <code>{fingerprint}</code>\n"
+            f"Further occurrences in the next {int(ERROR_ALERT_WINDOW_SECONDS)}s will be summarised.\n\n"
+        )
+
+    if limit is None or len(render(description)) <= limit:
+        return render(description)
+
+    # The longest prefix of the description whose escaped header fits
+    low, high = 0, len(description)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if len(render(description[:middle])) <= limit:
+            low = middle
+        else:
+            high = middle - 1
+    return render(description[:low])
+
+
+def get_error_fingerprint(error: Optional[BaseException]) -> str:
+    """Identify an error by its type and the innermost frame it was raised from."""
+    if error is None:
+        return "none"
+
+    top_frame = ""
+    frames = traceback.extract_tb(error.__traceback__)
+    if frames:
+        frame = frames[-1]
+        top_frame = f"{frame.filename}:{frame.lineno}:{frame.name}"
+
+    key = f"{type(error).__module__}.{type(error).__qualname__}@{top_frame}"
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def get_error_description(error: Optional[BaseException]) -> str:
+    if error is None:
+        return "Unknown error"
+
+    description = f"{type(error).__name__}: {error}"
+    frames = traceback.extract_tb(error.__traceback__)
+    if frames:
+        frame = frames[-1]
+        description += f" (at {os.path.basename(frame.filename)}:{frame.lineno} in {frame.name})"
+    return description[:500]
+
+
+async def send_error_summary(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Close an error's alert window, reporting how often it happened if more than once."""
+    if context.job is None:
+        return
+
+    fingerprint = str(context.job.data)
+    error_alert = _error_alerts.pop(fingerprint, None)
+    if error_alert is None or error_alert["count"] <= 1:
+        return
+
+    DEVELOPER_CHAT_ID = os.getenv("DEVELOPER_CHAT_ID") or ""
+
     await context.bot.send_message(
-        chat_id=DEVELOPER_CHAT_ID, text=message, parse_mode=ParseMode.HTML
+        chat_id=DEVELOPER_CHAT_ID,
+        text=(
+            f"<b>{html.escape(error_alert['description'])}</b>\n"
+            f"fingerprint: <code>{fingerprint}</code>\n"
+            f"occurred {error_alert['count']} times in the last "
+            f"{int(time.time() - error_alert['first_seen'])}s"
+        ),
+        parse_mode=ParseMode.HTML,
     )
@@ -0,0 +1,68 @@
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+from telegram import Update
+from telegram.ext import ContextTypes
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+
+
+class TextState(NamedTuple):
+    """What to do with a text message received while chat_data["state"] is a given state."""
+
+    handler: Handler  # next step of the flow
+    scratch_key: str  # chat_data key of the flow's scratch dict, e.g. "new_task"
+    field: str  # field of the scratch dict that the text is stored in
+    starts_flow: bool = False  # whether to start from an empty scratch dict
+    parser: Optional[Callable[[str], str]] = None
+    validator: Optional[Callable[[str, Dict[str, Any]], None]] = None
+
+
+# callback_data -> handler
+CALLBACK_HANDLERS: Dict[str, Handler] = dict()
+# chat_data["state"] -> TextState
+TEXT_STATES: Dict[str, TextState] = dict()
+
+
+def register_callback(*callback_data: str):
+    """Route callback queries with any of the given callback_data to the decorated handler."""
+
+    def decorator(func: Handler) -> Handler:
+        for data in callback_data:
+            if data in CALLBACK_HANDLERS:
+                raise ValueError(f"callback_data {data} is already registered")
+            CALLBACK_HANDLERS[data] = func
+        return func
+
+    return decorator
+
+
+def register_text_state(
+    state: str,
+    *,
+    scratch_key: str,
+    field: str,
+    starts_flow: bool = False,
+    parser: Optional[Callable[[str], str]] = None,
+    validator: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+):
+    """
+    Route text received in the given state to the decorated handler, after storing it in
+    chat_data[scratch_key][field].
+
+    parser and validator raise ValueError with a user-facing message to reject the input,
+    in which case the state is left unchanged so that the user can try again.
+    """
+
+    def decorator(func: Handler) -> Handler:
+        if state in TEXT_STATES:
+            raise ValueError(f"state {state} is already registered")
+        TEXT_STATES[state] = TextState(
+            handler=func,
+            scratch_key=scratch_key,
+            field=field,
+            starts_flow=starts_flow,
+            parser=parser,
+            validator=validator,
+        )
+        return func
+
+    return decorator
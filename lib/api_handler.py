@@ -1,13 +1,31 @@
-from typing import TypedDict
+import asyncio
+import threading
+import time
+from copy import deepcopy
+from typing import Dict, Iterable, List, Tuple, TypedDict
 from requests import request, post, patch
-from utils.constants import BASE_URL
-
-
-class Task(TypedDict):
+from lib import db_repository
+from utils.constants import (
+    BASE_URL,
+    DATA_BACKEND,
+    USER_BULK_BATCH_SIZE,
+    USER_PRELOAD_TTL_SECONDS,
+)
+from utils.logger_config import configure_logger
+from utils.metrics import track_external_call
+from utils.request_scope import get_request_scope
+from utils.single_flight import SingleFlight
+
+logger = configure_logger(__name__)
+
+
+class Task(TypedDict, total=False):
+    id: int  # Set by the backend
     userId: str
     name: str
     duration: int
     deadline: str  # MMDD
+    added: bool  # Whether it is on the user's calendar
 
 
 class Habit(TypedDict):
@@ -16,6 +34,7 @@ class Habit(TypedDict):
     frequency: int
 
 
+@track_external_call("backend", "get_google_oauth_url")
 def get_google_oauth_login_url(telegram_user_id: str, username: str):
     # Make a HTTP GET request to BASE_URL/get_google_oauth_url
 
@@ -36,7 +55,84 @@ def get_google_oauth_login_url(telegram_user_id: str, username: str):
     return url
 
 
+# Concurrent reads of the same user, e.g. a job and a command, share one request
+_user_flight = SingleFlight("user", copy=deepcopy)
+
+
+# telegram_user_id -> the user and when it was loaded by get_users
+_preloaded_users: Dict[str, Tuple[Dict, float]] = dict()
+_preloaded_users_lock = threading.Lock()
+
+
+def _get_preloaded_user(telegram_user_id: str):
+    with _preloaded_users_lock:
+        preloaded = _preloaded_users.get(telegram_user_id)
+    if preloaded is None or time.monotonic() - preloaded[1] > USER_PRELOAD_TTL_SECONDS:
+        return None
+    return deepcopy(preloaded[0])
+
+
 def get_user(telegram_user_id: str):
+    # Users don't change during one update, so the request scope keeps the first read
+    scope = get_request_scope()
+    if scope is not None and telegram_user_id in scope.users:
+        return scope.users[telegram_user_id]
+
+    user = _get_preloaded_user(telegram_user_id)
+    if user is None:
+        user = _user_flight.do(telegram_user_id, lambda: _fetch_user(telegram_user_id))
+    if scope is not None:
+        scope.users[telegram_user_id] = user
+    return user
+
+
+def get_users(telegram_user_ids: Iterable[str]) -> Dict[str, Dict]:
+    """
+    Load many users with one request per USER_BULK_BATCH_SIZE, e.g. before every
+    chat's morning flow runs. get_user serves them for USER_PRELOAD_TTL_SECONDS.
+    Users that weren't found are left out.
+    """
+    ids = list(dict.fromkeys(telegram_user_ids))
+    users: Dict[str, Dict] = dict()
+    for batch_start in range(0, len(ids), USER_BULK_BATCH_SIZE):
+        batch = ids[batch_start : batch_start + USER_BULK_BATCH_SIZE]
+        if DATA_BACKEND == "database":
+            users.update(db_repository.get_users(batch))
+        else:
+            users.update(_fetch_users_from_api(batch))
+
+    now = time.monotonic()
+    with _preloaded_users_lock:
+        for telegram_user_id, (_, loaded_at) in list(_preloaded_users.items()):
+            if now - loaded_at > USER_PRELOAD_TTL_SECONDS:
+                del _preloaded_users[telegram_user_id]
+        for telegram_user_id, user in users.items():
+            _preloaded_users[telegram_user_id] = (deepcopy(user), now)
+    return users
+
+
+@track_external_call("backend", "get_users")
+def _fetch_users_from_api(telegram_user_ids: Iterable[str]) -> Dict[str, Dict]:
+    res = request(
+        method="GET",
+        url=f"{BASE_URL}/users",
+        headers={
+            "Content-Type": "application/json",
+        },
+        params={"telegram_ids": ",".join(telegram_user_ids)},
+    )
+    res.raise_for_status()
+    return {str(user["telegram_user_id"]): user for user in res.json()}
+
+
+def _fetch_user(telegram_user_id: str):
+    if DATA_BACKEND == "database":
+        return db_repository.get_user(telegram_user_id) or dict()
+    return _fetch_user_from_api(telegram_user_id)
+
+
+@track_external_call("backend", "get_user")
+def _fetch_user_from_api(telegram_user_id: str):
     # Make a HTTP request to BASE_URL/users/telegram/{user_id}
 
     user_res = request(
@@ -52,20 +148,69 @@ def get_user(telegram_user_id: str):
 
 
 async def add_tasks(task: Task):
+    # requests blocks, so the call runs on a worker thread instead of the event loop
+    return await asyncio.to_thread(add_tasks_sync, task)
+
+
+def add_tasks_sync(task: Task):
+    """add_tasks for callers that are already on a worker thread, like the outbox."""
+    if DATA_BACKEND == "database":
+        # Same shape as the backend's response
+        return {"data": [db_repository.add_task(task)]}
+    return _add_tasks_to_api(task)
+
+
+@track_external_call("backend", "add_tasks")
+def _add_tasks_to_api(task: Task):
     url_post = f"{BASE_URL}/tasks"
     response = post(url_post, json=task)
+    response.raise_for_status()
     return response.json()
 
 
 def mark_task_as_added(task_id: int):
+    if DATA_BACKEND == "database":
+        db_repository.set_task_added(task_id, True)
+        return
+    _mark_task_as_added_in_api(task_id)
+
+
+@track_external_call("backend", "mark_task_as_added")
+def _mark_task_as_added_in_api(task_id: int):
     url_patch = f"{BASE_URL}/tasks/added/{task_id}"
-    patch(url_patch)
+    patch(url_patch).raise_for_status()
 
-def mark_task_as_not_added(task_id: int):
-    url_patch = f"/tasks/un_added/{task_id}"
-    patch(url_patch)
 
-async def plan_tasks(telegram_user_id: str):
-    url_patch = f"{BASE_URL}/tasks/plan/telegram/{telegram_user_id}"
-    response = patch(url_patch)
+def mark_task_as_not_added(task_id: int):
+    if DATA_BACKEND == "database":
+        db_repository.set_task_added(task_id, False)
+        return
+    _mark_task_as_not_added_in_api(task_id)
+
+
+@track_external_call("backend", "mark_task_as_not_added")
+def _mark_task_as_not_added_in_api(task_id: int):
+    url_patch = f"{BASE_URL}/tasks/un_added/{task_id}"
+    patch(url_patch).raise_for_status()
+
+
+def get_backlog_tasks(telegram_user_id: str) -> List[Task]:
+    """The user's tasks that aren't on their calendar yet."""
+    if DATA_BACKEND == "database":
+        return db_repository.get_backlog_tasks(telegram_user_id)
+    return [task for task in _fetch_tasks_from_api(telegram_user_id) if not task.get("added")]
+
+
+@track_external_call("backend", "get_tasks")
+def _fetch_tasks_from_api(telegram_user_id: str) -> List[Task]:
+    """
+    Needs the backend's GET /tasks/telegram/{telegram_user_id} route, returning the
+    user's tasks with their "added" flag. Without it, no backlog is planned.
+    """
+    url_get = f"{BASE_URL}/tasks/telegram/{telegram_user_id}"
+    response = request(method="GET", url=url_get)
+    if response.status_code == 404:
+        logger.warning("GET /tasks/telegram returned 404, not planning the backlog")
+        return []
+    response.raise_for_status()
     return response.json()
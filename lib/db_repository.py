@@ -0,0 +1,196 @@
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+from telegram.ext import Application
+from utils.constants import DATABASE_POOL_SIZE, DATABASE_URL
+from utils.logger_config import configure_logger
+from utils.metrics import track_external_call
+
+logger = configure_logger(__name__)
+
+# Users and tasks read and written directly in the backend's Postgres (Supabase)
+# database, instead of through the API at BASE_URL, when DATA_BACKEND is "database".
+# DATABASE_URL is a postgres:// URL, or sqlite:///<path> for a local stand-in
+# that creates the tables it needs.
+
+# Written with %s placeholders, which are swapped for ? on SQLite
+_QUERIES = {
+    "get_user": "SELECT * FROM users WHERE telegram_user_id = %s",
+    "get_users": "SELECT * FROM users WHERE telegram_user_id = ANY(%s)",
+    "add_task": (
+        'INSERT INTO tasks ("userId", name, duration, deadline) '
+        "VALUES (%s, %s, %s, %s) RETURNING *"
+    ),
+    "set_task_added": "UPDATE tasks SET added = %s WHERE id = %s",
+    "get_backlog_tasks": 'SELECT * FROM tasks WHERE "userId" = %s AND NOT added ORDER BY id',
+}
+
+# SQLite has no arrays, so the ids are passed as one JSON list instead
+_SQLITE_QUERIES = {
+    "get_users": "SELECT * FROM users WHERE telegram_user_id IN (SELECT value FROM json_each(?))",
+}
+
+_SQLITE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS users ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "telegram_user_id TEXT NOT NULL UNIQUE, "
+    "username TEXT, "
+    "google_refresh_token TEXT)",
+    "CREATE TABLE IF NOT EXISTS tasks ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    '"userId" TEXT NOT NULL, '
+    "name TEXT NOT NULL, "
+    "duration INTEGER NOT NULL, "
+    "deadline TEXT, "
+    "added BOOLEAN NOT NULL DEFAULT FALSE)",
+)
+
+
+class ConnectionPool:
+    """
+    A fixed number of DB-API connections shared by all threads. Each connection
+    keeps its own prepared statements, so reusing connections also reuses those.
+    """
+
+    def __init__(self, connect: Callable[[], Any], size: int):
+        self._connect = connect
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """A connection for one transaction, committed if the block doesn't raise."""
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                try:
+                    conn.rollback()
+                except Exception:
+                    # The connection is broken, so it isn't given to anyone else
+                    logger.warning("Discarding a broken database connection", exc_info=True)
+                    conn.close()
+                else:
+                    self._idle.put(conn)
+                raise
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _connect_sqlite(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    for statement in _SQLITE_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def _connect_postgres(url: str):
+    try:
+        import psycopg
+    except ImportError as e:
+        raise RuntimeError("DATA_BACKEND=database with Postgres needs psycopg installed") from e
+
+    # prepare_threshold=0 prepares every query on first use of each connection.
+    # Supabase's transaction pooler doesn't support prepared statements, so use
+    # the session pooler or a direct connection.
+    return psycopg.connect(url, prepare_threshold=0)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+_is_sqlite = DATABASE_URL.startswith("sqlite:///")
+
+
+def _get_pool() -> ConnectionPool:
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            if not DATABASE_URL:
+                raise RuntimeError("DATA_BACKEND=database needs DATABASE_URL to be set")
+            if _is_sqlite:
+                path = DATABASE_URL[len("sqlite:///") :]
+                _pool = ConnectionPool(lambda: _connect_sqlite(path), DATABASE_POOL_SIZE)
+            else:
+                _pool = ConnectionPool(
+                    lambda: _connect_postgres(DATABASE_URL), DATABASE_POOL_SIZE
+                )
+        return _pool
+
+
+def _query(name: str) -> str:
+    if _is_sqlite:
+        return _SQLITE_QUERIES.get(name) or _QUERIES[name].replace("%s", "?")
+    return _QUERIES[name]
+
+
+def _fetch_all(name: str, params: Sequence[Any]) -> List[Dict[str, Any]]:
+    with _get_pool().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_query(name), params)
+            if cursor.description is None:
+                return []
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+
+@track_external_call("database", "get_user")
+def get_user(telegram_user_id: str) -> Optional[Dict[str, Any]]:
+    rows = _fetch_all("get_user", (telegram_user_id,))
+    return rows[0] if rows else None
+
+
+@track_external_call("database", "get_users")
+def get_users(telegram_user_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """The users that exist among telegram_user_ids, by Telegram id, in one query."""
+    ids = list(telegram_user_ids)
+    rows = _fetch_all("get_users", (json.dumps(ids),) if _is_sqlite else (ids,))
+    return {str(row["telegram_user_id"]): row for row in rows}
+
+
+@track_external_call("database", "add_task")
+def add_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Insert a task and return its row, including the new id."""
+    rows = _fetch_all(
+        "add_task", (task["userId"], task["name"], task["duration"], task["deadline"])
+    )
+    return rows[0]
+
+
+@track_external_call("database", "get_backlog_tasks")
+def get_backlog_tasks(telegram_user_id: str) -> List[Dict[str, Any]]:
+    return _fetch_all("get_backlog_tasks", (telegram_user_id,))
+
+
+@track_external_call("database", "set_task_added")
+def set_task_added(task_id: int, added: bool) -> None:
+    _fetch_all("set_task_added", (added, task_id))
+
+
+async def stop_db_repository(application: Application) -> None:
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
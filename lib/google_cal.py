@@ -1,20 +1,51 @@
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
 from enum import Enum
-from typing import Any, Dict, List, Literal, Optional, Sequence, Tuple, Union
+from typing import Any, Dict, FrozenSet, List, Literal, NamedTuple, Optional, Sequence, Tuple, Union
 from typing_extensions import TypedDict
 from datetime import datetime, timedelta
 from os import getenv
-from dateutil import parser
-from google.auth.transport.requests import Request
+import httplib2
+from google.auth.exceptions import TransportError
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
-from lib.api_handler import get_google_oauth_login_url
+from googleapiclient.errors import HttpError
+from lib.api_handler import get_google_oauth_login_url, get_user
 from utils.constants import (
     DAY_END_TIME,
     DAY_START_TIME,
     GOOGLE_CAL_BASE_URL,
-    GOOGLE_SCOPES,
+    GOOGLE_CAL_BATCH_MAX_OPS,
+    GOOGLE_CAL_BREAKER_FAILURE_RATE,
+    GOOGLE_CAL_BREAKER_MIN_CALLS,
+    GOOGLE_CAL_BREAKER_OPEN_SECONDS,
+    GOOGLE_CAL_BREAKER_SLOW_CALL_SECONDS,
+    GOOGLE_CAL_BREAKER_WINDOW,
+    GOOGLE_CAL_TIMEOUT_SECONDS,
     NEW_YORK_TIMEZONE_INFO,
+    RECENT_EVENT_WRITES_TTL_SECONDS,
+    STALE_SCHEDULE_NOTE,
 )
+from utils.logger_config import configure_logger, log_chat_id
+from lib.google_tokens import get_google_credentials
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.single_flight import SingleFlight
+from utils.google_quota import CallPriority, google_call_priority, schedule_google_call
+from utils.metrics import track_external_call
+from utils.calendar_prefetch import (
+    add_prefetched_event,
+    discard_prefetched_events,
+    get_prefetched_events,
+    start_prefetch,
+)
+from utils.request_scope import CachedEventWindow, get_request_scope
+
+logger = configure_logger(__name__)
 
 
 class NovaEvent(str, Enum):
@@ -165,6 +196,7 @@ class GoogleCalendarReceivedEvent(TypedDict):
     description: str  # Not always there
     status: GoogleCalendarEventStatus
     id: str
+    etag: str
     creator: GoogleCalendarPerson
     organizer: GoogleCalendarPerson
     visibility: GoogleCalendarEventVisibility
@@ -235,6 +267,38 @@ class GoogleCalendarGetEventsResponse(TypedDict):
     items: List[GoogleCalendarReceivedEvent]
 
 
+def _is_upstream_failure(e: Exception) -> bool:
+    """Errors that say Google is unhealthy, as opposed to a problem with one request or user."""
+    if isinstance(e, HttpError):
+        return e.resp.status >= 500 or e.resp.status == 429
+    return isinstance(e, (OSError, TransportError, httplib2.HttpLib2Error))
+
+
+calendar_breaker = CircuitBreaker(
+    "google_calendar",
+    window_size=GOOGLE_CAL_BREAKER_WINDOW,
+    min_calls=GOOGLE_CAL_BREAKER_MIN_CALLS,
+    failure_rate=GOOGLE_CAL_BREAKER_FAILURE_RATE,
+    slow_call_seconds=GOOGLE_CAL_BREAKER_SLOW_CALL_SECONDS,
+    open_seconds=GOOGLE_CAL_BREAKER_OPEN_SECONDS,
+    is_failure=_is_upstream_failure,
+)
+
+
+def _execute(request):
+    """
+    Execute a Calendar request through the breaker. Only the request itself is timed,
+    not the wait for quota or a token refresh before it, which aren't Google's latency.
+    """
+    return calendar_breaker.call(request.execute)
+
+
+def _build_calendar_service(creds: Credentials):
+    # Without a timeout, a hung connection holds the caller until the OS gives up on it
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=GOOGLE_CAL_TIMEOUT_SECONDS))
+    return build("calendar", "v3", http=http)
+
+
 def get_google_oauth_client_config() -> Dict[str, GoogleOauthClientConfig]:
     client_id = getenv("GOOGLE_CLIENT_ID")
     client_secret = getenv("GOOGLE_CLIENT_SECRET")
@@ -264,7 +328,37 @@ def get_google_cal_link(telegram_user_id: Optional[int]):
         return GOOGLE_CAL_BASE_URL
 
 
+# Rendered schedules keyed by the (id, etag) set of the events they were rendered from.
+# The etag changes whenever an event changes, so entries never go stale.
+_readable_cal_event_str_cache: "OrderedDict[FrozenSet[Tuple[str, str]], str]" = OrderedDict()
+_READABLE_CAL_EVENT_STR_CACHE_SIZE = 1024
+
+
+def _get_event_etag_key(
+    events: Sequence[GoogleCalendarEventMinimum],
+) -> Optional[FrozenSet[Tuple[str, str]]]:
+    key = []
+    for event in events:
+        event_id = event.get("id")
+        etag = event.get("etag")
+        if event_id and not etag:
+            # Built locally with an id but not saved yet, so keyed on what is rendered
+            etag = "unsaved:{}@{}".format(
+                event.get("summary", ""), event.get("start", dict()).get("dateTime", "")
+            )
+        if not event_id:
+            # Locally built events without an id can't be told apart, so they aren't cached
+            return None
+        key.append((event_id, etag))
+    return frozenset(key)
+
+
 def get_readable_cal_event_str(events: Sequence[GoogleCalendarEventMinimum]):
+    cache_key = _get_event_etag_key(events)
+    if cache_key is not None and cache_key in _readable_cal_event_str_cache:
+        _readable_cal_event_str_cache.move_to_end(cache_key)
+        return _with_stale_note(_readable_cal_event_str_cache[cache_key])
+
     event_summary_strs = []
     # Sort in chronological order
     sorted_events = sort_events(events)
@@ -275,10 +369,69 @@ def get_readable_cal_event_str(events: Sequence[GoogleCalendarEventMinimum]):
                 str(
                     event.get("summary")
                     + " @ "
-                    + parser.parse(event_datetime_str).strftime("%H:%M")
+                    + datetime.fromisoformat(event_datetime_str).strftime("%H:%M")
                 )
             )
-    return "\n".join(event_summary_strs) or "No upcoming events found."
+    readable_str = "\n".join(event_summary_strs) or "No upcoming events found."
+
+    if cache_key is not None:
+        _readable_cal_event_str_cache[cache_key] = readable_str
+        if len(_readable_cal_event_str_cache) > _READABLE_CAL_EVENT_STR_CACHE_SIZE:
+            _readable_cal_event_str_cache.popitem(last=False)
+    return _with_stale_note(readable_str)
+
+
+def _with_stale_note(readable_str: str) -> str:
+    scope = get_request_scope()
+    if scope is not None and scope.served_stale_events:
+        return readable_str + "\n\n" + STALE_SCHEDULE_NOTE
+    return readable_str
+
+
+# The last windows read per calendar, served while Google is unreachable
+_last_event_windows: "OrderedDict[str, List[CachedEventWindow]]" = OrderedDict()
+_last_event_windows_lock = threading.Lock()
+_LAST_EVENT_WINDOWS_PER_CALENDAR = 8
+_LAST_EVENT_WINDOWS_CALENDARS = 1024
+
+
+def _remember_event_window(window: CachedEventWindow) -> None:
+    with _last_event_windows_lock:
+        windows = [
+            existing
+            for existing in _last_event_windows.get(window.refresh_token, [])
+            if (existing.q, existing.time_min, existing.time_max)
+            != (window.q, window.time_min, window.time_max)
+        ]
+        _last_event_windows[window.refresh_token] = [window] + windows[
+            : _LAST_EVENT_WINDOWS_PER_CALENDAR - 1
+        ]
+        _last_event_windows.move_to_end(window.refresh_token)
+        if len(_last_event_windows) > _LAST_EVENT_WINDOWS_CALENDARS:
+            _last_event_windows.popitem(last=False)
+
+
+def _get_stale_events(
+    refresh_token: str,
+    q: Optional[str],
+    time_min: Optional[str],
+    time_max: Optional[str],
+    k: int,
+) -> Optional[List[GoogleCalendarReceivedEvent]]:
+    with _last_event_windows_lock:
+        windows = list(_last_event_windows.get(refresh_token, []))
+    for window in windows:
+        events = window.serve(refresh_token, q, time_min, time_max, k)
+        if events is not None:
+            return deepcopy(events)
+    return None
+
+
+def _add_stale_event(refresh_token: str, event: GoogleCalendarReceivedEvent) -> None:
+    with _last_event_windows_lock:
+        for window in _last_event_windows.get(refresh_token, []):
+            window.add_event(deepcopy(event))
+
 
 def get_calendar_events(
     *,
@@ -294,35 +447,119 @@ def get_calendar_events(
 ) -> List[
     GoogleCalendarReceivedEvent
 ]:  # -> list[Any] | Any | List[GoogleCalendarEvent]:# -> list[Any] | Any | List[GoogleCalendarEvent]:# -> list[Any] | Any | List[GoogleCalendarEvent]:# -> list[Any] | Any | List[GoogleCalendarEvent]:# -> list[Any] | Any | List[GoogleCalendarEvent]:
-    """Shows basic usage of the Google Calendar API."""
-    CLIENT_ID = getenv("GOOGLE_CLIENT_ID")
-    CLIENT_SECRET = getenv("GOOGLE_CLIENT_SECRET")
-    creds = Credentials.from_authorized_user_info(
-        info={
-            "refresh_token": refresh_token,
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-        },
-        scopes=GOOGLE_SCOPES,
+    """
+    Get events from the user's primary calendar. Within a request scope, windows
+    that were already read are served from the scope instead of calling Google.
+    """
+    scope = get_request_scope()
+    if scope is not None:
+        cached_events = scope.get_events(refresh_token, q, timeMin, timeMax, k)
+        if cached_events is not None:
+            # Callers like merge_events modify the events, so the scope's copy is never handed out
+            return deepcopy(cached_events)
+
+    # Only calls of the same priority are shared, so an interactive read never waits
+    # behind a background one queued for quota
+    events, is_stale = _calendar_events_flight.do(
+        (refresh_token, q, timeMin, timeMax, k, google_call_priority.get()),
+        lambda: _fetch_calendar_events(refresh_token, q, timeMin, timeMax, k),
+    )
+    if is_stale:
+        if scope is not None:
+            scope.served_stale_events = True
+        return events
+    if scope is not None:
+        scope.put_events(refresh_token, q, timeMin, timeMax, k, deepcopy(events))
+    return events
+
+
+# Identical reads in flight at the same time, e.g. a job and a command, share one call
+_calendar_events_flight = SingleFlight("calendar_events", copy=deepcopy)
+
+
+def _fetch_calendar_events(
+    refresh_token: str,
+    q: Optional[str],
+    timeMin: Optional[str],
+    timeMax: Optional[str],
+    k: int,
+) -> Tuple[List[GoogleCalendarReceivedEvent], bool]:
+    """The events, and whether they are a stale snapshot because Google is unreachable."""
+    events = get_prefetched_events(refresh_token, q, timeMin, timeMax, k)
+    if events is None:
+        try:
+            events = _list_calendar_events(
+                refresh_token=refresh_token, q=q, timeMin=timeMin, timeMax=timeMax, k=k
+            )
+        except Exception as e:
+            if not isinstance(e, CircuitOpenError) and not _is_upstream_failure(e):
+                raise
+            # Google is down or failing, so fall back to the last read of this window
+            events = _get_stale_events(refresh_token, q, timeMin, timeMax, k)
+            if events is None:
+                raise
+            logger.warning("Serving stale calendar events: %r", e)
+            return events, True
+    _remember_event_window(
+        CachedEventWindow(refresh_token, q, timeMin, timeMax, k, deepcopy(events))
     )
+    return events, False
+
+
+def prefetch_calendar_events(
+    *,
+    telegram_user_id: str,
+    time_min: datetime,
+    time_max: datetime,
+    k: int,
+) -> None:
+    """
+    Start reading a calendar window in the background, so that the last step of a
+    multi-step command can be served from it by get_calendar_events.
+    """
+
+    def get_refresh_token() -> str:
+        # Speculative, so it yields the quota to interactive calls
+        google_call_priority.set(CallPriority.BACKGROUND)
+        log_chat_id.set(telegram_user_id)
+        return get_user(telegram_user_id).get("google_refresh_token", "")
+
+    def fetch(refresh_token: str) -> CachedEventWindow:
+        events = _list_calendar_events(
+            refresh_token=refresh_token,
+            q=None,
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+            k=k,
+        )
+        return CachedEventWindow(
+            refresh_token, None, time_min.isoformat(), time_max.isoformat(), k, events
+        )
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            try:
-              creds.refresh(Request())
-            except Exception as e:
-              reason, err = e.args
-                  
-    service = build("calendar", "v3", credentials=creds)
+    # Keyed on the Telegram id, the user is only looked up on the prefetch thread
+    start_prefetch(telegram_user_id, get_refresh_token, fetch)
+
+
+@calendar_breaker.fail_fast
+@schedule_google_call()
+@track_external_call("google_calendar", "events.list")
+def _list_calendar_events(
+    *,
+    refresh_token,
+    q: Optional[str],
+    timeMin: Optional[str],
+    timeMax: Optional[str],
+    k: int,
+) -> List[GoogleCalendarReceivedEvent]:
+    service = get_google_cal_service(refresh_token)
 
     # Call the Calendar API
-    print(f"Getting the upcoming {k} events")
+    logger.debug("Getting the upcoming %d events", k)
     if not timeMin and not timeMax and not q:
-        print("Time min or time max or q not set")
+        logger.warning("Time min or time max or q not set")
         return []
-    events_result: GoogleCalendarGetEventsResponse = (
-        service.events()
-        .list(
+    events_result: GoogleCalendarGetEventsResponse = _execute(
+        service.events().list(
             calendarId="primary",
             timeMin=timeMin,
             timeMax=timeMax,
@@ -332,48 +569,114 @@ def get_calendar_events(
             orderBy="startTime",
             timeZone="America/New_York",
         )
-        .execute()
     )
     events: List[GoogleCalendarReceivedEvent] = events_result.get("items", [])
 
     if type(events) is not list or len(events) == 0:
-        print("No upcoming events found.")
+        logger.debug("No upcoming events found.")
         return []
     else:
         return events
 
 
 def get_google_cal_service(refresh_token: str):
-    CLIENT_ID = getenv("GOOGLE_CLIENT_ID")
-    CLIENT_SECRET = getenv("GOOGLE_CLIENT_SECRET")
-    creds = Credentials.from_authorized_user_info(
-        info={
-            "refresh_token": refresh_token,
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-        },
-        scopes=GOOGLE_SCOPES,
+    return _build_calendar_service(get_google_credentials(refresh_token))
+
+
+def make_event_id(*parts: Any) -> str:
+    """
+    Deterministic event id for an identity such as (user, task id, slot), so that
+    inserting the same event again is detected instead of creating a duplicate.
+    Events the user creates by hand include the update id, since creating the same
+    event again in a later command is a new event. Calendar ids may only use
+    base32hex characters.
+    """
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).digest()[:20]
+    return base64.b32hexencode(digest).decode().lower()
+
+
+# Events inserted recently, keyed by id, so that retried inserts don't call Google at all
+_recent_event_writes: "OrderedDict[str, Tuple[float, GoogleCalendarReceivedEvent]]" = OrderedDict()
+_recent_event_writes_lock = threading.Lock()
+_RECENT_EVENT_WRITES_SIZE = 4096
+
+
+def _get_recent_event_write(event_id: str) -> Optional[GoogleCalendarReceivedEvent]:
+    with _recent_event_writes_lock:
+        recent_write = _recent_event_writes.get(event_id)
+        if recent_write is None:
+            return None
+        written_at, event = recent_write
+        if time.monotonic() - written_at > RECENT_EVENT_WRITES_TTL_SECONDS:
+            del _recent_event_writes[event_id]
+            return None
+        return event
+
+
+def _remember_event_write(event_id: str, event: GoogleCalendarReceivedEvent) -> None:
+    with _recent_event_writes_lock:
+        _recent_event_writes[event_id] = (time.monotonic(), event)
+        _recent_event_writes.move_to_end(event_id)
+        if len(_recent_event_writes) > _RECENT_EVENT_WRITES_SIZE:
+            _recent_event_writes.popitem(last=False)
+
+
+def _is_duplicate_insert(op_body: Dict[str, Any], error: Optional[Exception]) -> bool:
+    """Whether an insert failed only because an event with its id already exists."""
+    return (
+        bool(op_body.get("id"))
+        and isinstance(error, HttpError)
+        and error.resp.status == 409
     )
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
 
-    service = build("calendar", "v3", credentials=creds)
-    return service
+def _insert_event(service, event: Dict[str, Any]) -> GoogleCalendarReceivedEvent:
+    event_id = event.get("id")
+    if event_id:
+        recent_event = _get_recent_event_write(event_id)
+        if recent_event is not None:
+            logger.info("Event %s was already inserted, skipping the insert", event_id)
+            return recent_event
 
+    try:
+        event_res = _execute(service.events().insert(calendarId="primary", body=event))
+    except HttpError as e:
+        if not _is_duplicate_insert(event, e):
+            raise
+        return _restore_existing_event(service, event)
 
-def add_calendar_item(
+    if event_id:
+        _remember_event_write(event_id, event_res)
+    return event_res
+
+
+def _restore_existing_event(service, event: Dict[str, Any]) -> GoogleCalendarReceivedEvent:
+    """
+    For an insert that got a 409: the existing event with its id, which is
+    brought back with this body if it was deleted since.
+    """
+    event_id = event["id"]
+    # An earlier attempt went through but its response was lost
+    logger.info("Event %s already exists, using the existing event", event_id)
+    event_res = _execute(service.events().get(calendarId="primary", eventId=event_id))
+    if event_res.get("status") == GoogleCalendarEventStatus.CANCELLED.value:
+        # Deleted events keep their id, so a deleted event is brought back instead
+        event_res = _execute(
+            service.events().update(calendarId="primary", eventId=event_id, body=event)
+        )
+    _remember_event_write(event_id, event_res)
+    return event_res
+
+
+def build_calendar_item(
     *,
-    refresh_token: str,
     summary: str,
     start_time: datetime,
     end_time: datetime,
     event_type: NovaEvent,
     extra_details_dict: Optional[Dict[str, Any]] = None,
-):
-    service = get_google_cal_service(refresh_token)
-
+    event_id: Optional[str] = None,
+) -> Dict[str, Any]:
     start_obj = {
         "timeZone": "America/New_York",
         "dateTime": start_time.isoformat(),
@@ -395,10 +698,67 @@ def add_calendar_item(
             "shared": {},
         },
     }
+    if event_id:
+        event["id"] = event_id
+    return event
+
+
+def build_recurring_calendar_item(
+    *,
+    summary: str,
+    start_time: datetime,
+    end_time: datetime,
+    rrules: List[str],
+    event_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    event = build_calendar_item(
+        summary=summary,
+        start_time=start_time,
+        end_time=end_time,
+        event_type=NovaEvent.HABIT,
+        event_id=event_id,
+    )
+    event["recurrence"] = rrules
+    return event
+
+
+@calendar_breaker.fail_fast
+@schedule_google_call()
+@track_external_call("google_calendar", "events.insert")
+def add_calendar_item(
+    *,
+    refresh_token: str,
+    summary: str,
+    start_time: datetime,
+    end_time: datetime,
+    event_type: NovaEvent,
+    extra_details_dict: Optional[Dict[str, Any]] = None,
+    event_id: Optional[str] = None,
+):
+    """Insert an event. With an event_id (see make_event_id) retrying the insert is safe."""
+    service = get_google_cal_service(refresh_token)
+    event = build_calendar_item(
+        summary=summary,
+        start_time=start_time,
+        end_time=end_time,
+        event_type=event_type,
+        extra_details_dict=extra_details_dict,
+        event_id=event_id,
+    )
+
+    event_res = _insert_event(service, event)
 
-    event_res = service.events().insert(calendarId="primary", body=event).execute()
+    scope = get_request_scope()
+    if scope is not None:
+        scope.add_event(refresh_token, deepcopy(event_res))
+    add_prefetched_event(refresh_token, event_res)
+    _add_stale_event(refresh_token, event_res)
+    return event_res
 
 
+@calendar_breaker.fail_fast
+@schedule_google_call()
+@track_external_call("google_calendar", "events.insert")
 def add_recurring_calendar_item(
     *,
     refresh_token: str,
@@ -406,62 +766,175 @@ def add_recurring_calendar_item(
     start_time: datetime,
     end_time: datetime,
     rrules: List[str],
+    event_id: Optional[str] = None,
 ):
     service = get_google_cal_service(refresh_token)
-    start_obj = {
-        "timeZone": "America/New_York",
-        "dateTime": start_time.isoformat(),
-    }
-    end_obj = {
-        "timeZone": "America/New_York",
-        "dateTime": end_time.isoformat(),
-    }
-    event = {
-        "summary": summary,
-        "start": start_obj,
-        "end": end_obj,
-        "recurrence": rrules,
-        "extendedProperties": {
-            "private": {
-                "nova_type": NovaEvent.HABIT.value,
-            },
-            "shared": {},
-        },
-    }
-
-    recurring_event = (
-        service.events().insert(calendarId="primary", body=event).execute()
+    event = build_recurring_calendar_item(
+        summary=summary,
+        start_time=start_time,
+        end_time=end_time,
+        rrules=rrules,
+        event_id=event_id,
     )
 
+    recurring_event = _insert_event(service, event)
+
+    # The instances of a recurring event aren't known locally, so the windows are re-read
+    scope = get_request_scope()
+    if scope is not None:
+        scope.invalidate_events(refresh_token)
+    discard_prefetched_events(refresh_token)
 
+
+@calendar_breaker.fail_fast
+@schedule_google_call()
+@track_external_call("google_calendar", "events.update")
 def update_calendar_event(
     *,
     event_id: str,
     refresh_token: str,
     updated_event: GoogleCalendarCreateEvent,
 ):
-    CLIENT_ID = getenv("GOOGLE_CLIENT_ID")
-    CLIENT_SECRET = getenv("GOOGLE_CLIENT_SECRET")
-    creds = Credentials.from_authorized_user_info(
-        info={
-            "refresh_token": refresh_token,
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-        },
-        scopes=GOOGLE_SCOPES,
+    service = get_google_cal_service(refresh_token)
+
+    updated_event = _execute(
+        service.events().update(calendarId="primary", eventId=event_id, body=updated_event)
     )
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+    scope = get_request_scope()
+    if scope is not None:
+        scope.invalidate_events(refresh_token)
+    discard_prefetched_events(refresh_token)
 
-    service = build("calendar", "v3", credentials=creds)
 
-    updated_event = (
-        service.events()
-        .update(calendarId="primary", eventId=event_id, body=updated_event)
-        .execute()
-    )
+class CalendarWriteMethod(str, Enum):
+    INSERT = "insert"
+    UPDATE = "update"
+    PATCH = "patch"
+    DELETE = "delete"
+
+
+class CalendarWriteOp(TypedDict, total=False):
+    method: CalendarWriteMethod
+    event_id: str  # Not needed for inserts
+    body: Dict[str, Any]  # Not needed for deletes
+
+
+class CalendarWriteResult(NamedTuple):
+    op: CalendarWriteOp
+    response: Optional[GoogleCalendarReceivedEvent]  # None for deletes and failed ops
+    error: Optional[Exception]
+
+
+def _build_write_request(service, op: CalendarWriteOp):
+    events = service.events()
+    method = op["method"]
+    if method == CalendarWriteMethod.INSERT:
+        return events.insert(calendarId="primary", body=op["body"])
+    if method == CalendarWriteMethod.UPDATE:
+        return events.update(calendarId="primary", eventId=op["event_id"], body=op["body"])
+    if method == CalendarWriteMethod.PATCH:
+        return events.patch(calendarId="primary", eventId=op["event_id"], body=op["body"])
+    return events.delete(calendarId="primary", eventId=op["event_id"])
+
+
+@calendar_breaker.fail_fast
+@schedule_google_call(cost=lambda service, ops: len(ops))
+@track_external_call("google_calendar", "batch")
+def _execute_calendar_batch(
+    service, ops: Sequence[CalendarWriteOp]
+) -> List[CalendarWriteResult]:
+    results: List[CalendarWriteResult] = [
+        CalendarWriteResult(op, None, None) for op in ops
+    ]
+    duplicate_inserts: List[int] = []
+
+    def callback(request_id: str, response, exception: Optional[Exception]) -> None:
+        i = int(request_id)
+        if ops[i]["method"] == CalendarWriteMethod.INSERT and _is_duplicate_insert(
+            ops[i]["body"], exception
+        ):
+            duplicate_inserts.append(i)
+            return
+        results[i] = CalendarWriteResult(ops[i], response or None, exception)
+        if response and ops[i]["method"] == CalendarWriteMethod.INSERT and response.get("id"):
+            _remember_event_write(response["id"], response)
+
+    batch = service.new_batch_http_request(callback=callback)
+    for i, op in enumerate(ops):
+        batch.add(_build_write_request(service, op), request_id=str(i))
+    calendar_breaker.call(batch.execute)
+
+    # Same as _insert_event: the existing event is used, or restored if it was deleted
+    for i in duplicate_inserts:
+        try:
+            results[i] = CalendarWriteResult(
+                ops[i], _restore_existing_event(service, ops[i]["body"]), None
+            )
+        except Exception as e:
+            results[i] = CalendarWriteResult(ops[i], None, e)
+    return results
+
+
+def batch_calendar_writes(
+    *,
+    refresh_token: str,
+    ops: Sequence[CalendarWriteOp],
+) -> List[CalendarWriteResult]:
+    """
+    Send inserts, updates, patches and deletes through the Calendar batch endpoint,
+    GOOGLE_CAL_BATCH_MAX_OPS per request. Returns one result per op, in order.
+    A failed op doesn't fail the others, so callers should check each result's error.
+    """
+    if not ops:
+        return []
+
+    # Inserts that were recently written already have their result
+    results_by_index: Dict[int, CalendarWriteResult] = dict()
+    for i, op in enumerate(ops):
+        event_id = op.get("body", dict()).get("id")
+        if op["method"] == CalendarWriteMethod.INSERT and event_id:
+            recent_event = _get_recent_event_write(event_id)
+            if recent_event is not None:
+                results_by_index[i] = CalendarWriteResult(op, recent_event, None)
+    pending = [i for i in range(len(ops)) if i not in results_by_index]
+
+    if pending:
+        service = get_google_cal_service(refresh_token)
+        for chunk_start in range(0, len(pending), GOOGLE_CAL_BATCH_MAX_OPS):
+            chunk = pending[chunk_start : chunk_start + GOOGLE_CAL_BATCH_MAX_OPS]
+            chunk_results = _execute_calendar_batch(service, [ops[i] for i in chunk])
+            results_by_index.update(zip(chunk, chunk_results))
+    results = [results_by_index[i] for i in range(len(ops))]
+
+    failed = [result for result in results if result.error is not None]
+    if failed:
+        logger.warning(
+            "%d of %d calendar writes failed, first error: %s",
+            len(failed),
+            len(results),
+            failed[0].error,
+        )
+
+    succeeded = [result for result in results if result.error is None]
+    scope = get_request_scope()
+    if all(
+        result.op["method"] == CalendarWriteMethod.INSERT
+        and "recurrence" not in result.op["body"]
+        and result.response is not None
+        for result in succeeded
+    ):
+        for result in succeeded:
+            if scope is not None:
+                scope.add_event(refresh_token, deepcopy(result.response))
+            add_prefetched_event(refresh_token, result.response)
+    else:
+        # Same as the single writes, only plain inserts can be applied locally
+        if scope is not None:
+            scope.invalidate_events(refresh_token)
+        discard_prefetched_events(refresh_token)
+
+    return results
 
 
 def sort_events(
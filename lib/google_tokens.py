@@ -0,0 +1,180 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from os import getenv
+from typing import Dict, NamedTuple, Optional
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from utils.constants import (
+    GOOGLE_SCOPES,
+    GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS,
+    GOOGLE_TOKEN_REFRESH_MAX_CONCURRENT,
+)
+from utils.google_quota import is_on_event_loop
+from utils.logger_config import configure_logger
+from utils.metrics import Counter, Gauge
+
+logger = configure_logger(__name__)
+
+GOOGLE_TOKEN_REFRESHES = Counter(
+    "nova_google_token_refreshes_total",
+    "Google OAuth access token refreshes by mode and outcome.",
+    ["mode", "outcome"],
+)
+GOOGLE_TOKENS_REVOKED = Gauge(
+    "nova_google_tokens_revoked",
+    "Refresh tokens flagged as revoked (invalid_grant) since startup.",
+)
+
+_TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+
+class GoogleGrantRevokedError(RefreshError):
+    """
+    The refresh token was already rejected with invalid_grant. Shaped like the
+    RefreshError Google raises for it, so the error handler asks the user to log in again.
+    """
+
+    def __init__(self):
+        super().__init__(
+            "Google refresh token was revoked or expired", {"error": "invalid_grant"}
+        )
+
+
+class AccessToken(NamedTuple):
+    token: str
+    expiry: datetime  # Naive UTC, like Credentials.expiry
+
+
+# refresh token -> its latest access token
+_access_tokens: Dict[str, AccessToken] = dict()
+# refresh token -> lock held while it is being refreshed, so each is refreshed once at a time
+_refresh_locks: Dict[str, threading.Lock] = dict()
+_revoked: set = set()
+_state_lock = threading.Lock()
+
+# Caps refreshes across all users, e.g. when every morning job starts at 08:00
+_refresh_slots = threading.BoundedSemaphore(GOOGLE_TOKEN_REFRESH_MAX_CONCURRENT)
+_executor = ThreadPoolExecutor(
+    max_workers=GOOGLE_TOKEN_REFRESH_MAX_CONCURRENT, thread_name_prefix="google-token-refresh"
+)
+_refreshing_ahead: set = set()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(tz=timezone.utc).replace(tzinfo=None)
+
+
+def _build_credentials(refresh_token: str, access_token: Optional[AccessToken]) -> Credentials:
+    return Credentials(
+        token=access_token.token if access_token else None,
+        expiry=access_token.expiry if access_token else None,
+        refresh_token=refresh_token,
+        token_uri=_TOKEN_URI,
+        client_id=getenv("GOOGLE_CLIENT_ID"),
+        client_secret=getenv("GOOGLE_CLIENT_SECRET"),
+        scopes=GOOGLE_SCOPES,
+    )
+
+
+def _is_invalid_grant(e: RefreshError) -> bool:
+    return len(e.args) > 1 and isinstance(e.args[1], dict) and e.args[1].get("error") == "invalid_grant"
+
+
+def _refresh(refresh_token: str, mode: str, force: bool = False) -> AccessToken:
+    with _state_lock:
+        refresh_lock = _refresh_locks.setdefault(refresh_token, threading.Lock())
+
+    with refresh_lock:
+        # Another caller may have refreshed it while this one waited for the lock
+        access_token = _access_tokens.get(refresh_token)
+        if (
+            not force
+            and access_token is not None
+            and access_token.expiry - _utcnow()
+            > timedelta(seconds=GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS)
+        ):
+            return access_token
+        if refresh_token in _revoked:
+            raise GoogleGrantRevokedError()
+
+        creds = _build_credentials(refresh_token, None)
+        with _refresh_slots:
+            try:
+                creds.refresh(Request())
+            except RefreshError as e:
+                if _is_invalid_grant(e):
+                    logger.warning("Google refresh token was revoked, not refreshing it again")
+                    GOOGLE_TOKEN_REFRESHES.inc(mode=mode, outcome="invalid_grant")
+                    with _state_lock:
+                        _revoked.add(refresh_token)
+                        _access_tokens.pop(refresh_token, None)
+                        GOOGLE_TOKENS_REVOKED.set(len(_revoked))
+                else:
+                    GOOGLE_TOKEN_REFRESHES.inc(mode=mode, outcome="error")
+                raise
+            except Exception:
+                GOOGLE_TOKEN_REFRESHES.inc(mode=mode, outcome="error")
+                raise
+
+        GOOGLE_TOKEN_REFRESHES.inc(mode=mode, outcome="ok")
+        access_token = AccessToken(creds.token, creds.expiry)
+        with _state_lock:
+            _access_tokens[refresh_token] = access_token
+        return access_token
+
+
+def _refresh_ahead(refresh_token: str) -> None:
+    try:
+        _refresh(refresh_token, "background")
+    except Exception as e:
+        # The next call refreshes it in the foreground once it actually expires
+        logger.info("Background token refresh failed: %r", e)
+    finally:
+        with _state_lock:
+            _refreshing_ahead.discard(refresh_token)
+
+
+def get_google_credentials(refresh_token: str) -> Credentials:
+    """
+    Credentials with a valid access token for refresh_token. Access tokens are reused
+    until they expire, and refreshed in the background once they get close to it.
+    Raises GoogleGrantRevokedError without calling Google for tokens that got invalid_grant.
+    A refresh waits on locks and on Google, so this is only called from worker threads.
+    """
+    if is_on_event_loop():
+        raise RuntimeError("get_google_credentials called on the event loop, use run_google_call")
+    if refresh_token in _revoked:
+        raise GoogleGrantRevokedError()
+
+    access_token = _access_tokens.get(refresh_token)
+    remaining = access_token.expiry - _utcnow() if access_token is not None else None
+    if access_token is None or remaining is None or remaining <= timedelta(seconds=30):
+        access_token = _refresh(refresh_token, "foreground")
+    elif remaining <= timedelta(seconds=GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS):
+        with _state_lock:
+            should_refresh = refresh_token not in _refreshing_ahead
+            _refreshing_ahead.add(refresh_token)
+        if should_refresh:
+            _executor.submit(_refresh_ahead, refresh_token)
+
+    return _build_credentials(refresh_token, access_token)
+
+
+def is_google_grant_revoked(refresh_token: str) -> bool:
+    return refresh_token in _revoked
+
+
+def validate_google_grant(refresh_token: str) -> bool:
+    """
+    Whether Google still accepts refresh_token, checked by refreshing it even if
+    its access token is still valid. Errors other than invalid_grant are raised.
+    """
+    try:
+        _refresh(refresh_token, "health_check", force=True)
+    except RefreshError as e:
+        if isinstance(e, GoogleGrantRevokedError) or _is_invalid_grant(e):
+            return False
+        raise
+    return True
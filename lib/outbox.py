@@ -0,0 +1,470 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+from requests.exceptions import (
+    ChunkedEncodingError,
+    ConnectionError,
+    ConnectTimeout,
+    HTTPError,
+    RequestException,
+    Timeout,
+)
+from telegram.ext import Application
+from urllib3.exceptions import NewConnectionError
+from lib.api_handler import add_tasks_sync, get_user, mark_task_as_added, mark_task_as_not_added
+from lib.google_cal import NovaEvent, add_calendar_item, add_recurring_calendar_item
+from utils.constants import (
+    OUTBOX_FILEPATH,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_POLL_INTERVAL_SECONDS,
+    OUTBOX_RETENTION_SECONDS,
+    OUTBOX_RETRY_BASE_SECONDS,
+)
+from utils.circuit_breaker import CircuitOpenError
+from utils.google_quota import CallPriority, google_call_priority, run_google_call
+from utils.logger_config import configure_logger, log_chat_id
+from utils.metrics import Counter, Gauge
+
+logger = configure_logger(__name__)
+
+OUTBOX_PENDING = Gauge("nova_outbox_pending", "Mutations waiting in the outbox.")
+OUTBOX_RESULTS = Counter(
+    "nova_outbox_results_total", "Outbox mutation attempts by outcome.", ["kind", "outcome"]
+)
+
+# How many users' mutations are sent at the same time
+_DRAIN_BATCH_SIZE = 20
+
+
+class OutboxKind(str, Enum):
+    ADD_TASK = "add_task"
+    MARK_TASK_AS_ADDED = "mark_task_as_added"
+    MARK_TASK_AS_NOT_ADDED = "mark_task_as_not_added"
+    ADD_CALENDAR_ITEM = "add_calendar_item"
+    ADD_RECURRING_CALENDAR_ITEM = "add_recurring_calendar_item"
+
+
+class OutboxStatus(str, Enum):
+    PENDING = "pending"
+    DONE = "done"
+    DEAD = "dead"
+
+
+class OutboxRow(NamedTuple):
+    id: int
+    user_id: str
+    kind: OutboxKind
+    payload: Dict[str, Any]
+    attempts: int
+
+
+def _send_add_calendar_item(user_id: str, payload: Dict[str, Any]) -> None:
+    user = get_user(user_id)
+    add_calendar_item(
+        refresh_token=user.get("google_refresh_token", ""),
+        summary=payload["summary"],
+        start_time=datetime.fromisoformat(payload["start_time"]),
+        end_time=datetime.fromisoformat(payload["end_time"]),
+        event_type=NovaEvent(payload["event_type"]),
+        extra_details_dict=payload.get("extra_details"),
+        event_id=payload.get("event_id"),
+    )
+
+
+def _send_add_recurring_calendar_item(user_id: str, payload: Dict[str, Any]) -> None:
+    user = get_user(user_id)
+    add_recurring_calendar_item(
+        refresh_token=user.get("google_refresh_token", ""),
+        summary=payload["summary"],
+        start_time=datetime.fromisoformat(payload["start_time"]),
+        end_time=datetime.fromisoformat(payload["end_time"]),
+        rrules=payload["rrules"],
+        event_id=payload["event_id"],
+    )
+
+
+class AmbiguousSendError(Exception):
+    """The mutation failed after it may have been applied, so sending it again could apply it twice."""
+
+
+def _may_have_been_applied(e: RequestException) -> bool:
+    if isinstance(e, HTTPError):
+        return e.response is None or e.response.status_code >= 500
+    if isinstance(e, ConnectTimeout):
+        return False
+    if isinstance(e, ConnectionError):
+        # Refused connections never reached the backend, resets and other errors may have
+        reason = getattr(e.args[0], "reason", None) if e.args else None
+        return not isinstance(reason, NewConnectionError)
+    return isinstance(e, (Timeout, ChunkedEncodingError))
+
+
+def _send_add_task(user_id: str, payload: Dict[str, Any]) -> None:
+    # POST /tasks isn't idempotent, so a task the backend may have created isn't retried
+    try:
+        add_tasks_sync(payload["task"])
+    except RequestException as e:
+        if _may_have_been_applied(e):
+            raise AmbiguousSendError(repr(e)) from e
+        raise
+
+
+# kind -> function that sends the mutation on a worker thread, and raises if it should be retried
+_SENDERS: Dict[OutboxKind, Callable[[str, Dict[str, Any]], Any]] = {
+    OutboxKind.ADD_TASK: _send_add_task,
+    OutboxKind.MARK_TASK_AS_ADDED: lambda user_id, payload: mark_task_as_added(payload["task_id"]),
+    OutboxKind.MARK_TASK_AS_NOT_ADDED: lambda user_id, payload: mark_task_as_not_added(
+        payload["task_id"]
+    ),
+    OutboxKind.ADD_CALENDAR_ITEM: _send_add_calendar_item,
+    OutboxKind.ADD_RECURRING_CALENDAR_ITEM: _send_add_recurring_calendar_item,
+}
+
+_conn: Optional[sqlite3.Connection] = None
+_conn_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+_drain_task: Optional[asyncio.Task] = None
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+
+    if _conn is None:
+        _conn = sqlite3.connect(OUTBOX_FILEPATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "idempotency_key TEXT NOT NULL UNIQUE, "
+            "user_id TEXT NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, "
+            "last_error TEXT, "
+            "updated_at REAL NOT NULL)"
+        )
+        _conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, user_id, id)"
+        )
+        _conn.commit()
+    return _conn
+
+
+async def enqueue_mutation(
+    kind: OutboxKind,
+    user_id: str,
+    payload: Dict[str, Any],
+    idempotency_key: str,
+) -> bool:
+    # The insert commits to SQLite, so it runs on a worker thread instead of the event loop
+    return await asyncio.to_thread(enqueue_mutation_sync, kind, user_id, payload, idempotency_key)
+
+
+def enqueue_mutation_sync(
+    kind: OutboxKind,
+    user_id: str,
+    payload: Dict[str, Any],
+    idempotency_key: str,
+) -> bool:
+    """
+    Durably record a mutation to be sent in the background, in order per user.
+    A mutation whose idempotency_key is already in the outbox is ignored.
+    Returns whether the mutation was added. For callers on worker threads,
+    enqueue_mutation otherwise.
+    """
+    now = time.time()
+    with _conn_lock:
+        conn = _get_conn()
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO outbox "
+                "(idempotency_key, user_id, kind, payload, status, next_attempt_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    idempotency_key,
+                    user_id,
+                    kind.value,
+                    json.dumps(payload),
+                    OutboxStatus.PENDING.value,
+                    now,
+                    now,
+                ),
+            )
+    added = cursor.rowcount > 0
+    if not added:
+        logger.info("Ignoring duplicate outbox mutation %s", idempotency_key)
+    elif _loop is not None and _wakeup is not None:
+        # Called from worker threads, where the drain's event can't be set directly
+        _loop.call_soon_threadsafe(_wakeup.set)
+    return added
+
+
+async def enqueue_calendar_item(**kwargs: Any) -> bool:
+    """enqueue_calendar_item_sync, run on a worker thread."""
+    return await asyncio.to_thread(enqueue_calendar_item_sync, **kwargs)
+
+
+def enqueue_calendar_item_sync(
+    *,
+    user_id: str,
+    summary: str,
+    start_time: datetime,
+    end_time: datetime,
+    event_type: NovaEvent,
+    event_id: str,
+    extra_details_dict: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """
+    enqueue_mutation_sync for add_calendar_item, which takes datetimes and an enum.
+    event_id (see make_event_id) is also the idempotency key, so the same event
+    is only queued once and retrying its insert can't create a duplicate.
+    """
+    return enqueue_mutation_sync(
+        OutboxKind.ADD_CALENDAR_ITEM,
+        user_id,
+        {
+            "summary": summary,
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+            "event_type": event_type.value,
+            "extra_details": extra_details_dict,
+            "event_id": event_id,
+        },
+        f"add_calendar_item:{event_id}",
+    )
+
+
+async def enqueue_recurring_calendar_item(**kwargs: Any) -> bool:
+    """enqueue_recurring_calendar_item_sync, run on a worker thread."""
+    return await asyncio.to_thread(enqueue_recurring_calendar_item_sync, **kwargs)
+
+
+def enqueue_recurring_calendar_item_sync(
+    *,
+    user_id: str,
+    summary: str,
+    start_time: datetime,
+    end_time: datetime,
+    rrules: List[str],
+    event_id: str,
+) -> bool:
+    """enqueue_calendar_item_sync for add_recurring_calendar_item."""
+    return enqueue_mutation_sync(
+        OutboxKind.ADD_RECURRING_CALENDAR_ITEM,
+        user_id,
+        {
+            "summary": summary,
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+            "rrules": rrules,
+            "event_id": event_id,
+        },
+        f"add_recurring_calendar_item:{event_id}",
+    )
+
+
+def get_pending_added_task_ids(user_id: str) -> Set[Any]:
+    """
+    The user's tasks that the outbox is about to mark as added, whose backend
+    record doesn't say so yet. An un-add queued after the add wins.
+    """
+    with _conn_lock:
+        rows = (
+            _get_conn()
+            .execute(
+                "SELECT kind, payload FROM outbox "
+                "WHERE user_id = ? AND status = ? AND kind IN (?, ?) ORDER BY id",
+                (
+                    user_id,
+                    OutboxStatus.PENDING.value,
+                    OutboxKind.MARK_TASK_AS_ADDED.value,
+                    OutboxKind.MARK_TASK_AS_NOT_ADDED.value,
+                ),
+            )
+            .fetchall()
+        )
+    is_added: Dict[Any, bool] = dict()
+    for kind, payload in rows:
+        is_added[json.loads(payload)["task_id"]] = kind == OutboxKind.MARK_TASK_AS_ADDED.value
+    return {task_id for task_id, added in is_added.items() if added}
+
+
+def _read_due_rows() -> List[OutboxRow]:
+    """The oldest pending mutation of each user, if it is due."""
+    with _conn_lock:
+        rows = (
+            _get_conn()
+            .execute(
+                "SELECT id, user_id, kind, payload, attempts FROM outbox "
+                "WHERE id IN ("
+                "SELECT MIN(id) FROM outbox WHERE status = ? GROUP BY user_id"
+                ") AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (OutboxStatus.PENDING.value, time.time(), _DRAIN_BATCH_SIZE),
+            )
+            .fetchall()
+        )
+    return [
+        OutboxRow(row_id, user_id, OutboxKind(kind), json.loads(payload), attempts)
+        for row_id, user_id, kind, payload, attempts in rows
+    ]
+
+
+def _count_pending() -> int:
+    with _conn_lock:
+        return (
+            _get_conn()
+            .execute("SELECT COUNT(*) FROM outbox WHERE status = ?", (OutboxStatus.PENDING.value,))
+            .fetchone()[0]
+        )
+
+
+def _update_row(
+    row_id: int,
+    status: OutboxStatus,
+    attempts: int,
+    next_attempt_at: float,
+    error: Optional[str],
+) -> None:
+    with _conn_lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, "
+                "last_error = ?, updated_at = ? WHERE id = ?",
+                (status.value, attempts, next_attempt_at, error, time.time(), row_id),
+            )
+
+
+def _delete_old_rows() -> None:
+    # Dead rows are kept so they can be inspected and replayed by hand
+    with _conn_lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute(
+                "DELETE FROM outbox WHERE status = ? AND updated_at < ?",
+                (OutboxStatus.DONE.value, time.time() - OUTBOX_RETENTION_SECONDS),
+            )
+
+
+async def _send_row(row: OutboxRow) -> None:
+    # Runs in its own task (see drain_outbox), so this only applies to this row
+    log_chat_id.set(row.user_id)
+    sender = _SENDERS[row.kind]
+    attempts = row.attempts + 1
+    try:
+        # The Calendar senders wait for quota, on the background Calendar threads
+        await run_google_call(sender, row.user_id, row.payload)
+    except CircuitOpenError as e:
+        # Google is known to be down, which isn't this mutation's fault
+        logger.info("Outbox mutation %d (%s) waiting for %s", row.id, row.kind.value, e)
+        OUTBOX_RESULTS.inc(kind=row.kind.value, outcome="deferred")
+        await asyncio.to_thread(
+            _update_row,
+            row.id,
+            OutboxStatus.PENDING,
+            row.attempts,
+            time.time() + e.retry_after,
+            repr(e),
+        )
+        return
+    except AmbiguousSendError as e:
+        # Left for someone to check by hand rather than risk applying it twice
+        logger.error(
+            "Outbox mutation %d (%s) may have been applied, dead-lettering it: %s",
+            row.id,
+            row.kind.value,
+            e,
+        )
+        OUTBOX_RESULTS.inc(kind=row.kind.value, outcome="dead")
+        await asyncio.to_thread(_update_row, row.id, OutboxStatus.DEAD, attempts, 0, repr(e))
+        return
+    except Exception as e:
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            logger.error(
+                "Outbox mutation %d (%s) failed %d times, dead-lettering it: %r",
+                row.id,
+                row.kind.value,
+                attempts,
+                e,
+            )
+            OUTBOX_RESULTS.inc(kind=row.kind.value, outcome="dead")
+            await asyncio.to_thread(_update_row, row.id, OutboxStatus.DEAD, attempts, 0, repr(e))
+            return
+
+        delay = OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+        logger.warning(
+            "Outbox mutation %d (%s) failed, retrying in %.0fs: %r",
+            row.id,
+            row.kind.value,
+            delay,
+            e,
+        )
+        OUTBOX_RESULTS.inc(kind=row.kind.value, outcome="retry")
+        await asyncio.to_thread(
+            _update_row, row.id, OutboxStatus.PENDING, attempts, time.time() + delay, repr(e)
+        )
+        return
+
+    OUTBOX_RESULTS.inc(kind=row.kind.value, outcome="done")
+    await asyncio.to_thread(_update_row, row.id, OutboxStatus.DONE, attempts, 0, None)
+
+
+async def drain_outbox() -> None:
+    """Send every due mutation, one at a time per user and concurrently across users."""
+    while True:
+        rows = await asyncio.to_thread(_read_due_rows)
+        if not rows:
+            break
+        await asyncio.gather(*(_send_row(row) for row in rows))
+    OUTBOX_PENDING.set(await asyncio.to_thread(_count_pending))
+
+
+async def _drain_forever() -> None:
+    assert _wakeup is not None
+    google_call_priority.set(CallPriority.BACKGROUND)
+    await asyncio.to_thread(_delete_old_rows)
+    while True:
+        try:
+            await drain_outbox()
+        except Exception:
+            logger.exception("Failed to drain the outbox")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+async def start_outbox(application: Application) -> None:
+    """Start draining, which first replays anything left pending by the last run."""
+    global _loop, _wakeup, _drain_task
+
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    _drain_task = asyncio.create_task(_drain_forever())
+
+
+async def stop_outbox(application: Application) -> None:
+    global _conn, _drain_task
+
+    if _drain_task is not None:
+        _drain_task.cancel()
+        try:
+            await _drain_task
+        except asyncio.CancelledError:
+            pass
+        _drain_task = None
+
+    with _conn_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import pickle
+import sqlite3
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+from telegram.ext import Application, BasePersistence, PersistenceInput
+from utils.logger_config import configure_logger
+
+logger = configure_logger(__name__)
+
+# Blobs larger than this are zlib-compressed before they are written
+_COMPRESS_THRESHOLD_BYTES = 512
+_RAW_PREFIX = b"\x00"
+_ZLIB_PREFIX = b"\x01"
+
+
+def _dumps(data: Dict[str, Any]) -> bytes:
+    blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(blob) > _COMPRESS_THRESHOLD_BYTES:
+        return _ZLIB_PREFIX + zlib.compress(blob)
+    return _RAW_PREFIX + blob
+
+
+def _loads(blob: bytes) -> Dict[str, Any]:
+    if blob[:1] == _ZLIB_PREFIX:
+        return pickle.loads(zlib.decompress(blob[1:]))
+    return pickle.loads(blob[1:])
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+class SqlitePersistence(BasePersistence):
+    """
+    Persists chat_data in SQLite, one row per chat.
+
+    Rows are only read when a chat is first touched after startup
+    (see refresh_chat_data), so startup time does not depend on the number
+    of users. Writes are collected per chat and committed together in one
+    transaction, skipping chats whose data has not changed since the last write.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        update_interval: float = 60,
+        write_delay: float = 1,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False,
+                chat_data=True,
+                user_data=False,
+                callback_data=False,
+            ),
+            update_interval=update_interval,
+        )
+        self._filepath = filepath
+        self._write_delay = write_delay
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.Lock()
+
+        self._loaded_chat_ids: Set[int] = set()
+        self._dirty: Dict[int, bytes] = dict()
+        self._written_digests: Dict[int, bytes] = dict()
+        self._write_task: Optional[asyncio.Task] = None
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._filepath, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_data ("
+                "chat_id INTEGER PRIMARY KEY, "
+                "data BLOB NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _read_chat_row(self, chat_id: int) -> Optional[bytes]:
+        with self._conn_lock:
+            row = (
+                self._get_conn()
+                .execute("SELECT data FROM chat_data WHERE chat_id = ?", (chat_id,))
+                .fetchone()
+            )
+        return row[0] if row else None
+
+    def _read_chat_ids(self) -> List[int]:
+        with self._conn_lock:
+            rows = self._get_conn().execute("SELECT chat_id FROM chat_data").fetchall()
+        return [row[0] for row in rows]
+
+    def _write_chat_rows(self, rows: List[Tuple[int, bytes]]) -> None:
+        with self._conn_lock:
+            conn = self._get_conn()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO chat_data (chat_id, data) VALUES (?, ?) "
+                    "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data",
+                    rows,
+                )
+
+    def _delete_chat_row(self, chat_id: int) -> None:
+        with self._conn_lock:
+            conn = self._get_conn()
+            with conn:
+                conn.execute("DELETE FROM chat_data WHERE chat_id = ?", (chat_id,))
+
+    async def _write_dirty(self) -> None:
+        if not self._dirty:
+            return
+
+        batch, self._dirty = self._dirty, dict()
+        rows = list(batch.items())
+        try:
+            await asyncio.to_thread(self._write_chat_rows, rows)
+        except Exception:
+            # Put the batch back so the next run retries it, unless newer data came in
+            for chat_id, blob in rows:
+                self._dirty.setdefault(chat_id, blob)
+            raise
+
+        for chat_id, blob in rows:
+            self._written_digests[chat_id] = _digest(blob)
+        logger.debug("Persisted chat_data for %d chats", len(rows))
+
+    async def _delayed_write(self) -> None:
+        try:
+            await asyncio.sleep(self._write_delay)
+            await self._write_dirty()
+        except Exception:
+            logger.exception("Failed to persist chat_data")
+        finally:
+            self._write_task = None
+
+    def _schedule_write(self) -> None:
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._delayed_write())
+
+    async def get_chat_data(self) -> Dict[int, Dict[str, Any]]:
+        # Chats are loaded lazily in refresh_chat_data instead of all at startup
+        return dict()
+
+    async def list_chat_ids(self) -> List[int]:
+        """Every chat with persisted chat_data, whether or not it was loaded since startup."""
+        chat_ids = set(await asyncio.to_thread(self._read_chat_ids))
+        # Chats whose first write hasn't been committed yet
+        chat_ids.update(self._dirty)
+        return sorted(chat_ids)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[str, Any]) -> None:
+        if chat_id in self._loaded_chat_ids:
+            return
+
+        blob = await asyncio.to_thread(self._read_chat_row, chat_id)
+        self._loaded_chat_ids.add(chat_id)
+        if blob is None:
+            return
+
+        self._written_digests[chat_id] = _digest(blob)
+        # Never clobber anything written to the chat before it was loaded
+        for key, value in _loads(blob).items():
+            chat_data.setdefault(key, value)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[str, Any]) -> None:
+        if chat_id not in self._loaded_chat_ids:
+            await self.refresh_chat_data(chat_id, data)
+
+        blob = _dumps(data)
+        if self._written_digests.get(chat_id) == _digest(blob):
+            self._dirty.pop(chat_id, None)
+            return
+
+        self._dirty[chat_id] = blob
+        self._schedule_write()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._dirty.pop(chat_id, None)
+        self._written_digests.pop(chat_id, None)
+        self._loaded_chat_ids.discard(chat_id)
+        await asyncio.to_thread(self._delete_chat_row, chat_id)
+
+    async def flush(self) -> None:
+        if self._write_task is not None:
+            self._write_task.cancel()
+            self._write_task = None
+        await self._write_dirty()
+
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # Only chat_data is persisted, the rest are no-ops
+    async def get_user_data(self) -> Dict[int, Dict[str, Any]]:
+        return dict()
+
+    async def get_bot_data(self) -> Dict[str, Any]:
+        return dict()
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return dict()
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        pass
+
+    async def update_user_data(self, user_id: int, data: Dict[str, Any]) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[str, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[str, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[str, Any]) -> None:
+        pass
+
+
+async def get_known_chat_ids(application: Application) -> List[int]:
+    """
+    Every chat with chat_data, including chats that weren't loaded since startup
+    (see SqlitePersistence.refresh_chat_data).
+    """
+    chat_ids = set(application.chat_data)
+    if isinstance(application.persistence, SqlitePersistence):
+        chat_ids.update(await application.persistence.list_chat_ids())
+    return sorted(chat_ids)
+
+
+async def load_known_chat_data(application: Application) -> Dict[int, Dict[str, Any]]:
+    """chat_data of every known chat, loading the ones that weren't touched since startup."""
+    chats = dict()
+    for chat_id in await get_known_chat_ids(application):
+        chat_data = application.chat_data[chat_id]
+        if application.persistence is not None:
+            await application.persistence.refresh_chat_data(chat_id, chat_data)
+        chats[chat_id] = chat_data
+    return chats
@@ -9,13 +9,22 @@ from telegram.ext import (
 )
 import os
 from dotenv import load_dotenv
-from commands.admin_commands import cancel_command, help_command, refresh_command, schedule_command, start_command
+from commands.admin_commands import cancel_command, help_command, profile_command, refresh_command, schedule_command, start_command
 from commands.event_command import event_title
 from commands.habit_command import habit_title
 from commands.task_command import task_title
 from handlers.error_handlers import error_handler
 from handlers.handler import handle_callback_query, handle_text
+from lib.db_repository import stop_db_repository
+from lib.outbox import start_outbox, stop_outbox
+from lib.persistence import SqlitePersistence
+from utils.chat_data_janitor import add_chat_data_janitor
+from utils.constants import PERSISTENCE_FILEPATH, PERSISTENCE_UPDATE_INTERVAL_SECONDS
+from utils.credential_health_check import add_credential_health_check
+from utils.loop_watchdog import start_loop_watchdog, stop_loop_watchdog
+from utils.metrics import start_metrics_server, stop_metrics_server
 from utils.unknown_response import unknown_command, unknown_text
+from utils.user_preload import add_user_preload
 from enum import Enum
 
 load_dotenv()
@@ -23,6 +32,19 @@ load_dotenv()
 EXPECT_TEXT = range(1)
 
 
+async def post_init(application: Application) -> None:
+    await start_metrics_server(application)
+    await start_loop_watchdog(application)
+    await start_outbox(application)
+
+
+async def post_shutdown(application: Application) -> None:
+    await stop_outbox(application)
+    await stop_db_repository(application)
+    await stop_loop_watchdog(application)
+    await stop_metrics_server(application)
+
+
 # make command Enum
 class Command(str, Enum):
     START = "start"
@@ -33,12 +55,24 @@ class Command(str, Enum):
     HABIT = "habit"
     SCHEDULE = "schedule"
     REFRESH = "refresh"
+    PROFILE = "profile"
 
 
 if __name__ == "__main__":
     TOKEN = os.getenv("TOKEN") or ""
     # TOKEN = os.getenv("STAGING_TOKEN") or ""
-    app = Application.builder().token(TOKEN).build()
+    persistence = SqlitePersistence(
+        filepath=PERSISTENCE_FILEPATH,
+        update_interval=PERSISTENCE_UPDATE_INTERVAL_SECONDS,
+    )
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Commands
     app.add_handler(CommandHandler(Command.START, start_command))
@@ -51,6 +85,7 @@ if __name__ == "__main__":
 
     app.add_handler(CommandHandler(Command.SCHEDULE, schedule_command))
     app.add_handler(CommandHandler(Command.REFRESH, refresh_command))
+    app.add_handler(CommandHandler(Command.PROFILE, profile_command))
 
     # Handlers
     app.add_handler(CallbackQueryHandler(handle_callback_query))
@@ -66,6 +101,11 @@ if __name__ == "__main__":
     app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
     app.add_handler(MessageHandler(filters.TEXT, unknown_text))
 
+    # Housekeeping
+    add_chat_data_janitor(app)
+    add_credential_health_check(app)
+    add_user_preload(app)
+
     # Errors
     app.add_error_handler(error_handler)
 
@@ -3,7 +3,7 @@ from telegram.ext import ContextTypes
 from utils.logger_config import configure_logger
 from utils.utils import send_on_error_message
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 async def add_block_flows(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -17,13 +17,15 @@ async def add_block_flows(context: ContextTypes.DEFAULT_TYPE) -> None:
     from lib.google_cal import get_calendar_events
     from utils.job_queue import add_once_job
     from utils.datetime_utils import get_current_till_day_end_datetimes
+    from utils.google_quota import run_google_call
 
     user_id = context.chat_data["chat_id"]
     user = get_user(user_id)
 
     timeMin, timeMax = get_current_till_day_end_datetimes()
 
-    events = get_calendar_events(
+    events = await run_google_call(
+        get_calendar_events,
         refresh_token=user.get("google_refresh_token", ""),
         timeMin=timeMin.isoformat(),
         timeMax=timeMax.isoformat(),
@@ -2,7 +2,7 @@ from telegram.ext import ContextTypes
 from utils.logger_config import configure_logger
 from utils.utils import send_on_error_message
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 async def add_night_flow(context: ContextTypes.DEFAULT_TYPE) -> None:
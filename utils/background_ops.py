@@ -0,0 +1,135 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+from telegram import Message, Update
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+from utils.constants import BACKGROUND_OPS_MAX_CONCURRENT
+from utils.logger_config import configure_logger
+from utils.metrics import Gauge
+from utils.utils import send_message
+
+logger = configure_logger(__name__)
+
+BACKGROUND_OPS_RUNNING = Gauge(
+    "nova_background_ops_running", "Background operations currently running.", ["op"]
+)
+BACKGROUND_OPS_WAITING = Gauge(
+    "nova_background_ops_waiting", "Background operations waiting for a free slot.", ["op"]
+)
+
+# Edits the operation's status message
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+
+class BackgroundOp(NamedTuple):
+    name: str
+    task: asyncio.Task
+
+
+# chat_id -> the chat's running operation, at most one per chat
+_running_ops: Dict[str, BackgroundOp] = dict()
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+
+    # Created lazily so that it binds to the application's event loop
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(BACKGROUND_OPS_MAX_CONCURRENT)
+    return _semaphore
+
+
+async def _edit_status(
+    context: ContextTypes.DEFAULT_TYPE, status_message: Optional[Message], text: str
+) -> None:
+    if status_message is None:
+        return
+    try:
+        await context.bot.edit_message_text(
+            text, chat_id=status_message.chat_id, message_id=status_message.message_id
+        )
+    except BadRequest as e:
+        if "not modified" not in e.message.lower():
+            logger.info("Could not edit status message: %s", e.message)
+
+
+async def start_background_op(
+    update: Update | None,
+    context: ContextTypes.DEFAULT_TYPE,
+    name: str,
+    op: Callable[[ProgressCallback], Awaitable[None]],
+    ack_text: str,
+) -> bool:
+    """
+    Acknowledge with ack_text right away and run op as a background task.
+
+    op gets a callback that edits the acknowledgement into a progress update, and
+    sends its own result when it is done. Each chat runs one operation at a time,
+    which /cancel stops (see cancel_background_op), and at most
+    BACKGROUND_OPS_MAX_CONCURRENT run at once across all chats.
+    Returns whether the operation was started.
+    """
+    if context.chat_data is None:
+        return False
+    chat_id = context.chat_data["chat_id"]
+
+    if chat_id in _running_ops:
+        await send_message(
+            update,
+            context,
+            "I'm still working on your last request! Send /cancel to stop it.",
+        )
+        return False
+
+    status_message = await send_message(update, context, ack_text)
+
+    async def progress(text: str) -> None:
+        await _edit_status(context, status_message, text)
+
+    async def run() -> None:
+        semaphore = _get_semaphore()
+        try:
+            if semaphore.locked():
+                await progress("Lots going on right now, you're next in line...")
+            BACKGROUND_OPS_WAITING.inc(op=name)
+            try:
+                await semaphore.acquire()
+            finally:
+                BACKGROUND_OPS_WAITING.dec(op=name)
+
+            BACKGROUND_OPS_RUNNING.inc(op=name)
+            try:
+                await op(progress)
+            finally:
+                BACKGROUND_OPS_RUNNING.dec(op=name)
+                semaphore.release()
+        except asyncio.CancelledError:
+            logger.info("Background op %s canceled for chat %s", name, chat_id)
+            await progress("Canceled!")
+            raise
+        except Exception:
+            await progress("Something went wrong. Please try again later!")
+            # Re-raised so that the application passes it to the error handler
+            raise
+        finally:
+            # /cancel may already have let a newer operation take this chat's slot
+            running_op = _running_ops.get(chat_id)
+            if running_op is not None and running_op.task is asyncio.current_task():
+                del _running_ops[chat_id]
+
+    task = context.application.create_task(run(), update=update)
+    _running_ops[chat_id] = BackgroundOp(name=name, task=task)
+    return True
+
+
+def cancel_background_op(chat_id: str) -> Optional[str]:
+    """
+    Cancel the chat's running operation and return its name, if there is one.
+    Blocking calls already running in a thread still finish, but nothing after them runs.
+    """
+    background_op = _running_ops.pop(chat_id, None)
+    if background_op is None:
+        return None
+    background_op.task.cancel()
+    return background_op.name
@@ -0,0 +1,115 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import deepcopy
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from utils.constants import CALENDAR_PREFETCH_TTL_SECONDS, CALENDAR_PREFETCH_WAIT_SECONDS
+from utils.logger_config import configure_logger, log_chat_id
+from utils.request_scope import CachedEventWindow
+
+logger = configure_logger(__name__)
+
+# Threads don't inherit the handler's context, so prefetches never touch its request scope
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="calendar-prefetch")
+
+
+class PrefetchedWindow:
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        # Set by the prefetch thread once it has looked up the user
+        self.refresh_token: Optional[str] = None
+        self.future: "Optional[Future[CachedEventWindow]]" = None
+
+
+# Telegram user id -> the latest window prefetched for that user's calendar
+_prefetched: Dict[str, PrefetchedWindow] = dict()
+
+
+def _prune_expired() -> None:
+    now = time.monotonic()
+    for telegram_user_id, prefetched in list(_prefetched.items()):
+        if now - prefetched.started_at > CALENDAR_PREFETCH_TTL_SECONDS:
+            del _prefetched[telegram_user_id]
+
+
+def _run_prefetch(
+    prefetched: PrefetchedWindow,
+    get_refresh_token: Callable[[], str],
+    fetch: Callable[[str], CachedEventWindow],
+) -> CachedEventWindow:
+    prefetched.refresh_token = get_refresh_token()
+    return fetch(prefetched.refresh_token)
+
+
+def start_prefetch(
+    telegram_user_id: str,
+    get_refresh_token: Callable[[], str],
+    fetch: Callable[[str], CachedEventWindow],
+) -> None:
+    """
+    Look up the user's refresh token and run fetch with it in the background, and
+    keep the window for the next read of that calendar. Both run on the prefetch
+    thread, so the handler starting the prefetch doesn't wait on the backend.
+    """
+    _prune_expired()
+    prefetched = PrefetchedWindow(started_at=time.monotonic())
+    prefetched.future = _executor.submit(_run_prefetch, prefetched, get_refresh_token, fetch)
+    _prefetched[str(telegram_user_id)] = prefetched
+
+
+def _find_prefetched(refresh_token: str) -> Optional[Tuple[str, PrefetchedWindow]]:
+    # Reads run with the chat in log_chat_id, which finds a prefetch that is still
+    # looking up the user. Without it, only prefetches for this token can match.
+    chat_id = log_chat_id.get()
+    if chat_id is not None and str(chat_id) in _prefetched:
+        prefetched = _prefetched[str(chat_id)]
+        if prefetched.refresh_token in (None, refresh_token):
+            return str(chat_id), prefetched
+        return None
+    for telegram_user_id, prefetched in list(_prefetched.items()):
+        if prefetched.refresh_token == refresh_token:
+            return telegram_user_id, prefetched
+    return None
+
+
+def get_prefetched_events(
+    refresh_token: str,
+    q: Optional[str],
+    time_min: Optional[str],
+    time_max: Optional[str],
+    k: int,
+) -> Optional[List[Dict[str, Any]]]:
+    found = _find_prefetched(refresh_token)
+    if found is None:
+        return None
+    telegram_user_id, prefetched = found
+    if time.monotonic() - prefetched.started_at > CALENDAR_PREFETCH_TTL_SECONDS:
+        _prefetched.pop(telegram_user_id, None)
+        return None
+
+    try:
+        window = prefetched.future.result(timeout=CALENDAR_PREFETCH_WAIT_SECONDS)
+    except Exception:
+        logger.warning("Calendar prefetch failed, fetching directly", exc_info=True)
+        _prefetched.pop(telegram_user_id, None)
+        return None
+
+    events = window.serve(refresh_token, q, time_min, time_max, k)
+    return deepcopy(events) if events is not None else None
+
+
+def add_prefetched_event(refresh_token: str, event: Dict[str, Any]) -> None:
+    # Prefetches still looking up the user haven't read the calendar yet, so they will see it
+    for telegram_user_id, prefetched in list(_prefetched.items()):
+        if prefetched.refresh_token != refresh_token:
+            continue
+        if prefetched.future.done() and prefetched.future.exception() is None:
+            prefetched.future.result().add_event(deepcopy(event))
+        else:
+            # The fetch may or may not see the new event, so its result can't be trusted
+            _prefetched.pop(telegram_user_id, None)
+
+
+def discard_prefetched_events(refresh_token: str) -> None:
+    for telegram_user_id, prefetched in list(_prefetched.items()):
+        if prefetched.refresh_token == refresh_token:
+            _prefetched.pop(telegram_user_id, None)
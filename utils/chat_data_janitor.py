@@ -0,0 +1,133 @@
+import pickle
+import time
+from typing import Any, Dict, Mapping, Tuple
+from telegram.ext import Application, ContextTypes
+from utils.constants import (
+    CHAT_DATA_JANITOR_INTERVAL_SECONDS,
+    CHAT_DATA_MAX_BYTES,
+    CHAT_DATA_STATE_TTL_SECONDS,
+)
+from utils.logger_config import configure_logger
+from utils.metrics import Gauge
+
+logger = configure_logger(__name__)
+
+CHAT_DATA_BYTES = Gauge("nova_chat_data_bytes", "Total size of all chats' chat_data.")
+CHAT_DATA_CHATS = Gauge("nova_chat_data_chats", "Chats with chat_data in memory.")
+
+# Per-flow scratch dicts, only meaningful while the flow is in progress
+SCRATCH_CHAT_DATA_KEYS = (
+    "new_event",
+    "new_task",
+    "new_habit",
+    "new_block",
+    "job",
+    "night_flow_review",
+)
+# Keys that are never evicted to bring a chat under CHAT_DATA_MAX_BYTES. The card is
+# edited in place, and the revoked grant (see credential_health_check) stops a re-prompt.
+PROTECTED_CHAT_DATA_KEYS = (
+    "chat_id",
+    "state",
+    "last_active_at",
+    "schedule_card",
+    "revoked_google_grant",
+)
+
+
+def touch_chat_data(chat_data: Dict[str, Any]) -> None:
+    chat_data["last_active_at"] = time.time()
+
+
+def get_chat_data_size(chat_data: Mapping[str, Any]) -> int:
+    """Approximate size of a chat's data in bytes, as it would be persisted."""
+    return len(pickle.dumps(dict(chat_data), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def get_chat_data_sizes(application: Application) -> Tuple[Dict[int, int], int]:
+    """Returns the size in bytes of every chat's data, and the total."""
+    sizes = {
+        chat_id: get_chat_data_size(chat_data)
+        for chat_id, chat_data in application.chat_data.items()
+    }
+    return sizes, sum(sizes.values())
+
+
+def evict_stale_flow_state(chat_data: Dict[str, Any], now: float) -> bool:
+    """Drop scratch dicts and reset state for a flow abandoned longer than the TTL."""
+    last_active_at = chat_data.get("last_active_at")
+    if last_active_at is None:
+        # Data from before last_active_at existed, start the clock now
+        chat_data["last_active_at"] = now
+        return False
+    if now - last_active_at < CHAT_DATA_STATE_TTL_SECONDS:
+        return False
+
+    evicted = False
+    for key in SCRATCH_CHAT_DATA_KEYS:
+        if chat_data.pop(key, None) is not None:
+            evicted = True
+    if chat_data.pop("state", None) is not None:
+        evicted = True
+    return evicted
+
+
+def enforce_chat_data_cap(chat_data: Dict[str, Any]) -> bool:
+    """Evict scratch dicts, then the largest remaining keys, until under the cap."""
+    if get_chat_data_size(chat_data) <= CHAT_DATA_MAX_BYTES:
+        return False
+
+    for key in SCRATCH_CHAT_DATA_KEYS:
+        chat_data.pop(key, None)
+
+    evictable_keys = sorted(
+        (key for key in chat_data if key not in PROTECTED_CHAT_DATA_KEYS),
+        key=lambda key: get_chat_data_size({key: chat_data[key]}),
+        reverse=True,
+    )
+    for key in evictable_keys:
+        if get_chat_data_size(chat_data) <= CHAT_DATA_MAX_BYTES:
+            break
+        chat_data.pop(key, None)
+
+    return True
+
+
+async def clean_chat_data(context: ContextTypes.DEFAULT_TYPE) -> None:
+    now = time.time()
+    changed_chat_ids = set()
+
+    for chat_id, chat_data in context.application.chat_data.items():
+        if evict_stale_flow_state(chat_data, now):
+            changed_chat_ids.add(chat_id)
+        if enforce_chat_data_cap(chat_data):
+            logger.warning("chat_data for %s exceeded %d bytes", chat_id, CHAT_DATA_MAX_BYTES)
+            changed_chat_ids.add(chat_id)
+
+    if changed_chat_ids:
+        context.application.mark_data_for_update_persistence(chat_ids=changed_chat_ids)
+
+    sizes, total = get_chat_data_sizes(context.application)
+    CHAT_DATA_BYTES.set(total)
+    CHAT_DATA_CHATS.set(len(sizes))
+    largest = sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:5]
+    logger.info(
+        "chat_data: %d chats, %d bytes total, cleaned %d, largest %s",
+        len(sizes),
+        total,
+        len(changed_chat_ids),
+        largest,
+    )
+
+
+def add_chat_data_janitor(application: Application) -> None:
+    if application.job_queue is None:
+        logger.error("application.job_queue is None for add_chat_data_janitor")
+        return
+
+    application.job_queue.run_repeating(
+        clean_chat_data,
+        interval=CHAT_DATA_JANITOR_INTERVAL_SECONDS,
+        first=CHAT_DATA_JANITOR_INTERVAL_SECONDS,
+        name="repeating_clean_chat_data",
+    )
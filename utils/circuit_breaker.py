@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import deque
+from enum import Enum
+from functools import wraps
+from typing import Callable, Deque
+from utils.logger_config import configure_logger
+from utils.metrics import Gauge
+
+logger = configure_logger(__name__)
+
+CIRCUIT_BREAKER_STATE = Gauge(
+    "nova_circuit_breaker_open",
+    "1 while the circuit breaker is open or half-open, else 0.",
+    ["breaker"],
+)
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} circuit is open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while an upstream is unhealthy.
+
+    Trips open when, over the last window_size calls, the share of calls that
+    failed or took longer than slow_call_seconds reaches failure_rate. After
+    open_seconds, a single trial call is let through: it closes the circuit if it
+    succeeds and opens it again if it doesn't.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        window_size: int,
+        min_calls: int,
+        failure_rate: float,
+        slow_call_seconds: float,
+        open_seconds: float,
+        is_failure: Callable[[Exception], bool] = lambda e: True,
+    ):
+        self.name = name
+        self._min_calls = min_calls
+        self._failure_rate = failure_rate
+        self._slow_call_seconds = slow_call_seconds
+        self._open_seconds = open_seconds
+        self._is_failure = is_failure
+
+        self._lock = threading.Lock()
+        self._results: Deque[bool] = deque(maxlen=window_size)  # True for bad calls
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._trial_running = False
+        CIRCUIT_BREAKER_STATE.set(0, breaker=name)
+
+    @property
+    def state(self) -> CircuitState:
+        return self._state
+
+    def is_open(self) -> bool:
+        return self._state != CircuitState.CLOSED
+
+    def _set_state(self, state: CircuitState) -> None:
+        if state != self._state:
+            logger.warning("%s circuit is now %s", self.name, state.value)
+        self._state = state
+        CIRCUIT_BREAKER_STATE.set(0 if state == CircuitState.CLOSED else 1, breaker=self.name)
+
+    def check(self) -> None:
+        """Raise CircuitOpenError if a call would be rejected now, without making one."""
+        with self._lock:
+            if self._state == CircuitState.CLOSED:
+                return
+            retry_after = self._opened_at + self._open_seconds - time.monotonic()
+            if (self._state == CircuitState.OPEN and retry_after > 0) or (
+                self._state == CircuitState.HALF_OPEN and self._trial_running
+            ):
+                raise CircuitOpenError(self.name, max(retry_after, 1))
+
+    def _before_call(self) -> bool:
+        """Raise if the call isn't allowed. Returns whether it is the half-open trial."""
+        with self._lock:
+            if self._state == CircuitState.CLOSED:
+                return False
+
+            retry_after = self._opened_at + self._open_seconds - time.monotonic()
+            if self._state == CircuitState.OPEN and retry_after <= 0:
+                self._set_state(CircuitState.HALF_OPEN)
+            if self._state == CircuitState.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            raise CircuitOpenError(self.name, max(retry_after, 1))
+
+    def _after_call(self, is_trial: bool, is_bad: bool) -> None:
+        with self._lock:
+            if is_trial:
+                self._trial_running = False
+                self._results.clear()
+                if is_bad:
+                    self._opened_at = time.monotonic()
+                    self._set_state(CircuitState.OPEN)
+                else:
+                    self._set_state(CircuitState.CLOSED)
+                return
+
+            self._results.append(is_bad)
+            if (
+                self._state == CircuitState.CLOSED
+                and len(self._results) >= self._min_calls
+                and sum(self._results) / len(self._results) >= self._failure_rate
+            ):
+                self._opened_at = time.monotonic()
+                self._set_state(CircuitState.OPEN)
+
+    def call(self, func: Callable, *args, **kwargs):
+        is_trial = self._before_call()
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._after_call(is_trial, self._is_failure(e))
+            raise
+        self._after_call(is_trial, time.perf_counter() - start > self._slow_call_seconds)
+        return result
+
+    def guard(self, func: Callable) -> Callable:
+        """Decorator form of call."""
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+
+        return wrapper
+
+    def fail_fast(self, func: Callable) -> Callable:
+        """
+        Decorator that raises CircuitOpenError before func runs while calls would be
+        rejected. For functions that do more than the call, which they make with call.
+        """
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            self.check()
+            return func(*args, **kwargs)
+
+        return wrapper
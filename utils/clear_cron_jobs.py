@@ -2,7 +2,7 @@ from telegram.ext import ContextTypes
 from utils.logger_config import configure_logger
 from utils.utils import send_on_error_message
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 async def clear_cron_jobs(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -18,4 +18,4 @@ async def clear_cron_jobs(context: ContextTypes.DEFAULT_TYPE) -> None:
 
     for job in context.job_queue.jobs():
         job.schedule_removal()
-        logger.info(f"Job {job} removed")
+        logger.info("Job %s removed", job)
@@ -12,6 +12,8 @@ NIGHT_FLOW_TIME = time(hour=20, minute=0, second=0, tzinfo=NEW_YORK_TIMEZONE_INF
 get_current_datetime = lambda: datetime.now(tz=NEW_YORK_TIMEZONE_INFO) + timedelta(hours=0, minutes=0, seconds=20)
 CURRENT_DATETIME = get_current_datetime()
 GOOGLE_CAL_BASE_URL = "https://calendar.google.com/calendar/u/0/r"
+# The Calendar batch endpoint takes at most 50 requests per call
+GOOGLE_CAL_BATCH_MAX_OPS = 50
 GOOGLE_SCOPES = [
     "https://www.googleapis.com/auth/userinfo.email",
     "openid",
@@ -22,6 +24,72 @@ _ENV = getenv("ENVIRONMENT")  # "dev" or "prod"
 BASE_URL = (
     "http://127.0.0.1:8000" if _ENV == "dev" else "https://nova-api-ten.vercel.app"
 )
+PERSISTENCE_FILEPATH = getenv("PERSISTENCE_FILEPATH") or "nova_chat_data.sqlite3"
+PERSISTENCE_UPDATE_INTERVAL_SECONDS = float(
+    getenv("PERSISTENCE_UPDATE_INTERVAL_SECONDS") or "15"
+)
+# Abandoned flow state is evicted after this long without activity
+CHAT_DATA_STATE_TTL_SECONDS = float(getenv("CHAT_DATA_STATE_TTL_SECONDS") or "21600")
+CHAT_DATA_MAX_BYTES = int(getenv("CHAT_DATA_MAX_BYTES") or "65536")
+CHAT_DATA_JANITOR_INTERVAL_SECONDS = float(
+    getenv("CHAT_DATA_JANITOR_INTERVAL_SECONDS") or "600"
+)
+# Repeats of the same error within this window are sent to the developer as one summary
+ERROR_ALERT_WINDOW_SECONDS = float(getenv("ERROR_ALERT_WINDOW_SECONDS") or "300")
+# Port of the Prometheus /metrics endpoint, 0 disables it. The endpoint has no auth,
+# so it only listens on localhost unless METRICS_HOST says otherwise.
+METRICS_HOST = getenv("METRICS_HOST") or "127.0.0.1"
+METRICS_PORT = int(getenv("METRICS_PORT") or "9464")
+# Reports callbacks that hold the event loop for longer than the threshold
+LOOP_WATCHDOG_ENABLED = (getenv("LOOP_WATCHDOG_ENABLED") or "0") == "1"
+LOOP_WATCHDOG_THRESHOLD_SECONDS = float(getenv("LOOP_WATCHDOG_THRESHOLD_SECONDS") or "0.25")
+LOOP_WATCHDOG_INTERVAL_SECONDS = float(getenv("LOOP_WATCHDOG_INTERVAL_SECONDS") or "0.05")
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_SAMPLE_INTERVAL_SECONDS = 0.01
+# Calendar windows prefetched while the user is still answering a multi-step command
+CALENDAR_PREFETCH_TTL_SECONDS = float(getenv("CALENDAR_PREFETCH_TTL_SECONDS") or "300")
+# How long the final step waits for an unfinished prefetch before fetching itself
+CALENDAR_PREFETCH_WAIT_SECONDS = float(getenv("CALENDAR_PREFETCH_WAIT_SECONDS") or "10")
+# Slow operations like habit creation run in the background, at most this many at once
+BACKGROUND_OPS_MAX_CONCURRENT = int(getenv("BACKGROUND_OPS_MAX_CONCURRENT") or "8")
+# Backend and calendar mutations are recorded here and sent in the background
+OUTBOX_FILEPATH = getenv("OUTBOX_FILEPATH") or "nova_outbox.sqlite3"
+OUTBOX_POLL_INTERVAL_SECONDS = float(getenv("OUTBOX_POLL_INTERVAL_SECONDS") or "5")
+OUTBOX_RETRY_BASE_SECONDS = float(getenv("OUTBOX_RETRY_BASE_SECONDS") or "2")
+OUTBOX_MAX_ATTEMPTS = int(getenv("OUTBOX_MAX_ATTEMPTS") or "8")
+OUTBOX_RETENTION_SECONDS = float(getenv("OUTBOX_RETENTION_SECONDS") or "86400")
+# Inserts of an event id written within this long are skipped as duplicates
+RECENT_EVENT_WRITES_TTL_SECONDS = float(getenv("RECENT_EVENT_WRITES_TTL_SECONDS") or "86400")
+# Project-wide Google Calendar quota, shared fairly between users
+GOOGLE_CAL_QUOTA_PER_SECOND = float(getenv("GOOGLE_CAL_QUOTA_PER_SECOND") or "10")
+GOOGLE_CAL_QUOTA_BURST = float(getenv("GOOGLE_CAL_QUOTA_BURST") or "20")
+# Threads per priority that Calendar calls from handlers and jobs wait for quota on
+GOOGLE_CAL_THREADS = int(getenv("GOOGLE_CAL_THREADS") or "16")
+GOOGLE_CAL_TIMEOUT_SECONDS = float(getenv("GOOGLE_CAL_TIMEOUT_SECONDS") or "10")
+# Calendar calls fail fast once this share of the last calls failed or were slow
+GOOGLE_CAL_BREAKER_WINDOW = 20
+GOOGLE_CAL_BREAKER_MIN_CALLS = 5
+GOOGLE_CAL_BREAKER_FAILURE_RATE = 0.5
+GOOGLE_CAL_BREAKER_SLOW_CALL_SECONDS = 5
+GOOGLE_CAL_BREAKER_OPEN_SECONDS = 30
+STALE_SCHEDULE_NOTE = "(I can't reach Google Calendar right now, so this schedule may be stale!)"
+# Access tokens last an hour, and are refreshed in the background this long before that
+GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS = 300
+GOOGLE_TOKEN_REFRESH_MAX_CONCURRENT = int(getenv("GOOGLE_TOKEN_REFRESH_MAX_CONCURRENT") or "4")
+# Every user's refresh token is checked nightly, this many at a time
+CREDENTIAL_HEALTH_CHECK_TIME = time(hour=3, minute=0, second=0, tzinfo=NEW_YORK_TIMEZONE_INFO)
+CREDENTIAL_HEALTH_CHECK_CONCURRENCY = int(getenv("CREDENTIAL_HEALTH_CHECK_CONCURRENCY") or "8")
+# "api" goes through the backend at BASE_URL, "database" reads and writes DATABASE_URL directly
+DATA_BACKEND = getenv("DATA_BACKEND") or "api"
+DATABASE_URL = getenv("DATABASE_URL") or ""
+DATABASE_POOL_SIZE = int(getenv("DATABASE_POOL_SIZE") or "5")
+# Users are loaded in bulk shortly before the morning and night flows fan out
+USER_BULK_BATCH_SIZE = 200
+USER_PRELOAD_LEAD_SECONDS = 60
+USER_PRELOAD_TTL_SECONDS = 300
+# Tasks that fit no single free slot are split into chunks at least this long
+TASK_MIN_CHUNK_MINUTES = int(getenv("TASK_MIN_CHUNK_MINUTES") or "30")
 READYMADE_RESPONSES = [
     "Embrace the glorious mess that you are and get stuff done!",
     "Progress, not perfection. Just do your best and keep going.",
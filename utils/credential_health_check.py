@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+from typing import Any, Dict, Optional
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, ContextTypes
+from lib.api_handler import get_google_oauth_login_url, get_user, get_users
+from lib.google_tokens import validate_google_grant
+from lib.persistence import load_known_chat_data
+from utils.constants import (
+    CREDENTIAL_HEALTH_CHECK_CONCURRENCY,
+    CREDENTIAL_HEALTH_CHECK_TIME,
+    DAY_START_TIME,
+)
+from utils.logger_config import configure_logger, log_chat_id
+from utils.metrics import Counter
+
+logger = configure_logger(__name__)
+
+CREDENTIAL_HEALTH_CHECKS = Counter(
+    "nova_credential_health_checks_total",
+    "Nightly refresh token checks by outcome.",
+    ["outcome"],
+)
+
+# chat_data key holding a fingerprint of the user's refresh token that Google rejected
+REVOKED_GRANT_KEY = "revoked_google_grant"
+# Jobs that only read the calendar, which can't work until the user logs in again
+_SUPPRESSED_JOB_PREFIXES = ("daily_morning_flow_", "once_block_start_alert_")
+
+
+def _get_grant_fingerprint(refresh_token: str) -> str:
+    # The token itself isn't kept in chat_data, which is persisted to disk
+    return hashlib.sha256(refresh_token.encode()).hexdigest()[:16]
+
+
+def has_revoked_google_grant(chat_data: Dict[str, Any], user: Dict[str, Any]) -> bool:
+    """
+    Whether the health check found the user's current refresh token revoked.
+    Once the user logs in again their token changes, and the flag is dropped.
+    """
+    fingerprint = chat_data.get(REVOKED_GRANT_KEY)
+    if fingerprint is None:
+        return False
+    refresh_token = user.get("google_refresh_token")
+    if refresh_token and _get_grant_fingerprint(refresh_token) == fingerprint:
+        return True
+    chat_data.pop(REVOKED_GRANT_KEY, None)
+    return False
+
+
+def _remove_calendar_jobs(context: ContextTypes.DEFAULT_TYPE, chat_id: str) -> None:
+    if context.job_queue is None:
+        return
+    for job in context.job_queue.jobs():
+        if str(job.chat_id) == chat_id and (job.name or "").startswith(_SUPPRESSED_JOB_PREFIXES):
+            job.schedule_removal()
+            logger.info("Job %s removed, the user's Google login was revoked", job.name)
+
+
+async def send_relogin_prompt(context: ContextTypes.DEFAULT_TYPE) -> None:
+    if context.job is None or context.job.chat_id is None:
+        return
+
+    url = await asyncio.to_thread(
+        get_google_oauth_login_url,
+        telegram_user_id=str(context.job.chat_id),
+        username=str(context.job.data or "user"),
+    )
+    keyboard = [[InlineKeyboardButton("Click me!", url=url)]]
+    await context.bot.send_message(
+        context.job.chat_id,
+        "You'll need to login to Google Calendar again!",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+async def _check_chat(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: str,
+    chat_data: Dict[str, Any],
+    semaphore: asyncio.Semaphore,
+) -> Optional[str]:
+    """Check one user's refresh token. Returns its outcome, or None if there was nothing to check."""
+    async with semaphore:
+        # Runs in its own task (see check_credentials), so this only applies to this chat
+        log_chat_id.set(chat_id)
+        user = await asyncio.to_thread(get_user, chat_id)
+        refresh_token = user.get("google_refresh_token")
+        if not refresh_token:
+            return None
+        if await asyncio.to_thread(validate_google_grant, refresh_token):
+            chat_data.pop(REVOKED_GRANT_KEY, None)
+            return "valid"
+
+    fingerprint = _get_grant_fingerprint(refresh_token)
+    _remove_calendar_jobs(context, chat_id)
+    if chat_data.get(REVOKED_GRANT_KEY) == fingerprint:
+        # Already prompted on an earlier night
+        return "revoked"
+
+    chat_data[REVOKED_GRANT_KEY] = fingerprint
+    if context.job_queue is not None:
+        job_name = f"relogin_prompt_{chat_id}"
+        for job in context.job_queue.get_jobs_by_name(job_name):
+            job.schedule_removal()
+        # Sent at the start of the day rather than in the middle of the night
+        context.job_queue.run_once(
+            send_relogin_prompt,
+            DAY_START_TIME,
+            chat_id=int(chat_id),
+            name=job_name,
+            data=user.get("username") or "user",
+        )
+    return "revoked"
+
+
+async def check_credentials(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Check every user's Google refresh token. Users whose token was revoked stop
+    getting calendar jobs until they log in again, and get one prompt to do so.
+    """
+    semaphore = asyncio.Semaphore(CREDENTIAL_HEALTH_CHECK_CONCURRENCY)
+    chats = [
+        (str(chat_data["chat_id"]), chat_data)
+        for chat_data in (await load_known_chat_data(context.application)).values()
+        if chat_data.get("chat_id")
+    ]
+    try:
+        await asyncio.to_thread(get_users, [chat_id for chat_id, _ in chats])
+    except Exception:
+        logger.warning("Could not preload users, loading them one by one", exc_info=True)
+    outcomes = await asyncio.gather(
+        *(_check_chat(context, chat_id, chat_data, semaphore) for chat_id, chat_data in chats),
+        return_exceptions=True,
+    )
+
+    changed_chat_ids = set()
+    for (chat_id, chat_data), outcome in zip(chats, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.warning("Could not check credentials for %s: %r", chat_id, outcome)
+            outcome = "error"
+        if outcome is None:
+            continue
+        CREDENTIAL_HEALTH_CHECKS.inc(outcome=outcome)
+        changed_chat_ids.add(int(chat_id))
+    if changed_chat_ids:
+        context.application.mark_data_for_update_persistence(chat_ids=changed_chat_ids)
+
+    logger.info("Checked credentials for %d chats", len(changed_chat_ids))
+
+
+def add_credential_health_check(application: Application) -> None:
+    if application.job_queue is None:
+        logger.error("application.job_queue is None for add_credential_health_check")
+        return
+
+    application.job_queue.run_daily(
+        check_credentials,
+        CREDENTIAL_HEALTH_CHECK_TIME,
+        name="daily_check_credentials",
+    )
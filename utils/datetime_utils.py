@@ -45,25 +45,31 @@ def get_current_till_day_end_datetimes() -> Tuple[datetime, datetime]:
 
 def get_current_till_midnight_datetimes() -> Tuple[datetime, datetime]:
     current = datetime.now(tz=NEW_YORK_TIMEZONE_INFO)
-    midnight = datetime.now(tz=NEW_YORK_TIMEZONE_INFO).replace(
-        hour=23, minute=59, second=59
-    )
+    # No microseconds, so that windows read within one request end at the same instant
+    midnight = current.replace(hour=23, minute=59, second=59, microsecond=0)
 
     return current, midnight
 
 
 def get_tomorrow_start_end_datetimes() -> Tuple[datetime, datetime]:
     today_date = (datetime.now(tz=NEW_YORK_TIMEZONE_INFO) + timedelta(days=1)).date()
-    day_start = datetime.combine(
-        today_date,
-        DAY_START_TIME,
-        tzinfo=NEW_YORK_TIMEZONE_INFO,
+    # localize, since pytz time zones passed as tzinfo use the LMT offset (-4:56)
+    day_start = NEW_YORK_TIMEZONE_INFO.localize(
+        datetime.combine(today_date, DAY_START_TIME.replace(tzinfo=None))
     )
-    day_end = datetime.combine(
-        today_date,
-        DAY_END_TIME,
-        tzinfo=NEW_YORK_TIMEZONE_INFO,
+    day_end = NEW_YORK_TIMEZONE_INFO.localize(
+        datetime.combine(today_date, DAY_END_TIME.replace(tzinfo=None))
+    )
+    return day_start, day_end
+
+
+def get_mmdd_day_datetimes(date_str: str) -> Tuple[datetime, datetime]:
+    """Get the whole day of an MMDD date in the current year, from 0000 to 0000 the next day."""
+    day = datetime.strptime(
+        str(datetime.now(tz=NEW_YORK_TIMEZONE_INFO).year) + date_str, "%Y%m%d"
     )
+    day_start = NEW_YORK_TIMEZONE_INFO.localize(day)
+    day_end = NEW_YORK_TIMEZONE_INFO.localize(day + timedelta(days=1))
     return day_start, day_end
 
 
@@ -74,7 +80,7 @@ def get_closest_week() -> Tuple[datetime, datetime]:
     # Preserve timezone info in lambdas for precision
     gen_closest_sunday_midnight = lambda: datetime.now(
         tz=NEW_YORK_TIMEZONE_INFO
-    ).replace(hour=0, minute=0, second=0) + timedelta(
+    ).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(
         days=6 - datetime.now(tz=NEW_YORK_TIMEZONE_INFO).weekday()
     )
     gen_next_saturday_night = lambda: (
@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime
+from enum import IntEnum
+from functools import partial, wraps
+from typing import Callable, Dict, List, Tuple, TypeVar
+from utils.constants import (
+    GOOGLE_CAL_QUOTA_BURST,
+    GOOGLE_CAL_QUOTA_PER_SECOND,
+    GOOGLE_CAL_THREADS,
+    NEW_YORK_TIMEZONE_INFO,
+)
+from utils.logger_config import configure_logger, log_chat_id
+from utils.metrics import Counter, Gauge, Histogram
+
+logger = configure_logger(__name__)
+
+
+class CallPriority(IntEnum):
+    # Lower values are served first
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+# Handlers run as INTERACTIVE, while jobs, prefetches and the outbox run as BACKGROUND
+google_call_priority: ContextVar[CallPriority] = ContextVar(
+    "google_call_priority", default=CallPriority.INTERACTIVE
+)
+
+GOOGLE_QUOTA_WAIT = Histogram(
+    "nova_google_quota_wait_seconds",
+    "Time a Google Calendar call waited for quota.",
+    ["priority"],
+)
+GOOGLE_QUOTA_CALLS = Counter(
+    "nova_google_quota_calls_total",
+    "Google Calendar requests charged against the quota.",
+    ["priority"],
+)
+# Per-user usage stays in the ledger (see get_usage_today), one label per user would be unbounded
+GOOGLE_QUOTA_USERS_TODAY = Gauge(
+    "nova_google_quota_users_today",
+    "Users charged for Google Calendar requests today (New York time).",
+)
+GOOGLE_QUOTA_MAX_USER_CALLS_TODAY = Gauge(
+    "nova_google_quota_max_user_calls_today",
+    "Most Google Calendar requests charged to one user today (New York time).",
+)
+
+# (priority, virtual finish tag, arrival order, virtual start tag)
+_Entry = Tuple[int, float, int, float]
+
+
+class FairTokenBucket:
+    """
+    Token bucket shared by all threads, handing tokens out by priority and then by
+    start-time fair queuing across users: each user's calls are tagged with virtual
+    finish times, so a user with many queued calls can't starve the others.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue: List[_Entry] = []
+        self._order = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = dict()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    def acquire(self, user: str, cost: float, priority: CallPriority) -> float:
+        """Block until cost tokens are granted to this call. Returns the time waited."""
+        started_at = time.monotonic()
+        with self._cond:
+            start_tag = max(self._virtual_time, self._last_finish.get(user, 0.0))
+            entry: _Entry = (int(priority), start_tag + cost, next(self._order), start_tag)
+            self._last_finish[user] = entry[1]
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    self._refill()
+                    is_next = self._queue[0] is entry
+                    # Calls larger than the bucket are let through once it is full
+                    if is_next and self._tokens >= min(cost, self._burst):
+                        heapq.heappop(self._queue)
+                        self._tokens -= cost
+                        self._virtual_time = max(self._virtual_time, start_tag)
+                        self._prune_users()
+                        self._cond.notify_all()
+                        return time.monotonic() - started_at
+                    timeout = (
+                        (min(cost, self._burst) - self._tokens) / self._rate if is_next else None
+                    )
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+
+    def _prune_users(self) -> None:
+        # Users whose calls are all behind the virtual time have no effect on fairness
+        if len(self._last_finish) > 1024:
+            self._last_finish = {
+                user: finish
+                for user, finish in self._last_finish.items()
+                if finish > self._virtual_time
+            }
+
+
+_bucket = FairTokenBucket(GOOGLE_CAL_QUOTA_PER_SECOND, GOOGLE_CAL_QUOTA_BURST)
+_ledger_lock = threading.Lock()
+_ledger_day = ""
+_ledger: Dict[str, float] = dict()
+_ledger_max = 0.0
+
+
+def _record_usage(user: str, cost: float) -> None:
+    global _ledger_day, _ledger, _ledger_max
+
+    today = datetime.now(tz=NEW_YORK_TIMEZONE_INFO).date().isoformat()
+    with _ledger_lock:
+        if today != _ledger_day:
+            if _ledger:
+                top_users = sorted(_ledger.items(), key=lambda item: item[1], reverse=True)[:5]
+                logger.info(
+                    "Google Calendar quota on %s: %d users, top %s",
+                    _ledger_day,
+                    len(_ledger),
+                    top_users,
+                )
+            _ledger_day = today
+            _ledger = dict()
+            _ledger_max = 0.0
+        _ledger[user] = _ledger.get(user, 0) + cost
+        _ledger_max = max(_ledger_max, _ledger[user])
+        GOOGLE_QUOTA_USERS_TODAY.set(len(_ledger))
+        GOOGLE_QUOTA_MAX_USER_CALLS_TODAY.set(_ledger_max)
+
+
+def get_usage_today() -> Dict[str, float]:
+    with _ledger_lock:
+        return dict(_ledger)
+
+
+def is_on_event_loop() -> bool:
+    """Whether this thread is running an event loop, where blocking calls stall every handler."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+T = TypeVar("T")
+
+# Calls wait for quota on these threads rather than on the event loop. Each priority
+# has its own threads, so background calls waiting for quota never keep interactive
+# ones from reaching the bucket.
+_executors = {
+    priority: ThreadPoolExecutor(
+        max_workers=GOOGLE_CAL_THREADS,
+        thread_name_prefix=f"google-calendar-{priority.name.lower()}",
+    )
+    for priority in CallPriority
+}
+
+
+async def run_google_call(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    asyncio.to_thread for functions that call Google Calendar, which is how handlers
+    and jobs call them. Runs with the caller's context, so its chat and priority apply.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _executors[google_call_priority.get()], partial(context.run, func, *args, **kwargs)
+    )
+
+
+def schedule_google_call(cost: Callable[..., float] = lambda *args, **kwargs: 1):
+    """
+    Wait for quota before each call of a Google Calendar client function. cost is
+    called with the function's arguments, since e.g. a batch is charged per request.
+    The call is charged to the chat in log_chat_id, at the priority in google_call_priority.
+    Waiting for quota blocks, so these functions can't be called on the event loop
+    (see run_google_call).
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if is_on_event_loop():
+                raise RuntimeError(f"{func.__name__} called on the event loop, use run_google_call")
+            user = log_chat_id.get() or "unknown"
+            priority = google_call_priority.get()
+            call_cost = cost(*args, **kwargs)
+
+            waited = _bucket.acquire(user, call_cost, priority)
+            GOOGLE_QUOTA_WAIT.observe(waited, priority=priority.name.lower())
+            GOOGLE_QUOTA_CALLS.inc(call_cost, priority=priority.name.lower())
+            _record_usage(user, call_cost)
+            if waited > 1:
+                logger.info("Waited %.1fs for Google Calendar quota", waited)
+
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
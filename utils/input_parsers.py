@@ -0,0 +1,57 @@
+from datetime import datetime
+from typing import Any, Dict
+from utils.constants import NEW_YORK_TIMEZONE_INFO
+
+MAX_DURATION_MINUTES = 24 * 60
+
+
+def parse_mmdd(text: str) -> str:
+    """Validate a MMDD date, e.g. 1031. Raises ValueError with a user-facing message."""
+    text = text.strip()
+    try:
+        if len(text) != 4 or not text.isdigit():
+            raise ValueError
+        # Parse with the current year so that 0229 is accepted in leap years
+        datetime.strptime(
+            str(datetime.now(tz=NEW_YORK_TIMEZONE_INFO).year) + text, "%Y%m%d"
+        )
+    except ValueError:
+        raise ValueError("That doesn't look like a date. Please use MMDD, e.g. 1031.")
+    return text
+
+
+def parse_hhmm(text: str) -> str:
+    """Validate a 24h HHMM time, e.g. 1930. Raises ValueError with a user-facing message."""
+    text = text.strip()
+    try:
+        if len(text) != 4 or not text.isdigit():
+            raise ValueError
+        datetime.strptime(text, "%H%M")
+    except ValueError:
+        raise ValueError("That doesn't look like a time. Please use HHMM, e.g. 1930.")
+    return text
+
+
+def parse_minutes(text: str) -> str:
+    """Validate a duration in whole minutes. Raises ValueError with a user-facing message."""
+    text = text.strip()
+    if not text.isdigit() or not 0 < int(text) <= MAX_DURATION_MINUTES:
+        raise ValueError(
+            f"Please send the number of minutes, between 1 and {MAX_DURATION_MINUTES}."
+        )
+    return str(int(text))
+
+
+def parse_times_per_week(text: str) -> str:
+    text = text.strip()
+    if not text.isdigit() or not 0 < int(text) <= 7:
+        raise ValueError("Please send a number of days between 1 and 7.")
+    return str(int(text))
+
+
+def validate_end_after_start(end_time: str, new_event: Dict[str, Any]) -> None:
+    start_time = new_event.get("start_time")
+    if start_time and end_time <= start_time:
+        raise ValueError(
+            "The event has to end after it starts (" + start_time + "). When does it end?"
+        )
@@ -6,7 +6,7 @@ from utils.constants import NEW_YORK_TIMEZONE_INFO
 from utils.logger_config import configure_logger
 from utils.utils import send_on_error_message
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 def remove_job_if_exists(job_name: str, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -21,7 +21,7 @@ def remove_job_if_exists(job_name: str, context: ContextTypes.DEFAULT_TYPE) -> b
         return False
     for job in current_jobs:
         job.schedule_removal()
-        logger.info(f"Job {job} removed, Name: {job_name}")
+        logger.info("Job %s removed, Name: %s", job, job_name)
     return True
 
 
@@ -49,7 +49,7 @@ async def add_once_job(
             callback, when, chat_id=chat_id, name=job_name, data=data
         )
 
-        logger.info(f"Once job {job_name} added for {chat_id} at {when}")
+        logger.info("Once job %s added for %s at %s", job_name, chat_id, when)
 
 
 async def add_daily_job(
@@ -79,8 +79,8 @@ async def add_daily_job(
             data=data,
         )
 
-        logger.info(f"Daily job {job_name} added for {chat_id} at {time}")
-        logger.info("Next run at " + str(daily_job.next_t))
+        logger.info("Daily job %s added for %s at %s", job_name, chat_id, time)
+        logger.info("Next run at %s", daily_job.next_t)
 
 
 async def clear_cron_jobs(context: ContextTypes.DEFAULT_TYPE):
@@ -93,6 +93,10 @@ async def clear_cron_jobs(context: ContextTypes.DEFAULT_TYPE):
         await send_on_error_message(context)
         return
 
+    # Only this chat's jobs, the housekeeping jobs and other chats' jobs stay
+    chat_id = str(context.chat_data["chat_id"])
     for job in context.job_queue.jobs():
+        if str(job.chat_id) != chat_id:
+            continue
         job.schedule_removal()
-        logger.info(f"Job {job} removed")
+        logger.info("Job %s removed", job)
@@ -1,13 +1,109 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from os import getenv
+from typing import Optional
 
+# Set by the update_chat_data_state decorators, and attached to every record logged
+# while the handler runs
+log_chat_id: ContextVar[Optional[str]] = ContextVar("log_chat_id", default=None)
+log_state: ContextVar[Optional[str]] = ContextVar("log_state", default=None)
 
-def configure_logger():
-    # Enable logging
-    logging.basicConfig(
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        level=logging.INFO,
-    )
+# Fraction of DEBUG records that are kept, so hot-path logs can be enabled cheaply
+LOG_DEBUG_SAMPLE_RATE = float(getenv("LOG_DEBUG_SAMPLE_RATE") or "1")
+LOG_LEVEL = getenv("LOG_LEVEL") or "INFO"
+
+_EXTRA_FIELDS = ("chat_id", "state", "latency_ms")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class ContextFilter(logging.Filter):
+    """Attach the current chat_id and state to the record, and sample DEBUG records."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and random.random() >= LOG_DEBUG_SAMPLE_RATE:
+            return False
+
+        for field, var in (("chat_id", log_chat_id), ("state", log_state)):
+            if getattr(record, field, None) is None:
+                setattr(record, field, var.get())
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        log = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in _EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                log[field] = value
+        if record.exc_info:
+            log["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Formatted by StructuredQueueHandler before the record was queued
+            log["exc_info"] = record.exc_text
+        return json.dumps(log, ensure_ascii=False, default=str)
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler.prepare folds the traceback into msg and drops exc_info. This keeps
+    msg as the plain message and the traceback in exc_text, formatted as text since
+    traceback objects don't outlive the call that logged them.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def _start_listener() -> None:
+    """
+    Route all records through a queue so that handlers on the event loop never
+    block on I/O. Formatting and writing happen on the QueueListener's thread.
+    """
+    global _listener
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
 
     # set higher logging level for httpx to avoid all GET and POST requests being logged
     logging.getLogger("httpx").setLevel(logging.WARNING)
-    return logging.getLogger(__name__)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def configure_logger(name: str = __name__) -> logging.Logger:
+    if _listener is None:
+        _start_listener()
+    return logging.getLogger(name)
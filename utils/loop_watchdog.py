@@ -0,0 +1,102 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+from telegram.ext import Application
+from utils.constants import (
+    LOOP_WATCHDOG_ENABLED,
+    LOOP_WATCHDOG_INTERVAL_SECONDS,
+    LOOP_WATCHDOG_THRESHOLD_SECONDS,
+)
+from utils.logger_config import configure_logger
+from utils.metrics import Counter, Histogram
+
+logger = configure_logger(__name__)
+
+LOOP_LAG = Histogram(
+    "nova_event_loop_lag_seconds",
+    "How late the event loop woke up the watchdog's heartbeat.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOOP_BLOCKED = Counter(
+    "nova_event_loop_blocked_total",
+    "Times a callback held the event loop for longer than the watchdog threshold.",
+)
+
+_heartbeat_task: Optional[asyncio.Task] = None
+_monitor_thread: Optional[threading.Thread] = None
+_stop_event = threading.Event()
+_last_heartbeat = 0.0
+
+
+async def _heartbeat() -> None:
+    """Tick on the event loop, recording how late each tick was."""
+    global _last_heartbeat
+
+    while True:
+        _last_heartbeat = time.monotonic()
+        await asyncio.sleep(LOOP_WATCHDOG_INTERVAL_SECONDS)
+        LOOP_LAG.observe(
+            max(time.monotonic() - _last_heartbeat - LOOP_WATCHDOG_INTERVAL_SECONDS, 0)
+        )
+
+
+def _monitor(loop_thread_id: int) -> None:
+    """
+    Runs on its own thread. When the heartbeat stops for longer than the threshold,
+    whatever is holding the loop is still on the loop thread's stack, so capture it.
+    """
+    reported = False
+    while not _stop_event.wait(LOOP_WATCHDOG_INTERVAL_SECONDS):
+        blocked_for = time.monotonic() - _last_heartbeat - LOOP_WATCHDOG_INTERVAL_SECONDS
+        if blocked_for <= LOOP_WATCHDOG_THRESHOLD_SECONDS:
+            reported = False
+            continue
+        if reported:
+            # Only one report per stall
+            continue
+
+        reported = True
+        LOOP_BLOCKED.inc()
+        frame = sys._current_frames().get(loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else "No stack available"
+        logger.warning(
+            "Event loop blocked for more than %.2fs, currently at:\n%s",
+            blocked_for,
+            stack,
+        )
+
+
+async def start_loop_watchdog(application: Application) -> None:
+    global _heartbeat_task, _monitor_thread, _last_heartbeat
+
+    if not LOOP_WATCHDOG_ENABLED or _heartbeat_task is not None:
+        return
+
+    _stop_event.clear()
+    _last_heartbeat = time.monotonic()
+    _heartbeat_task = asyncio.create_task(_heartbeat())
+    _monitor_thread = threading.Thread(
+        target=_monitor,
+        args=(threading.get_ident(),),
+        name="loop_watchdog",
+        daemon=True,
+    )
+    _monitor_thread.start()
+    logger.info(
+        "Event loop watchdog started, threshold %.2fs", LOOP_WATCHDOG_THRESHOLD_SECONDS
+    )
+
+
+async def stop_loop_watchdog(application: Application) -> None:
+    global _heartbeat_task, _monitor_thread
+
+    _stop_event.set()
+    if _heartbeat_task is not None:
+        _heartbeat_task.cancel()
+        _heartbeat_task = None
+    if _monitor_thread is not None:
+        _monitor_thread.join(timeout=1)
+        _monitor_thread = None
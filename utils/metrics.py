@@ -0,0 +1,279 @@
+import asyncio
+import inspect
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+from typing import Dict, List, Optional, Sequence, Tuple
+from telegram.ext import Application
+from utils.constants import METRICS_HOST, METRICS_PORT
+from utils.logger_config import configure_logger
+
+logger = configure_logger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """The metric in the Prometheus text format, one line per entry."""
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = dict()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in values
+        ]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = dict()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (count per bucket (last one is +Inf), sum)
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = dict()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+
+        lines = self._header()
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+HANDLER_LATENCY = Histogram(
+    "nova_handler_latency_seconds", "Time spent in a bot handler.", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "nova_handler_errors_total", "Exceptions raised by a bot handler.", ["handler"]
+)
+HANDLER_IN_FLIGHT = Gauge(
+    "nova_handler_in_flight", "Bot handlers currently running.", ["handler"]
+)
+EXTERNAL_CALL_LATENCY = Histogram(
+    "nova_external_call_latency_seconds",
+    "Time spent in a call to Google or the backend.",
+    ["service", "operation"],
+)
+EXTERNAL_CALL_ERRORS = Counter(
+    "nova_external_call_errors_total",
+    "Failed calls to Google or the backend.",
+    ["service", "operation"],
+)
+EXTERNAL_CALL_IN_FLIGHT = Gauge(
+    "nova_external_call_in_flight",
+    "Calls to Google or the backend currently running.",
+    ["service", "operation"],
+)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def track_external_call(service: str, operation: str):
+    """Record latency, errors and in-flight calls of a sync or async client function."""
+
+    def decorator(func):
+        labels = {"service": service, "operation": operation}
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                EXTERNAL_CALL_IN_FLIGHT.inc(**labels)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    EXTERNAL_CALL_ERRORS.inc(**labels)
+                    raise
+                finally:
+                    EXTERNAL_CALL_LATENCY.observe(time.perf_counter() - start, **labels)
+                    EXTERNAL_CALL_IN_FLIGHT.dec(**labels)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            EXTERNAL_CALL_IN_FLIGHT.inc(**labels)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                EXTERNAL_CALL_ERRORS.inc(**labels)
+                raise
+            finally:
+                EXTERNAL_CALL_LATENCY.observe(time.perf_counter() - start, **labels)
+                EXTERNAL_CALL_IN_FLIGHT.dec(**labels)
+
+        return wrapper
+
+    return decorator
+
+
+_metrics_server: Optional[asyncio.AbstractServer] = None
+
+
+async def _handle_metrics_request(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the request headers
+        while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else ""
+        if path.split("?")[0] == "/metrics":
+            status = "200 OK"
+            body = render_metrics().encode()
+        else:
+            status = "404 Not Found"
+            body = b"Not Found\n"
+
+        writer.write(
+            (
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode()
+            + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(application: Application) -> None:
+    global _metrics_server
+
+    if METRICS_PORT <= 0:
+        return
+
+    _metrics_server = await asyncio.start_server(
+        _handle_metrics_request, METRICS_HOST, METRICS_PORT
+    )
+    logger.info("Serving /metrics on %s:%d", METRICS_HOST, METRICS_PORT)
+
+
+async def stop_metrics_server(application: Application) -> None:
+    global _metrics_server
+
+    if _metrics_server is not None:
+        _metrics_server.close()
+        await _metrics_server.wait_closed()
+        _metrics_server = None
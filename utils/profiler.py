@@ -0,0 +1,55 @@
+import sys
+import threading
+import time
+from collections import Counter
+from os.path import basename
+from types import FrameType
+from typing import Dict, List, Optional
+
+_profiling_lock = threading.Lock()
+
+
+def _collapse_stack(thread_name: str, frame: Optional[FrameType]) -> str:
+    frames: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    # Collapsed stacks go from the root to the leaf
+    return ";".join(reversed(frames))
+
+
+def sample_stacks(duration: float, interval: float) -> Dict[str, int]:
+    """
+    Sample the stacks of all other threads every interval seconds for duration seconds.
+    Returns how many times each collapsed stack was seen.
+
+    Only one profile can run at a time, raises RuntimeError if one is already running.
+    """
+    if not _profiling_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+
+    try:
+        own_thread_id = threading.get_ident()
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                stacks[_collapse_stack(thread_name, frame)] += 1
+            time.sleep(interval)
+        return dict(stacks)
+    finally:
+        _profiling_lock.release()
+
+
+def format_collapsed_stacks(stacks: Dict[str, int]) -> str:
+    """Format stacks in the collapsed format read by flamegraph.pl and speedscope."""
+    return "\n".join(
+        f"{stack} {count}"
+        for stack, count in sorted(stacks.items(), key=lambda item: item[1], reverse=True)
+    )
@@ -0,0 +1,191 @@
+from contextvars import ContextVar, Token
+from datetime import date, datetime, time
+from typing import Any, Dict, List, Optional
+from utils.constants import NEW_YORK_TIMEZONE_INFO
+
+
+def _parse_window_bound(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # Naive and aware datetimes can't be compared, so only aware bounds are used
+    return parsed if parsed.tzinfo is not None else None
+
+
+def _parse_event_timing(timing: Dict[str, Any]) -> Optional[datetime]:
+    if timing.get("dateTime"):
+        return datetime.fromisoformat(timing["dateTime"])
+    if timing.get("date"):
+        return NEW_YORK_TIMEZONE_INFO.localize(
+            datetime.combine(date.fromisoformat(timing["date"]), time())
+        )
+    return None
+
+
+def _overlaps(event: Dict[str, Any], time_min: datetime, time_max: datetime) -> bool:
+    """Same rule as events.list: the event ends after time_min and starts before time_max."""
+    start = _parse_event_timing(event.get("start") or dict())
+    end = _parse_event_timing(event.get("end") or dict())
+    if start is None or end is None:
+        return False
+    return end > time_min and start < time_max
+
+
+class CachedEventWindow:
+    def __init__(
+        self,
+        refresh_token: str,
+        q: Optional[str],
+        time_min: Optional[str],
+        time_max: Optional[str],
+        k: int,
+        events: List[Dict[str, Any]],
+    ):
+        self.refresh_token = refresh_token
+        self.q = q
+        self.time_min = time_min
+        self.time_max = time_max
+        self.k = k
+        self.events = list(events)
+        # Whether events holds every event in the window, rather than only the first k
+        self.complete = len(events) < k
+        self.time_min_dt = _parse_window_bound(time_min)
+        self.time_max_dt = _parse_window_bound(time_max)
+
+    def serve(
+        self,
+        refresh_token: str,
+        q: Optional[str],
+        time_min: Optional[str],
+        time_max: Optional[str],
+        k: int,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """The events for the requested window, if they can be answered from this one."""
+        if refresh_token != self.refresh_token or q != self.q:
+            return None
+
+        if time_min == self.time_min and time_max == self.time_max:
+            if k <= self.k or self.complete:
+                return self.events[:k]
+            return None
+
+        # A sub-window can be served by filtering, as long as nothing was cut off by k
+        if q is not None or not self.complete:
+            return None
+        requested_min = _parse_window_bound(time_min)
+        requested_max = _parse_window_bound(time_max)
+        if (
+            requested_min is None
+            or requested_max is None
+            or self.time_min_dt is None
+            or self.time_max_dt is None
+            or requested_min < self.time_min_dt
+            or requested_max > self.time_max_dt
+        ):
+            return None
+
+        return [
+            event for event in self.events if _overlaps(event, requested_min, requested_max)
+        ][:k]
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        if self.q is not None or self.time_min_dt is None or self.time_max_dt is None:
+            return
+        if event.get("id"):
+            # A retried insert returns the event that is already there
+            self.events = [
+                existing for existing in self.events if existing.get("id") != event["id"]
+            ]
+        if not _overlaps(event, self.time_min_dt, self.time_max_dt):
+            return
+
+        start = _parse_event_timing(event.get("start") or dict())
+        index = len(self.events)
+        for i, existing in enumerate(self.events):
+            existing_start = _parse_event_timing(existing.get("start") or dict())
+            if start is not None and existing_start is not None and start < existing_start:
+                index = i
+                break
+        if not self.complete and index == len(self.events):
+            # The event could be past the k events that were fetched, leave it out
+            return
+        self.events.insert(index, event)
+
+
+class RequestScope:
+    """
+    Memoizes user and calendar reads for the duration of one update or job, so that
+    every handler in one interaction sees the same snapshot. Calendar writes made
+    during the interaction are applied to the cached windows.
+    """
+
+    def __init__(self):
+        self.users: Dict[str, Dict[str, Any]] = dict()
+        self.event_windows: List[CachedEventWindow] = []
+        # Set when Google was unreachable and events came from an older read
+        self.served_stale_events = False
+
+    def get_events(
+        self,
+        refresh_token: str,
+        q: Optional[str],
+        time_min: Optional[str],
+        time_max: Optional[str],
+        k: int,
+    ) -> Optional[List[Dict[str, Any]]]:
+        for window in self.event_windows:
+            events = window.serve(refresh_token, q, time_min, time_max, k)
+            if events is not None:
+                return events
+        return None
+
+    def put_events(
+        self,
+        refresh_token: str,
+        q: Optional[str],
+        time_min: Optional[str],
+        time_max: Optional[str],
+        k: int,
+        events: List[Dict[str, Any]],
+    ) -> None:
+        self.event_windows.append(
+            CachedEventWindow(refresh_token, q, time_min, time_max, k, events)
+        )
+
+    def add_event(self, refresh_token: str, event: Dict[str, Any]) -> None:
+        for window in self.event_windows:
+            if window.refresh_token == refresh_token:
+                window.add_event(event)
+        # Searches can't be updated locally
+        self.event_windows = [
+            window
+            for window in self.event_windows
+            if window.refresh_token != refresh_token or window.q is None
+        ]
+
+    def invalidate_events(self, refresh_token: str) -> None:
+        self.event_windows = [
+            window for window in self.event_windows if window.refresh_token != refresh_token
+        ]
+
+
+request_scope: ContextVar[Optional[RequestScope]] = ContextVar("request_scope", default=None)
+
+
+def get_request_scope() -> Optional[RequestScope]:
+    return request_scope.get()
+
+
+def enter_request_scope() -> Optional[Token]:
+    """Start a scope unless one is already active. Returns the token to pass to exit_request_scope."""
+    if request_scope.get() is not None:
+        return None
+    return request_scope.set(RequestScope())
+
+
+def exit_request_scope(token: Optional[Token]) -> None:
+    if token is not None:
+        request_scope.reset(token)
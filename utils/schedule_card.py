@@ -0,0 +1,146 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Optional
+from telegram import InlineKeyboardMarkup, Update
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+from utils.constants import NEW_YORK_TIMEZONE_INFO
+from utils.logger_config import configure_logger
+from utils.utils import send_message
+
+logger = configure_logger(__name__)
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _markup_hash(reply_markup: Optional[InlineKeyboardMarkup]) -> str:
+    markup_json = json.dumps(reply_markup.to_dict(), sort_keys=True) if reply_markup else ""
+    return hashlib.sha1(markup_json.encode()).hexdigest()
+
+
+def _render(body: str, footer: Optional[str]) -> str:
+    return "\n\n".join(part for part in (body, footer) if part)
+
+
+def _today() -> str:
+    return datetime.now(tz=NEW_YORK_TIMEZONE_INFO).date().isoformat()
+
+
+async def _send_card(
+    update: Update | None,
+    context: ContextTypes.DEFAULT_TYPE,
+    body: str,
+    footer: Optional[str],
+    reply_markup: Optional[InlineKeyboardMarkup],
+) -> None:
+    if context.chat_data is None:
+        return
+
+    rendered = _render(body, footer)
+    message = await send_message(update, context, rendered, reply_markup=reply_markup)
+    if message is None:
+        return
+
+    context.chat_data["schedule_card"] = {
+        "chat_id": message.chat_id,
+        "message_id": message.message_id,
+        "date": _today(),
+        "body": body,
+        "text_hash": _text_hash(rendered),
+        "markup_hash": _markup_hash(reply_markup),
+    }
+
+
+async def send_schedule_card(
+    update: Update | None,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+) -> None:
+    """
+    Send a new schedule card and remember it in chat_data["schedule_card"],
+    so that later steps of the flow can edit it instead of sending new messages.
+    """
+    await _send_card(update, context, text, None, reply_markup)
+
+
+def use_callback_message_as_card(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Make the message whose button was tapped the schedule card, for flows like the
+    block alerts whose edit cycle starts on a message other than the last schedule.
+    """
+    if context.chat_data is None or update.callback_query is None:
+        return
+    message = update.callback_query.message
+    if message is None or not message.text:
+        return
+
+    context.chat_data["schedule_card"] = {
+        "chat_id": message.chat_id,
+        "message_id": message.message_id,
+        "date": _today(),
+        "body": message.text,
+        "text_hash": _text_hash(message.text),
+        "markup_hash": _markup_hash(message.reply_markup),
+    }
+
+
+async def edit_schedule_card(
+    update: Update | None,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: Optional[str] = None,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    footer: Optional[str] = None,
+) -> None:
+    """
+    Edit the last schedule card in place. text replaces the card's body (the
+    current body is kept if None), and footer is appended below the body.
+
+    Skips the edit if the rendered content is unchanged, and falls back to
+    sending a new card if there is no card from today or it can't be edited.
+    Schedules too long for one message are always sent as a new card.
+    """
+    if context.chat_data is None:
+        return
+
+    card = context.chat_data.get("schedule_card")
+    if card and card.get("date") != _today():
+        card = None
+    body = text if text is not None else (card["body"] if card else "")
+    if not card or len(_render(body, footer)) > MessageLimit.MAX_TEXT_LENGTH:
+        # Schedules over the length limit are sent in chunks, which can't be edited in place
+        await _send_card(update, context, body, footer, reply_markup)
+        return
+
+    text_hash = _text_hash(_render(body, footer))
+    markup_hash = _markup_hash(reply_markup)
+    if text_hash == card["text_hash"] and markup_hash == card["markup_hash"]:
+        return
+
+    try:
+        if text_hash == card["text_hash"]:
+            await context.bot.edit_message_reply_markup(
+                chat_id=card["chat_id"],
+                message_id=card["message_id"],
+                reply_markup=reply_markup,
+            )
+        else:
+            await context.bot.edit_message_text(
+                _render(body, footer),
+                chat_id=card["chat_id"],
+                message_id=card["message_id"],
+                reply_markup=reply_markup,
+            )
+    except BadRequest as e:
+        if "not modified" not in e.message.lower():
+            logger.info("Could not edit schedule card, sending a new one: %s", e.message)
+            await _send_card(update, context, body, footer, reply_markup)
+            return
+
+    card["body"] = body
+    card["text_hash"] = text_hash
+    card["markup_hash"] = markup_hash
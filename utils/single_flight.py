@@ -0,0 +1,65 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+from utils.logger_config import configure_logger
+from utils.metrics import Counter
+
+logger = configure_logger(__name__)
+
+SINGLE_FLIGHT_CALLS = Counter(
+    "nova_single_flight_calls_total",
+    "Calls through a single-flight group, by whether they ran or joined one in flight.",
+    ["group", "outcome"],
+)
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller runs
+    the function, and callers that arrive while it is running wait for it and get
+    its result, or its exception. Nothing is cached once the call is done.
+
+    Every caller gets the same object, so callers that modify the result should
+    pass a copy function.
+    """
+
+    def __init__(self, name: str, copy: Callable[[Any], Any] = lambda result: result):
+        self.name = name
+        self._copy = copy
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = dict()
+
+    def do(self, key: Hashable, func: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            SINGLE_FLIGHT_CALLS.inc(group=self.name, outcome="joined")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return self._copy(call.result)
+
+        SINGLE_FLIGHT_CALLS.inc(group=self.name, outcome="ran")
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return self._copy(call.result)
@@ -0,0 +1,349 @@
+from bisect import bisect_left, insort
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from lib.api_handler import Task, get_backlog_tasks
+from lib.google_cal import (
+    CalendarWriteMethod,
+    CalendarWriteOp,
+    NovaEvent,
+    batch_calendar_writes,
+    build_calendar_item,
+    find_next_available_time_slot,
+    get_calendar_events,
+    make_event_id,
+)
+from lib.outbox import (
+    OutboxKind,
+    enqueue_calendar_item_sync,
+    enqueue_mutation_sync,
+    get_pending_added_task_ids,
+)
+from utils.circuit_breaker import CircuitOpenError
+from utils.constants import (
+    DAY_END_TIME,
+    DAY_START_TIME,
+    NEW_YORK_TIMEZONE_INFO,
+    TASK_MIN_CHUNK_MINUTES,
+)
+from utils.logger_config import configure_logger
+
+logger = configure_logger(__name__)
+
+Interval = Tuple[datetime, datetime]
+
+
+class TaskPlacement(NamedTuple):
+    task: Task
+    start: datetime
+    end: datetime
+    # A task split across several gaps has one placement per chunk
+    chunk_index: int = 0
+    chunk_count: int = 1
+
+
+def get_busy_intervals(events: Sequence[Dict[str, Any]]) -> List[Interval]:
+    """The timed events as sorted intervals, with overlapping ones merged."""
+    # All-day events don't block time
+    intervals = sorted(
+        (
+            datetime.fromisoformat(event["start"]["dateTime"]),
+            datetime.fromisoformat(event["end"]["dateTime"]),
+        )
+        for event in events
+        if event.get("start", dict()).get("dateTime") and event.get("end", dict()).get("dateTime")
+    )
+    merged: List[Interval] = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def get_free_gaps(
+    busy_intervals: Sequence[Interval], window_start: datetime, window_end: datetime
+) -> List[Interval]:
+    """The free time in the window, given sorted and merged busy intervals."""
+    gaps: List[Interval] = []
+    cursor = window_start
+    for start, end in busy_intervals:
+        if end <= cursor:
+            continue
+        if start >= window_end:
+            break
+        if start > cursor:
+            gaps.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < window_end:
+        gaps.append((cursor, window_end))
+    return gaps
+
+
+def find_task_chunks(
+    free_gaps: Sequence[Interval], duration: timedelta, min_chunk: timedelta
+) -> Optional[List[Interval]]:
+    """
+    Split duration across the chronologically sorted free gaps, earliest first,
+    in chunks of at least min_chunk. Returns None if the gaps can't hold it all.
+    """
+    min_chunk = min(min_chunk, duration)
+    chosen: List[Interval] = []
+    capacity = timedelta(0)
+    for start, end in free_gaps:
+        if end - start < min_chunk:
+            continue
+        chosen.append((start, end))
+        capacity += end - start
+        while capacity >= duration and min_chunk * len(chosen) > duration:
+            # Too many chunks to each be min_chunk long, so give up the shortest gap
+            shortest = min(chosen, key=lambda gap: gap[1] - gap[0])
+            chosen.remove(shortest)
+            capacity -= shortest[1] - shortest[0]
+        if capacity < duration:
+            continue
+
+        # Every chunk gets min_chunk, and the rest fills the earliest gaps first
+        extra = duration - min_chunk * len(chosen)
+        chunks: List[Interval] = []
+        for gap_start, gap_end in chosen:
+            length = min_chunk + min(gap_end - gap_start - min_chunk, extra)
+            extra -= length - min_chunk
+            chunks.append((gap_start, gap_start + length))
+        return chunks
+    return None
+
+
+def _get_deadline(task: Task, today: date) -> date:
+    """MMDD deadlines have no year, so one more than half a year ago is taken to be next year's."""
+    deadline = task.get("deadline") or ""
+    try:
+        day = datetime.strptime(str(today.year) + deadline, "%Y%m%d").date()
+    except ValueError:
+        return date.max
+    if day < today - timedelta(days=183):
+        day = day.replace(year=today.year + 1)
+    return day
+
+
+def plan_task_placements(
+    tasks: Sequence[Task],
+    free_gaps: Sequence[Interval],
+    today: Optional[date] = None,
+    min_chunk: Optional[timedelta] = None,
+) -> Tuple[List[TaskPlacement], List[Task]]:
+    """
+    Place tasks into the free gaps, earliest deadline first, each into the smallest
+    gap that fits it (best fit), which leaves the large gaps for the long tasks.
+    With min_chunk, a task that fits no single gap is split across several.
+    Returns the placements in chronological order, and the tasks that didn't fit.
+    """
+    today = today or datetime.now(tz=NEW_YORK_TIMEZONE_INFO).date()
+    # (length, start), kept sorted so the best fit is found by bisection
+    gaps = sorted((end - start, start) for start, end in free_gaps)
+    placements: List[TaskPlacement] = []
+    unplaced: List[Task] = []
+
+    # Among tasks due the same day, longer ones are harder to fit so go first
+    ordered_tasks = sorted(
+        tasks, key=lambda task: (_get_deadline(task, today), -int(task.get("duration") or 0))
+    )
+    for task in ordered_tasks:
+        duration = timedelta(minutes=int(task.get("duration") or 0))
+        if duration <= timedelta(0):
+            unplaced.append(task)
+            continue
+
+        i = bisect_left(gaps, (duration,))
+        if i == len(gaps):
+            chunks = (
+                find_task_chunks(
+                    sorted((start, start + length) for length, start in gaps),
+                    duration,
+                    min_chunk,
+                )
+                if min_chunk is not None
+                else None
+            )
+            if chunks is None:
+                unplaced.append(task)
+                continue
+
+            # Chunks are taken from the start of their gaps
+            used = {start: end - start for start, end in chunks}
+            remaining_gaps = []
+            for length, start in gaps:
+                if start in used:
+                    if length > used[start]:
+                        remaining_gaps.append((length - used[start], start + used[start]))
+                else:
+                    remaining_gaps.append((length, start))
+            gaps = sorted(remaining_gaps)
+            placements.extend(
+                TaskPlacement(task, start, end, chunk_index, len(chunks))
+                for chunk_index, (start, end) in enumerate(chunks)
+            )
+            continue
+
+        length, start = gaps.pop(i)
+        placements.append(TaskPlacement(task, start, start + duration))
+        if length > duration:
+            insort(gaps, (length - duration, start + duration))
+
+    placements.sort(key=lambda placement: placement.start)
+    return placements, unplaced
+
+
+def schedule_task_backlog(
+    *,
+    user_id: str,
+    refresh_token: str,
+    events: Sequence[Dict[str, Any]],
+    window_start: datetime,
+    window_end: datetime,
+) -> List[Dict[str, Any]]:
+    """
+    Plan the user's backlog into the free time between the events in the window,
+    write the placements in one calendar batch and mark the tasks as added.
+    Returns the calendar items that were written or queued.
+    """
+    # Tasks placed by an earlier run are only marked as added once the outbox sends it
+    pending_added_task_ids = get_pending_added_task_ids(user_id)
+    tasks = [task for task in get_backlog_tasks(user_id) if task["id"] not in pending_added_task_ids]
+    if not tasks:
+        return []
+
+    free_gaps = get_free_gaps(get_busy_intervals(events), window_start, window_end)
+    placements, unplaced = plan_task_placements(
+        tasks, free_gaps, min_chunk=timedelta(minutes=TASK_MIN_CHUNK_MINUTES)
+    )
+    if unplaced:
+        logger.info("%d of %d backlog tasks didn't fit", len(unplaced), len(tasks))
+    if not placements:
+        return []
+
+    items = write_task_placements(
+        user_id=user_id, refresh_token=refresh_token, placements=placements
+    )
+
+    # Every chunk is on the calendar or queued, so each placed task counts as added
+    for placement, item in zip(placements, items):
+        if placement.chunk_index == 0:
+            task_id = placement.task["id"]
+            enqueue_mutation_sync(
+                OutboxKind.MARK_TASK_AS_ADDED,
+                user_id,
+                {"task_id": task_id},
+                # Keyed on the placement, so a task that was un-added and placed again
+                # is marked again rather than ignored as a duplicate
+                idempotency_key=f"mark_task_as_added:{task_id}:{item['id']}",
+            )
+    return items
+
+
+def write_task_placements(
+    *,
+    user_id: str,
+    refresh_token: str,
+    placements: Sequence[TaskPlacement],
+) -> List[Dict[str, Any]]:
+    """
+    Write the placements as task events in one calendar batch. The chunks of a
+    split task share its task_id in extendedProperties.private. Chunks that couldn't
+    be written are queued on the outbox. Returns each placement's calendar item.
+    """
+    extra_details = []
+    for placement in placements:
+        extra_details_dict = {
+            "task_id": placement.task["id"],
+            "deadline": placement.task.get("deadline") or "",
+        }
+        if placement.chunk_count > 1:
+            extra_details_dict["chunk"] = f"{placement.chunk_index + 1}/{placement.chunk_count}"
+        extra_details.append(extra_details_dict)
+    event_ids = [
+        make_event_id(
+            user_id, NovaEvent.TASK.value, placement.task["id"], placement.start, placement.end
+        )
+        for placement in placements
+    ]
+    items = [
+        build_calendar_item(
+            summary=placement.task["name"],
+            start_time=placement.start,
+            end_time=placement.end,
+            event_type=NovaEvent.TASK,
+            extra_details_dict=extra_details_dict,
+            event_id=event_id,
+        )
+        for placement, extra_details_dict, event_id in zip(placements, extra_details, event_ids)
+    ]
+
+    try:
+        results = batch_calendar_writes(
+            refresh_token=refresh_token,
+            ops=[CalendarWriteOp(method=CalendarWriteMethod.INSERT, body=item) for item in items],
+        )
+    except CircuitOpenError:
+        # Google is down, so the outbox adds them once it is back
+        results = None
+
+    # Failed chunks are retried by the outbox, with the same ids so they can't be added twice
+    for i, (placement, extra_details_dict, event_id) in enumerate(
+        zip(placements, extra_details, event_ids)
+    ):
+        if results is not None and results[i].error is None:
+            continue
+        enqueue_calendar_item_sync(
+            user_id=user_id,
+            summary=placement.task["name"],
+            start_time=placement.start,
+            end_time=placement.end,
+            event_type=NovaEvent.TASK,
+            extra_details_dict=extra_details_dict,
+            event_id=event_id,
+        )
+    return items
+
+
+def find_task_time_slots(
+    *,
+    refresh_token: str,
+    time_min: datetime,
+    time_max: datetime,
+    duration_minutes: int,
+) -> Optional[List[Interval]]:
+    """
+    One slot for the task between time_min and time_max if there is one, otherwise
+    chunks of at least TASK_MIN_CHUNK_MINUTES across the day's free gaps.
+    """
+    time_slot = find_next_available_time_slot(
+        refresh_token=refresh_token,
+        time_min=time_min,
+        time_max=time_max,
+        event_duration_minutes=duration_minutes,
+    )
+    if time_slot is not None:
+        return [time_slot]
+
+    # Served from the request scope, find_next_available_time_slot read the same window
+    events = get_calendar_events(
+        refresh_token=refresh_token,
+        timeMin=time_min.isoformat(),
+        timeMax=time_max.isoformat(),
+        k=500,
+    )
+    day = time_min.date()
+    window_start = max(
+        time_min,
+        NEW_YORK_TIMEZONE_INFO.localize(datetime.combine(day, DAY_START_TIME.replace(tzinfo=None))),
+    )
+    window_end = min(
+        time_max,
+        NEW_YORK_TIMEZONE_INFO.localize(datetime.combine(day, DAY_END_TIME.replace(tzinfo=None))),
+    )
+    return find_task_chunks(
+        get_free_gaps(get_busy_intervals(events), window_start, window_end),
+        timedelta(minutes=duration_minutes),
+        timedelta(minutes=TASK_MIN_CHUNK_MINUTES),
+    )
@@ -5,7 +5,7 @@ from utils.constants import READYMADE_RESPONSES
 from utils.logger_config import configure_logger
 from utils.utils import send_message, update_chat_data_state
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 @update_chat_data_state
@@ -1,9 +1,10 @@
+import asyncio
 from telegram.ext import ContextTypes
 from utils.add_night_flow import add_night_flow
 from utils.logger_config import configure_logger
 from utils.utils import send_on_error_message
 
-logger = configure_logger()
+logger = configure_logger(__name__)
 
 
 async def update_cron_jobs(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -12,14 +13,22 @@ async def update_cron_jobs(context: ContextTypes.DEFAULT_TYPE) -> None:
         await send_on_error_message(context)
         return
 
+    from lib.api_handler import get_user
     from utils.add_block_flows import add_block_flows
     from utils.add_morning_flow import add_morning_flow
+    from utils.credential_health_check import has_revoked_google_grant
     from utils.job_queue import clear_cron_jobs
 
     await clear_cron_jobs(context)
 
-    await add_morning_flow(context)
+    # The calendar jobs would only fail until the user logs in to Google again
+    user = await asyncio.to_thread(get_user, context.chat_data["chat_id"])
+    calendar_jobs_enabled = not has_revoked_google_grant(context.chat_data, user)
+
+    if calendar_jobs_enabled:
+        await add_morning_flow(context)
 
     await add_night_flow(context)
 
-    await add_block_flows(context)
+    if calendar_jobs_enabled:
+        await add_block_flows(context)
@@ -0,0 +1,35 @@
+import asyncio
+from datetime import date, datetime, time, timedelta
+from telegram.ext import Application, ContextTypes
+from lib.api_handler import get_users
+from lib.persistence import get_known_chat_ids
+from utils.constants import DAY_START_TIME, NIGHT_FLOW_TIME, USER_PRELOAD_LEAD_SECONDS
+from utils.logger_config import configure_logger
+
+logger = configure_logger(__name__)
+
+
+async def preload_users(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Load every chat's user in bulk, so the jobs that are about to run don't each fetch one."""
+    chat_ids = [str(chat_id) for chat_id in await get_known_chat_ids(context.application)]
+    users = await asyncio.to_thread(get_users, chat_ids)
+    logger.info("Preloaded %d of %d users", len(users), len(chat_ids))
+
+
+def _before(flow_time: time) -> time:
+    return (
+        datetime.combine(date.today(), flow_time) - timedelta(seconds=USER_PRELOAD_LEAD_SECONDS)
+    ).timetz()
+
+
+def add_user_preload(application: Application) -> None:
+    if application.job_queue is None:
+        logger.error("application.job_queue is None for add_user_preload")
+        return
+
+    for flow_time, name in ((DAY_START_TIME, "morning"), (NIGHT_FLOW_TIME, "night")):
+        application.job_queue.run_daily(
+            preload_users,
+            _before(flow_time),
+            name=f"daily_preload_users_{name}",
+        )
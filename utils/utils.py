@@ -1,16 +1,54 @@
+import time
 from functools import wraps
 from telegram import (
+    Message,
     Update,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
     ForceReply,
 )
+from telegram.constants import MessageLimit
 from telegram.ext import ContextTypes
-from utils.logger_config import configure_logger
-from typing import Optional, Union, Literal
-
-logger = configure_logger()
+from utils.chat_data_janitor import touch_chat_data
+from utils.google_quota import CallPriority, google_call_priority
+from utils.logger_config import configure_logger, log_chat_id, log_state
+from utils.metrics import HANDLER_ERRORS, HANDLER_IN_FLIGHT, HANDLER_LATENCY
+from utils.request_scope import enter_request_scope, exit_request_scope
+from typing import List, Optional, Union, Literal
+
+logger = configure_logger(__name__)
+
+
+async def _run_handler(func, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+    """
+    Run a handler with its chat_id and state (its name) attached to every log record.
+    The outermost handler of an update or job also opens its request scope.
+    """
+    scope_token = enter_request_scope()
+    tokens = (
+        log_chat_id.set((context.chat_data or dict()).get("chat_id")),
+        log_state.set(func.__name__),
+    )
+    HANDLER_IN_FLIGHT.inc(handler=func.__name__)
+    start = time.perf_counter()
+    try:
+        return await func(*args, **kwargs)
+    except Exception:
+        HANDLER_ERRORS.inc(handler=func.__name__)
+        raise
+    finally:
+        latency = time.perf_counter() - start
+        HANDLER_LATENCY.observe(latency, handler=func.__name__)
+        HANDLER_IN_FLIGHT.dec(handler=func.__name__)
+        logger.debug(
+            "%s done",
+            func.__name__,
+            extra={"latency_ms": round(latency * 1000, 1)},
+        )
+        for var, token in zip((log_chat_id, log_state), tokens):
+            var.reset(token)
+        exit_request_scope(scope_token)
 
 
 def update_chat_data_state(func):
@@ -19,12 +57,13 @@ def update_chat_data_state(func):
         update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs
     ):
         if context.chat_data is None:
-            logger.error(f"context.chat_data is None for {func.__name__}")
+            logger.error("context.chat_data is None for %s", func.__name__)
             await send_on_error_message(context)
             return
         context.chat_data["state"] = func.__name__
+        touch_chat_data(context.chat_data)
 
-        return await func(update, context, *args, **kwargs)
+        return await _run_handler(func, context, update, context, *args, **kwargs)
 
     return wrapper
 
@@ -33,12 +72,18 @@ def update_chat_data_state_context(func):
     @wraps(func)
     async def wrapper(context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         if context.chat_data is None:
-            logger.error(f"context.chat_data is None for {func.__name__}")
+            logger.error("context.chat_data is None for %s", func.__name__)
             await send_on_error_message(context)
             return
         context.chat_data["state"] = func.__name__
+        touch_chat_data(context.chat_data)
 
-        return await func(context, *args, **kwargs)
+        # Jobs like the morning flow fire in bursts, so they yield the Google quota to handlers
+        priority_token = google_call_priority.set(CallPriority.BACKGROUND)
+        try:
+            return await _run_handler(func, context, context, *args, **kwargs)
+        finally:
+            google_call_priority.reset(priority_token)
 
     return wrapper
 
@@ -53,33 +98,77 @@ async def send_message(
     | ForceReply
     | None = None,
     parse_mode: str | None = None
-):
+) -> Optional[Message]:
+    """
+    Send text as a reply, or to the job's chat. Text over Telegram's length limit
+    is split across several messages, with reply_markup attached to the last one.
+    """
+    chunks = split_message_text(text)
+    for chunk in chunks[:-1]:
+        await _send_message(update, context, chunk, None, parse_mode)
+    return await _send_message(update, context, chunks[-1], reply_markup, parse_mode)
+
+
+def split_message_text(text: str, limit: int = MessageLimit.MAX_TEXT_LENGTH) -> List[str]:
+    """Split text into chunks of at most limit characters, preferring line breaks."""
+    if len(text) <= limit:
+        return [text]
+
+    chunks: List[str] = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if not current:
+            current = line
+        elif len(current) + 1 + len(line) <= limit:
+            current += "\n" + line
+        else:
+            chunks.append(current)
+            current = line
+    chunks.append(current)
+    return chunks
+
+
+async def _send_message(
+    update: Update | None,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    reply_markup: InlineKeyboardMarkup
+    | ReplyKeyboardMarkup
+    | ReplyKeyboardRemove
+    | ForceReply
+    | None,
+    parse_mode: str | None,
+) -> Optional[Message]:
     if update is not None and update.message is not None:
-        await update.message.reply_text(
+        return await update.message.reply_text(
             text, reply_markup=reply_markup, parse_mode=parse_mode
         )
-        return
 
     if update is not None and update.effective_message is not None:
-        await update.effective_message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
-        return
+        return await update.effective_message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
 
     if (
         update is not None
         and update.callback_query is not None
         and update.callback_query.message is not None
     ):
-        await update.callback_query.message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
-        return
+        return await update.callback_query.message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
 
     if context.job is not None and context.job.chat_id is not None:
-        await context.bot.send_message(
+        return await context.bot.send_message(
             context.job.chat_id,
             text=text,
             reply_markup=reply_markup,
             parse_mode=parse_mode
         )
-        return
+
+    return None
 
 
 async def send_on_error_message(context: ContextTypes.DEFAULT_TYPE) -> None: